@@ -0,0 +1,130 @@
+"""Writing activity from the daily_user_activity rollups
+
+Every story write adds or takes away its share of one row per user, day
+and genre (stories started, words written), in the same transaction as
+the write. The dashboard reads those rows for the last WINDOW_DAYS days
+and never touches the stories, so it costs the same for a user with ten
+stories as for one with ten thousand. Days are UTC, like the stories'
+timestamps.
+
+The helpers here turn rollup rows into the dashboard's views: a calendar
+heatmap, weekly totals, the genre mix per month and writing streaks.
+The `activity_backfill` maintenance job recomputes the rows from the
+stories, which fills them in on databases from before the rollups.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+WINDOW_DAYS = 371  # 53 weeks, the width of the heatmap
+TREND_WEEKS = 26
+MIX_MONTHS = 12
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def daily_totals(rows: Iterable[Dict]) -> Dict[date, Dict[str, int]]:
+    """Stories and words per day, all genres together"""
+    days: Dict[date, Dict[str, int]] = defaultdict(lambda: {'stories': 0, 'words': 0})
+    for row in rows:
+        day = days[date.fromisoformat(row['day'])]
+        day['stories'] += row['stories']
+        day['words'] += row['words']
+    return dict(days)
+
+
+def streaks(days: Dict[date, Dict[str, int]], until: Optional[date] = None) -> Tuple[int, int]:
+    """(current, longest) runs of consecutive days with words written
+
+    The current streak still counts if nothing has been written yet today.
+    Both are limited to the days in the window.
+    """
+    until = until or today()
+    active = sorted(day for day, totals in days.items() if totals['words'] > 0 and day <= until)
+    longest = run = 0
+    previous = None
+    for day in active:
+        run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    current = run if previous is not None and until - previous <= timedelta(days=1) else 0
+    return current, longest
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def weekly_totals(days: Dict[date, Dict[str, int]], weeks: int = TREND_WEEKS,
+                  until: Optional[date] = None) -> List[Dict]:
+    """Stories and words per week (Monday first) for the last weeks weeks, empty weeks included"""
+    last = week_start(until or today())
+    starts = [last - timedelta(weeks=n) for n in range(weeks - 1, -1, -1)]
+    totals = {start: {'week': start.isoformat(), 'stories': 0, 'words': 0} for start in starts}
+    for day, day_totals in days.items():
+        week = totals.get(week_start(day))
+        if week is not None:
+            week['stories'] += day_totals['stories']
+            week['words'] += day_totals['words']
+    return [totals[start] for start in starts]
+
+
+def genre_mix(rows: Iterable[Dict], months: int = MIX_MONTHS, until: Optional[date] = None) -> Dict[str, Dict[str, int]]:
+    """Words per genre for each of the last months months: {month: {genre: words}}, oldest first"""
+    until = until or today()
+    keys = []
+    year, month = until.year, until.month
+    for _ in range(months):
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    mix: Dict[str, Dict[str, int]] = {key: defaultdict(int) for key in reversed(keys)}
+    for row in rows:
+        month_mix = mix.get(row['day'][:7])
+        if month_mix is not None and row['words'] > 0:
+            month_mix[row['genre'] or "Other"] += row['words']
+    return {key: dict(genres) for key, genres in mix.items()}
+
+
+def heatmap(days: Dict[date, Dict[str, int]], until: Optional[date] = None) -> List[List[Optional[Dict]]]:
+    """Weeks of the window as columns of seven days, Monday first
+
+    Each cell is {'day', 'words', 'level'} with level 0-4 by words
+    written, relative to the busiest day; days after until are None.
+    """
+    until = until or today()
+    first = week_start(until - timedelta(days=WINDOW_DAYS - 7))
+    busiest = max((totals['words'] for totals in days.values()), default=0)
+    weeks = []
+    start = first
+    while start <= until:
+        column = []
+        for offset in range(7):
+            day = start + timedelta(days=offset)
+            if day > until:
+                column.append(None)
+                continue
+            words = days.get(day, {}).get('words', 0)
+            level = 0 if words <= 0 or not busiest else min(4, 1 + 4 * words // (busiest + 1))
+            column.append({'day': day, 'words': words, 'level': level})
+        weeks.append(column)
+        start += timedelta(weeks=1)
+    return weeks
+
+
+def summary(rows: List[Dict], until: Optional[date] = None) -> Dict:
+    """Everything the dashboard shows, from get_activity() rows"""
+    until = until or today()
+    days = daily_totals(rows)
+    current, longest = streaks(days, until)
+    return {
+        'current_streak': current,
+        'longest_streak': longest,
+        'active_days': sum(1 for totals in days.values() if totals['words'] > 0),
+        'words': sum(totals['words'] for totals in days.values()),
+        'stories': sum(totals['stories'] for totals in days.values()),
+        'weeks': weekly_totals(days, until=until),
+        'genre_mix': genre_mix(rows, until=until),
+        'days': {day.isoformat(): totals for day, totals in sorted(days.items())},
+    }
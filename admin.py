@@ -0,0 +1,126 @@
+"""Admin-only generation analytics page"""
+import os
+import streamlit as st
+from database import open_database
+from maintenance import status as maintenance_status
+from profiling import PROFILE_DIR, PROFILE_RERUNS
+from telemetry import telemetry
+
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+RANGES = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90}
+
+
+def is_admin(user):
+    """Admins are listed by email in ADMIN_EMAILS (comma separated)"""
+    return user.get('email', '').lower() in ADMIN_EMAILS
+
+
+def show_admin_page(user):
+    """Daily generation rollups from the telemetry database"""
+    if not is_admin(user):
+        st.error("Admins only")
+        return
+
+    st.title("📊 Generation Analytics")
+    show_profiling_controls()
+    show_maintenance()
+    show_library_totals()
+    days = RANGES[st.selectbox("Range", list(RANGES))]
+
+    telemetry.flush(timeout=2.0)  # include events still in the write buffer
+    summary = telemetry.daily_summary(days)
+    if not summary:
+        st.info("No generations recorded in this range yet.")
+        return
+
+    stories = sum(row['stories'] for row in summary)
+    fell_through = sum(row['fell_through'] for row in summary)
+    requested = sum(row['requested_words'] for row in summary)
+    produced = sum(row['produced_words'] for row in summary)
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Stories", f"{stories:,}")
+    with col2:
+        st.metric("Fell back", f"{fell_through / stories:.1%}", help="First backend failed")
+    with col3:
+        st.metric("Words produced / requested", f"{produced / requested:.1%}" if requested else "-")
+    with col4:
+        st.metric("Tokens", f"{sum(row['tokens'] for row in summary):,}")
+
+    st.subheader("Share by source")
+    share = telemetry.source_share(days)
+    st.bar_chart({source: [value * 100] for source, value in share.items()})
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Latency by genre")
+        st.dataframe(telemetry.latency_quantiles(days, by="genre"), use_container_width=True, hide_index=True)
+    with col2:
+        st.subheader("Latency by source")
+        st.dataframe(telemetry.latency_quantiles(days, by="source"), use_container_width=True, hide_index=True)
+    st.caption("Quantiles are upper bucket edges in seconds (half-octave buckets).")
+
+    st.subheader("Errors before fallback")
+    errors = telemetry.error_breakdown(days)
+    if errors:
+        st.dataframe(errors, use_container_width=True, hide_index=True)
+    else:
+        st.caption("No errors in this range.")
+
+    st.subheader("Daily")
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+
+def show_library_totals():
+    """Users and stories across the whole store (all shards when STORY_SHARDS > 1)"""
+    totals = open_database().get_global_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Users", f"{totals['total_users']:,}")
+    with col2:
+        st.metric("Stories saved", f"{totals['total_stories']:,}")
+    with col3:
+        st.metric("Words saved", f"{totals['total_words']:,}")
+
+
+def show_maintenance():
+    """Last run of each database maintenance job, and the free space it has left to reclaim"""
+    with st.expander("🧹 Database maintenance"):
+        db = open_database()
+        space = db.archive_status()
+        st.caption(f"Database {space['db_bytes'] / 1e6:.1f} MB, {space['free_bytes'] / 1e6:.1f} MB of it free pages.")
+        rows = maintenance_status(db)
+        failed = [row for row in rows if row['ok'] == 0]
+        if failed:
+            st.error(f"{len(failed)} job(s) failed or found problems on their last run")
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+
+def _sync_profile_toggle():
+    st.session_state['profile_reruns'] = st.session_state['profile_reruns_toggle']
+
+
+def show_profiling_controls():
+    """Per-session rerun profiling toggle and the newest profile files"""
+    with st.expander("🔬 Rerun profiling"):
+        if PROFILE_RERUNS:
+            st.caption("PROFILE_RERUNS=1: every session is being profiled.")
+        else:
+            # Widget state is dropped when the admin page is not shown, so keep the flag in its own key
+            st.toggle("Profile my reruns", value=st.session_state.get('profile_reruns', False),
+                      key="profile_reruns_toggle", on_change=_sync_profile_toggle,
+                      help="Sample each rerun of this session and write a flamegraph")
+        
+        files = []
+        if os.path.isdir(PROFILE_DIR):
+            files = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".speedscope.json")),
+                           reverse=True)[:10]
+        if not files:
+            st.caption(f"No profiles in {PROFILE_DIR}/ yet.")
+        for name in files:
+            with open(os.path.join(PROFILE_DIR, name), "rb") as f:
+                st.download_button(name, f.read(), file_name=name, mime="application/json", key=f"profile_{name}")
+        if files:
+            st.caption("Open the files at https://www.speedscope.app; the .collapsed files next to them work "
+                       "with flamegraph.pl.")
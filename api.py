@@ -0,0 +1,302 @@
+"""Headless JSON API for story generation and library operations
+
+Run with:  uvicorn api:app --workers 2
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from activity import summary
+from auth import SimpleAuth
+from database import check_story_fields, open_database
+from export import FORMATS, download_name, export_file, iter_file
+from huggingface_client import generate_story, stream_story
+from maintenance import start_maintenance
+from metrics import start_metrics_server
+
+load_dotenv()
+
+GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"]
+
+# Generation is slow and blocking, so it gets its own bounded executor
+generation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("API_GENERATION_WORKERS", "8")),
+    thread_name_prefix="generate"
+)
+db = open_database(pool_size=int(os.getenv("API_DB_POOL_SIZE", "8")))
+start_maintenance(db)
+start_metrics_server()
+auth = SimpleAuth()
+
+# Each worker would sign tokens with its own random secret and reject the others'.
+# uvicorn --workers (and --reload) runs the app in child processes.
+if not auth.secret_configured and (int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+                                   or multiprocessing.parent_process() is not None):
+    raise RuntimeError("Set AUTH_SECRET (in the environment or .env) to run the API with more than one worker")
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+async def api_error_handler(request: Request, exc: APIError):
+    return JSONResponse({"error": exc.message}, status_code=exc.status_code)
+
+
+def current_user(request: Request) -> dict:
+    """Resolve the bearer token to a user or raise 401"""
+    header = request.headers.get("authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise APIError(401, "Missing bearer token")
+    user = auth.verify_token(token)
+    if not user:
+        raise APIError(401, "Invalid or expired token")
+    return user
+
+
+async def read_json(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise APIError(400, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise APIError(400, "Body must be a JSON object")
+    return body
+
+
+def check_text(body: dict, *fields: str):
+    """400 unless each field given in the body is a string (tags: a list of strings)"""
+    try:
+        check_story_fields(**{field: body.get(field) for field in fields})
+    except TypeError as e:
+        raise APIError(400, str(e))
+
+
+def creativity_param(body: dict) -> float:
+    try:
+        creativity = float(body.get("creativity", 0.7))
+    except (TypeError, ValueError):
+        raise APIError(400, "creativity must be a number")
+    if not math.isfinite(creativity):
+        raise APIError(400, "creativity must be a number")
+    return creativity
+
+
+def generation_params(body: dict) -> dict:
+    """Validate generation fields with the same ranges as the UI"""
+    check_text(body, "prompt", "title", "tags")
+    prompt = (body.get("prompt") or "").strip()
+    if not prompt:
+        raise APIError(400, "prompt is required")
+    genre = body.get("genre", "Fantasy")
+    if genre not in GENRES:
+        raise APIError(400, f"genre must be one of {', '.join(GENRES)}")
+    creativity = min(max(creativity_param(body), 0.1), 1.0)
+    try:
+        length = min(max(int(body.get("length", 300)), 100), 800)
+    except (TypeError, ValueError, OverflowError):
+        raise APIError(400, "length must be a number")
+    return {"prompt": prompt, "genre": genre, "creativity": creativity, "length": length}
+
+
+def story_id_param(request: Request) -> int:
+    try:
+        return int(request.path_params["story_id"])
+    except ValueError:
+        raise APIError(400, "story_id must be an integer")
+
+
+# Auth
+async def create_token(request: Request):
+    body = await read_json(request)
+    await run_in_threadpool(auth.load_users)  # pick up sign-ups made through the UI
+    success, user = auth.login_user(body.get("email", ""), body.get("password", ""))
+    if not success:
+        raise APIError(401, "Invalid email or password")
+    await run_in_threadpool(db.create_or_update_user, user['user_id'], user['email'], user['display_name'])
+    return JSONResponse({"token": auth.issue_token(user), "user": user})
+
+
+# Generation
+async def generate(request: Request):
+    user = current_user(request)
+    body = await read_json(request)
+    params = generation_params(body)
+
+    loop = asyncio.get_running_loop()
+    story = await loop.run_in_executor(
+        generation_executor, generate_story,
+        params["prompt"], params["genre"], params["creativity"], params["length"]
+    )
+
+    result = {"content": story}
+    if body.get("save"):
+        result["story_id"] = await run_in_threadpool(
+            db.save_story, user['user_id'], body.get("title") or params["prompt"][:60],
+            params["prompt"], story, params["genre"], params["creativity"], body.get("tags")
+        )
+    return JSONResponse(result)
+
+
+async def generate_stream(request: Request):
+    current_user(request)
+    params = generation_params(await read_json(request))
+    chunks = stream_story(params["prompt"], params["genre"], params["creativity"], params["length"])
+    # Starlette iterates sync generators in its threadpool
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+
+
+# Library
+async def list_stories(request: Request):
+    user = current_user(request)
+    query = request.query_params
+    try:
+        limit = max(1, min(int(query.get("limit", 20)), 100))
+        offset = max(int(query.get("offset", 0)), 0)
+    except ValueError:
+        raise APIError(400, "limit and offset must be integers")
+    genre = query.get("genre") or None
+    favorite_only = query.get("favorite_only", "").lower() in ("1", "true", "yes")
+    search = query.get("q")
+
+    if search:
+        stories = await run_in_threadpool(
+            db.search_stories, user['user_id'], search, genre=genre,
+            favorite_only=favorite_only, limit=limit, offset=offset
+        )
+    else:
+        stories = await run_in_threadpool(
+            db.get_user_stories, user['user_id'], limit=limit, offset=offset,
+            genre=genre, favorite_only=favorite_only
+        )
+    total = await run_in_threadpool(
+        db.count_stories, user['user_id'], query=search, genre=genre, favorite_only=favorite_only
+    )
+    return JSONResponse({"total": total, "limit": limit, "offset": offset, "stories": stories})
+
+
+async def create_story(request: Request):
+    user = current_user(request)
+    body = await read_json(request)
+    check_text(body, "title", "prompt", "content", "genre", "tags")
+    for field in ("title", "prompt", "content"):
+        if not body.get(field):
+            raise APIError(400, f"{field} is required")
+    creativity = creativity_param(body)
+    story_id = await run_in_threadpool(
+        db.save_story, user['user_id'], body["title"], body["prompt"], body["content"],
+        body.get("genre"), creativity, body.get("tags")
+    )
+    return JSONResponse({"story_id": story_id}, status_code=201)
+
+
+async def export_stories(request: Request):
+    """The library as a ZIP of Markdown files or an EPUB, built in a temporary file and streamed back"""
+    user = current_user(request)
+    query = request.query_params
+    fmt = query.get("format", "zip")
+    if fmt not in FORMATS:
+        raise APIError(400, f"format must be one of {', '.join(FORMATS)}")
+    filters = {"query": query.get("q") or None, "genre": query.get("genre") or None,
+               "favorite_only": query.get("favorite_only", "").lower() in ("1", "true", "yes")}
+    if query.get("ids"):
+        try:
+            filters = {"story_ids": [int(story_id) for story_id in query["ids"].split(",")]}
+        except ValueError:
+            raise APIError(400, "ids must be comma-separated integers")
+
+    spool, count = await run_in_threadpool(
+        export_file, db, user['user_id'], fmt, user.get('display_name') or "", **filters
+    )
+    size = spool.seek(0, os.SEEK_END)
+    spool.seek(0)
+    headers = {"Content-Disposition": f'attachment; filename="{download_name(fmt)}"',
+               "Content-Length": str(size), "X-Story-Count": str(count)}
+    return StreamingResponse(iter_file(spool), media_type=FORMATS[fmt][1], headers=headers)
+
+
+async def story_detail(request: Request):
+    user = current_user(request)
+    story_id = story_id_param(request)
+
+    if request.method == "GET":
+        story = await run_in_threadpool(db.get_story, story_id, user['user_id'])
+        if not story:
+            raise APIError(404, "Story not found")
+        return JSONResponse(story)
+
+    if request.method == "PATCH":
+        body = await read_json(request)
+        check_text(body, "title", "content", "genre", "tags")
+        await run_in_threadpool(
+            db.update_story, story_id, user['user_id'], title=body.get("title"),
+            content=body.get("content"), genre=body.get("genre"), tags=body.get("tags")
+        )
+        story = await run_in_threadpool(db.get_story, story_id, user['user_id'])
+        if not story:
+            raise APIError(404, "Story not found")
+        return JSONResponse(story)
+
+    await run_in_threadpool(db.delete_story, story_id, user['user_id'])
+    return JSONResponse({"deleted": story_id})
+
+
+async def toggle_favorite(request: Request):
+    user = current_user(request)
+    story_id = story_id_param(request)
+    await run_in_threadpool(db.toggle_favorite, story_id, user['user_id'])
+    story = await run_in_threadpool(db.get_story, story_id, user['user_id'])
+    if not story:
+        raise APIError(404, "Story not found")
+    return JSONResponse({"story_id": story_id, "is_favorite": bool(story['is_favorite'])})
+
+
+async def stats(request: Request):
+    user = current_user(request)
+    return JSONResponse(await run_in_threadpool(db.get_stats, user['user_id']))
+
+
+async def activity(request: Request):
+    """Streaks, weekly totals, genre mix and daily totals for the last year, from the activity rollups"""
+    user = current_user(request)
+    rows = await run_in_threadpool(db.get_activity, user['user_id'])
+    return JSONResponse(summary(rows))
+
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+routes = [
+    Route("/health", health),
+    Route("/auth/token", create_token, methods=["POST"]),
+    Route("/generate", generate, methods=["POST"]),
+    Route("/generate/stream", generate_stream, methods=["POST"]),
+    Route("/stories", list_stories, methods=["GET"]),
+    Route("/stories", create_story, methods=["POST"]),
+    Route("/stories/export", export_stories, methods=["GET"]),
+    Route("/stories/{story_id}", story_detail, methods=["GET", "PATCH", "DELETE"]),
+    Route("/stories/{story_id}/favorite", toggle_favorite, methods=["POST"]),
+    Route("/stats", stats),
+    Route("/activity", activity),
+]
+
+app = Starlette(routes=routes, exception_handlers={APIError: api_error_handler})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
@@ -1,11 +1,18 @@
 import streamlit as st
 import os 
+import uuid
 from dotenv import load_dotenv
 from datetime import datetime
+from admin import is_admin, show_admin_page
 from auth import check_authentication, logout
-from database import Database
+from dashboard import show_activity_page
+from database import open_database
 from history import show_history_page
 from huggingface_client import generate_story
+from maintenance import start_maintenance
+from metrics import start_metrics_server, touch_session
+from profiling import start_rerun_profile
+from template_engine import GENRE_PROMPTS
 
 load_dotenv()
 
@@ -13,28 +20,28 @@ YOUR_HF_TOKEN = os.getenv("HF_TOKEN")
 
 GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"]
 
-GENRE_PROMPTS = {
-    "Fantasy": "Include magical elements, mythical creatures, and an epic quest.",
-    "Sci-Fi": "Set in the future with advanced technology and space exploration themes.",
-    "Mystery": "Include a puzzling crime or enigma that needs to be solved.",
-    "Romance": "Focus on emotional connections and relationship development.",
-    "Horror": "Create suspense and fear with dark, eerie atmospheres.",
-    "Adventure": "Include thrilling journeys and daring exploits.",
-    "Comedy": "Make it humorous with witty dialogue and funny situations.",
-    "Drama": "Focus on serious themes and character conflicts.",
-    "Thriller": "Build tension with fast-paced action and unexpected twists."
-}
-
 
 # Streamlit UI - MUST BE FIRST
 st.set_page_config(page_title="AI Story Generator", page_icon="📖", layout="wide")
 
+# Metrics endpoint (side thread, started once per process)
+start_metrics_server()
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+touch_session(st.session_state['session_id'])
+
+# Sampling profile of this rerun (PROFILE_RERUNS=1, or the toggle on the admin page)
+start_rerun_profile(st.session_state.get('profile_reruns', False), label=st.session_state['session_id'][:8])
+
 # Check authentication
 user = check_authentication()
 
-# Initialize database
-db = Database()
-db.create_or_update_user(user['user_id'], user['email'], user['display_name'])
+# Initialize database (maintenance runs from a side thread, started once per process)
+db = open_database()
+start_maintenance(db)
+if st.session_state.get('user_synced') != user['user_id']:
+    db.create_or_update_user(user['user_id'], user['email'], user['display_name'])
+    st.session_state['user_synced'] = user['user_id']
 
 # Custom CSS
 st.markdown("""
@@ -303,9 +310,13 @@ with st.sidebar:
     st.caption(f"📧 {user['email']}")
     st.divider()
     
+    pages = ["✍️ Generate Story", "📚 My Library", "📈 Activity"]
+    if is_admin(user):
+        pages.append("📊 Admin")
+    
     page = st.radio(
         "Navigation",
-        ["✍️ Generate Story", "📚 My Library"],
+        pages,
         label_visibility="collapsed"
     )
     
@@ -317,6 +328,10 @@ with st.sidebar:
 # Show selected page
 if page == "📚 My Library":
     show_history_page(user['user_id'])
+elif page == "📈 Activity":
+    show_activity_page(user['user_id'])
+elif page == "📊 Admin":
+    show_admin_page(user)
 else:
     # Main story generation page
     st.title("📖 AI Story Generator")
@@ -346,6 +361,7 @@ else:
             GENRES,
             help="Choose your story genre"
         )
+        st.caption(GENRE_PROMPTS.get(genre, ""))
         
         creativity = st.slider(
             "Creativity",
@@ -0,0 +1,214 @@
+"""Append-only archive for the text of old stories
+
+Most reads are of recent stories, but every story body stays in the
+stories B-tree forever. The archive job moves the opening chapter
+(stories.content) of old stories nobody has read lately into
+<db>.archive next to the database file. The row keeps its metadata with
+content blanked, and archive_offset/archive_length say where the
+compressed text is. Database reads fill content back in transparently.
+Each archived read is one record read from a memory-mapped file and a
+zlib decompress.
+
+A story is archived once it has not been edited for AFTER_DAYS and not
+opened (get_story) for IDLE_DAYS. Editing an archived story's text moves
+it back into the database. Search still matches archived stories by
+title, prompt and later chapters, but not by their opening text.
+
+File layout: an 8-byte magic, then records. Each record is a 16-byte
+header (story_id, compressed length, crc32) and the zlib data. Records
+are only appended. Editing or deleting an archived story leaves its old
+record behind until the archive is compacted.
+
+    python archive.py                  # archive stories past the thresholds
+    python archive.py --vacuum         # ... then VACUUM so the database file shrinks
+    python archive.py status           # archived stories, archive and database sizes
+    python archive.py compact          # drop records of edited and deleted stories
+    python archive.py restore [--user ID]   # move archived text back into the database
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, List, Tuple
+
+AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+IDLE_DAYS = int(os.getenv("ARCHIVE_IDLE_DAYS", "30"))
+# Shorter texts save less than they cost to look up
+MIN_CHARS = 256
+COMPRESSION_LEVEL = 9
+
+MAGIC = b"STORYAR1"
+_HEADER = struct.Struct("<qII")
+
+
+class ArchiveError(Exception):
+    """A record is missing or does not match its index entry"""
+
+
+def archive_path(db_name: str) -> str:
+    return os.path.splitext(db_name)[0] + ".archive"
+
+
+class ArchiveFile:
+    """One archive file: appends from the archive job, reads through a shared mmap"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._map = None
+
+    def append(self, records: List[Tuple[int, str]]) -> List[Tuple[int, int]]:
+        """Compress and append (story_id, text) records; returns each one's (offset, length) once on disk"""
+        locations = []
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            if offset == 0:
+                f.write(MAGIC)
+                offset = len(MAGIC)
+            for story_id, text in records:
+                data = zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+                f.write(_HEADER.pack(story_id, len(data), zlib.crc32(data)))
+                f.write(data)
+                locations.append((offset, len(data)))
+                offset += _HEADER.size + len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return locations
+
+    def _view(self, end: int, reopen: bool = False):
+        """A map covering at least end bytes; appends and compaction make the current one stale"""
+        with self._lock:
+            if reopen or self._map is None or len(self._map) < end:
+                # Readers may still hold the old map; it closes when the last one drops it
+                self._map = None
+                try:
+                    with open(self.path, "rb") as f:
+                        if os.fstat(f.fileno()).st_size:
+                            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except FileNotFoundError:
+                    pass
+            return self._map
+
+    @staticmethod
+    def _record(view, story_id: int, offset: int, length: int):
+        end = offset + _HEADER.size + length
+        if view is None or len(view) < end:
+            return None
+        record_id, size, crc = _HEADER.unpack_from(view, offset)
+        data = view[offset + _HEADER.size:end]
+        if record_id == story_id and size == length and zlib.crc32(data) == crc:
+            return zlib.decompress(data).decode("utf-8")
+        return None
+
+    def read(self, story_id: int, offset: int, length: int) -> str:
+        end = offset + _HEADER.size + length
+        for reopen in (False, True):
+            text = self._record(self._view(end, reopen), story_id, offset, length)
+            if text is not None:
+                return text
+        # Offsets from before a compaction that has not committed yet point into the previous file
+        try:
+            with open(self.path + ".prev", "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                text = self._record(view, story_id, offset, length)
+        except (FileNotFoundError, ValueError):
+            text = None
+        if text is not None:
+            return text
+        raise ArchiveError(f"{self.path}: no record for story {story_id} at {offset}")
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def write_compacted(self, records: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+        """Copy the live (story_id, offset, length) records into a new file; returns their new locations
+
+        swap_compacted() puts the new file in place.
+        """
+        locations = []
+        with open(self.path + ".compact", "wb") as out:
+            out.write(MAGIC)
+            offset = len(MAGIC)
+            for story_id, old_offset, length in records:
+                end = old_offset + _HEADER.size + length
+                view = self._view(end)
+                if view is None or len(view) < end:
+                    raise ArchiveError(f"{self.path}: no record for story {story_id} at {old_offset}")
+                out.write(view[old_offset:end])
+                locations.append((offset, length))
+                offset += _HEADER.size + length
+            out.flush()
+            os.fsync(out.fileno())
+        return locations
+
+    def swap_compacted(self):
+        """Put the compacted file in place; the old one stays readable as .prev until drop_previous()"""
+        if os.path.exists(self.path + ".prev"):
+            os.remove(self.path + ".prev")
+        os.link(self.path, self.path + ".prev")
+        os.replace(self.path + ".compact", self.path)
+        with self._lock:
+            self._map = None
+
+    def drop_previous(self):
+        try:
+            os.remove(self.path + ".prev")
+        except FileNotFoundError:
+            pass
+
+
+def record_size(length: int) -> int:
+    """Bytes one record takes in the file"""
+    return _HEADER.size + length
+
+
+# One instance per archive file and process, so threads share the map
+_archives: Dict[str, ArchiveFile] = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(db_name: str) -> ArchiveFile:
+    path = archive_path(db_name)
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = ArchiveFile(path)
+        return _archives[path]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from database import open_database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--after-days", type=int, default=AFTER_DAYS, help="days since the last edit")
+    parser.add_argument("--idle-days", type=int, default=IDLE_DAYS, help="days since the story was last opened")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards (locks the database meanwhile)")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("status", help="archived stories, archive and database sizes")
+    commands.add_parser("compact", help="drop records of edited and deleted stories")
+    restore = commands.add_parser("restore", help="move archived text back into the database")
+    restore.add_argument("--user", help="only this user's stories")
+    args = parser.parse_args()
+
+    db = open_database()
+    start = time.perf_counter()
+    if args.command == "status":
+        status = db.archive_status()
+        print(f"{status['archived']} archived stories, {status['live_bytes'] / 1e6:.1f} MB live in "
+              f"{status['archive_bytes'] / 1e6:.1f} MB of archive; database {status['db_bytes'] / 1e6:.1f} MB "
+              f"({status['free_bytes'] / 1e6:.1f} MB free pages)")
+    elif args.command == "compact":
+        print(f"reclaimed {db.compact_archive() / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s")
+    elif args.command == "restore":
+        print(f"restored {db.restore_archived(args.user)} stories in {time.perf_counter() - start:.1f}s")
+    else:
+        stories, size = db.archive_stories(args.after_days, args.idle_days)
+        print(f"archived {stories} stories ({size / 1e6:.1f} MB of text) in {time.perf_counter() - start:.1f}s")
+    if args.vacuum:
+        db.vacuum()
+        print(f"vacuumed in {time.perf_counter() - start:.1f}s")
@@ -2,15 +2,28 @@
 import streamlit as st
 from typing import Optional, Dict
 import hashlib
+import hmac
+import base64
 import json
 import os
+import time
 from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Signs API tokens when AUTH_SECRET is not set; it lives only as long as this process
+PROCESS_SECRET = base64.urlsafe_b64encode(os.urandom(32)).decode()
+TOKEN_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_TTL", str(7 * 24 * 3600)))
 
 class SimpleAuth:
     """Simple authentication system for demo purposes"""
     
     def __init__(self, users_file: str = "users.json"):
         self.users_file = users_file
+        # Set AUTH_SECRET so tokens survive restarts and work on every worker
+        self.secret_configured = bool(os.getenv("AUTH_SECRET"))
+        self.secret = os.getenv("AUTH_SECRET") or PROCESS_SECRET
         self.load_users()
     
     def load_users(self):
@@ -61,6 +74,33 @@ class SimpleAuth:
             }
         return False, None
     
+    def issue_token(self, user_info: Dict) -> str:
+        """Issue a signed bearer token for the API"""
+        payload = json.dumps({
+            'email': user_info['email'],
+            'exp': int(time.time()) + TOKEN_TTL_SECONDS
+        }).encode()
+        body = base64.urlsafe_b64encode(payload).decode().rstrip("=")
+        signature = hmac.new(self.secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+        return f"{body}.{signature}"
+    
+    def verify_token(self, token: str) -> Optional[Dict]:
+        """Return user info for a valid, unexpired token"""
+        body, _, signature = token.partition(".")
+        expected = hmac.new(self.secret.encode(), body.encode(), hashlib.sha256).hexdigest()
+        # Bytes, because compare_digest refuses str with non-ASCII characters
+        if not hmac.compare_digest(signature.encode(), expected.encode()):
+            return None
+        
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+        except ValueError:
+            return None
+        
+        if payload.get('exp', 0) < time.time():
+            return None
+        return self.get_user_info(payload.get('email', ''))
+    
     def get_user_info(self, email: str) -> Optional[Dict]:
         """Get user information"""
         if email in self.users:
@@ -0,0 +1,287 @@
+"""Pluggable story generation backends
+
+Backends are tried in priority order (lowest first). Each has its own
+concurrency limit and timeout; a backend that is already running
+max_concurrency requests is skipped rather than queued, so traffic spills
+over to the next backend under load.
+
+Configure with GENERATION_BACKENDS (a JSON list) or a JSON file named by
+GENERATION_BACKENDS_FILE (default backends.json), e.g.
+
+    [
+      {"type": "openai", "name": "llama", "base_url": "http://127.0.0.1:8080",
+       "model": "llama-3-8b", "priority": 10, "max_concurrency": 4, "timeout": 60},
+      {"type": "hf", "priority": 20},
+      {"type": "ngram", "priority": 30},
+      {"type": "template", "priority": 40}
+    ]
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from calibration import calibrator
+from profiling import span
+from huggingface_client import build_hf_prompt, generate_with_hf, generate_with_local, trim_to_word_count
+from scoring import pick_best
+
+DEFAULT_BACKENDS = [
+    {"type": "hf", "priority": 10},
+    {"type": "ngram", "priority": 20},
+    {"type": "template", "priority": 30},
+]
+
+
+class Backend:
+    """Base class: subclasses implement generate()"""
+    type_name = "base"
+    remote = False
+
+    def __init__(self, name: Optional[str] = None, priority: int = 100, max_concurrency: int = 8,
+                 timeout: float = 30.0, enabled: bool = True):
+        self.name = name or self.type_name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.enabled = enabled
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.in_flight = 0
+
+    def generate(self, prompt: str, genre: str, creativity: float, max_length: int,
+                 stats: Optional[Dict] = None, context: str = "") -> Tuple[bool, str]:
+        """Subclasses may record "model" and "tokens" in stats
+        
+        context is the end of the story so far when generating a
+        continuation; backends that cannot condition on it ignore it.
+        """
+        raise NotImplementedError
+
+    def try_generate(self, prompt: str, genre: str, creativity: float, max_length: int,
+                     stats: Optional[Dict] = None, context: str = "") -> Tuple[bool, str]:
+        """Generate if a concurrency slot is free, otherwise report busy"""
+        if not self._slots.acquire(blocking=False):
+            return False, "Busy"
+        self.in_flight += 1
+        try:
+            with span(f"backend.{self.name}"):
+                return self.generate(prompt, genre, creativity, max_length, stats, context)
+        except Exception as e:
+            return False, f"Error: {e}"
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+
+class HFBackend(Backend):
+    """Hugging Face serverless inference API"""
+    type_name = "hf"
+    remote = True
+
+    def __init__(self, model: str = "gpt2", candidates: int = 3, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.candidates = candidates  # sampled per request and ranked by scoring.py
+        self.session = _session(self.max_concurrency)
+
+    def generate(self, prompt, genre, creativity, max_length, stats=None, context=""):
+        max_tokens, min_tokens = calibrator.token_budget(self.model, genre, max_length)
+        hf_prompt = build_hf_prompt(prompt, genre, max_length, context)
+        hf_stats = {}
+        success, text = generate_with_hf(hf_prompt, self.model, max_tokens, creativity, timeout=self.timeout,
+                                         session=self.session, min_tokens=min_tokens, stats=hf_stats,
+                                         num_candidates=self.candidates)
+        if not success:
+            return False, text
+
+        candidates = hf_stats["candidates"]
+        for candidate in candidates:
+            calibrator.record(self.model, genre, len(candidate["text"].split()), candidate["generated_tokens"] or 0)
+        best, score = pick_best([c["text"] for c in candidates], max_length, hf_prompt, prompt)
+        if best is None:
+            return False, f"Low quality output (score {score:.2f})"
+        if stats is not None:
+            stats.update(model=self.model, tokens=sum(c["generated_tokens"] or 0 for c in candidates))
+        return True, trim_to_word_count(candidates[best]["text"], max_length)
+
+
+class OpenAICompatibleBackend(Backend):
+    """Any server speaking the OpenAI completions protocol (llama.cpp server, vLLM, Ollama)"""
+    type_name = "openai"
+    remote = True
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8080", model: str = "default",
+                 api_key: Optional[str] = None, candidates: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.url = base_url.rstrip("/") + "/v1/completions"
+        self.model = model
+        self.candidates = candidates
+        self.session = _session(self.max_concurrency)  # keep-alive connections to the server
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def generate(self, prompt, genre, creativity, max_length, stats=None, context=""):
+        max_tokens, _ = calibrator.token_budget(self.model, genre, max_length, cap=2048)
+        completion_prompt = build_hf_prompt(prompt, genre, max_length, context)
+        payload = {
+            "model": self.model,
+            "prompt": completion_prompt,
+            "max_tokens": max_tokens,
+            "temperature": creativity,
+            "top_p": 0.95,
+            "n": self.candidates,
+        }
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.Timeout:
+            return False, "Request timeout"
+        except requests.RequestException as e:
+            return False, str(e)
+
+        if response.status_code != 200:
+            return False, f"HTTP error ({response.status_code})"
+        data = response.json()
+        texts = [choice.get("text", "").strip() for choice in data.get("choices") or []]
+        texts = [text for text in texts if len(text) > 10]
+        if not texts:
+            return False, "Empty response"
+        # usage covers all n completions
+        tokens = (data.get("usage") or {}).get("completion_tokens") or 0
+        calibrator.record(self.model, genre, sum(len(text.split()) for text in texts), tokens)
+        best, score = pick_best(texts, max_length, completion_prompt, prompt)
+        if best is None:
+            return False, f"Low quality output (score {score:.2f})"
+        if stats is not None:
+            stats.update(model=self.model, tokens=tokens)
+        return True, trim_to_word_count(texts[best], max_length)
+
+
+class NgramBackend(Backend):
+    """Trigram model trained on saved stories (ngram_model.py)"""
+    type_name = "ngram"
+
+    def generate(self, prompt, genre, creativity, max_length, stats=None, context=""):
+        from ngram_model import ngram_models
+        return ngram_models.generate(prompt, genre, max_length, creativity)
+
+
+class TemplateBackend(Backend):
+    """Genre template engine (template_engine.py)"""
+    type_name = "template"
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("name", "local")
+        kwargs.setdefault("max_concurrency", 64)
+        super().__init__(**kwargs)
+
+    def generate(self, prompt, genre, creativity, max_length, stats=None, context=""):
+        max_tokens = min(int(max_length * 1.33), 800)
+        return generate_with_local(prompt, max_tokens, creativity, target_words=max_length, genre=genre)
+
+
+class MockBackend(Backend):
+    """Canned text after an optional delay, for tests and load generation"""
+    type_name = "mock"
+
+    def __init__(self, text: Optional[str] = None, delay: float = 0.0, fail: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.text = text
+        self.delay = delay
+        self.fail = fail
+
+    def generate(self, prompt, genre, creativity, max_length, stats=None, context=""):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            return False, "Mock failure"
+        text = self.text or f"A {genre.lower()} story about {prompt}."
+        words = text.split()
+        return True, " ".join((words * (max_length // len(words) + 1))[:max_length])
+
+
+BACKEND_TYPES = {cls.type_name: cls for cls in
+                 (HFBackend, OpenAICompatibleBackend, NgramBackend, TemplateBackend, MockBackend)}
+
+
+def _session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class BackendRegistry:
+    """Ordered set of backends with fall-through routing"""
+
+    def __init__(self, backends: List[Backend]):
+        self.backends = sorted(backends, key=lambda backend: backend.priority)
+
+    @classmethod
+    def from_config(cls, config: List[Dict]) -> "BackendRegistry":
+        backends = []
+        for entry in config:
+            entry = dict(entry)
+            backend_type = entry.pop("type")
+            if backend_type not in BACKEND_TYPES:
+                raise ValueError(f"Unknown backend type {backend_type!r}")
+            backends.append(BACKEND_TYPES[backend_type](**entry))
+        return cls(backends)
+
+    def generate(self, prompt: str, genre: str, creativity: float, max_length: int,
+                 remote: bool = True, stats: Optional[Dict] = None,
+                 context: str = "") -> Tuple[Optional[str], Optional[str]]:
+        """Try each enabled backend in order; returns (backend name, text) or (None, None)
+
+        If a stats dict is passed it receives the winning backend's model and
+        tokens (when known) and "errors", a list of (backend name, message)
+        for the backends that failed first.
+        """
+        errors = []
+        if stats is not None:
+            stats["errors"] = errors
+        for backend in self.backends:
+            if not backend.enabled or (backend.remote and not remote):
+                continue
+            success, text = backend.try_generate(prompt, genre, creativity, max_length, stats, context)
+            if success:
+                return backend.name, text
+            errors.append((backend.name, text))
+        return None, None
+
+    def status(self) -> List[Dict]:
+        return [{"name": b.name, "type": b.type_name, "priority": b.priority, "enabled": b.enabled,
+                 "in_flight": b.in_flight, "max_concurrency": b.max_concurrency} for b in self.backends]
+
+
+def load_config() -> List[Dict]:
+    if os.getenv("GENERATION_BACKENDS"):
+        return json.loads(os.environ["GENERATION_BACKENDS"])
+    path = os.getenv("GENERATION_BACKENDS_FILE", "backends.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return DEFAULT_BACKENDS
+
+
+_registry: Optional[BackendRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> BackendRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = BackendRegistry.from_config(load_config())
+        return _registry
+
+
+def set_registry(registry: BackendRegistry):
+    """Swap the process-wide registry (tests, benchmarks, config reloads)"""
+    global _registry
+    with _registry_lock:
+        _registry = registry
@@ -0,0 +1,612 @@
+"""Online backups of the story database with point-in-time restore
+
+Snapshots use SQLite's online backup API from inside a read transaction.
+They copy SNAPSHOT_PAGES pages per step and sleep STEP_SLEEP between
+steps. In WAL mode, readers never block the app's writers, and a paced
+copy leaves them the disk. Every file is stored with its sha256, gzipped
+unless BACKUP_COMPRESS=0. Only the newest BACKUP_KEEP snapshots of each
+file are kept.
+
+`ship` adds point-in-time restore. After a snapshot it copies each new
+WAL frame to the backup every BACKUP_SHIP_SECONDS. A copy takes the
+write lock for as long as it takes to read the frames, usually
+milliseconds, and the app's writers wait behind it. They are compressed
+and stored after it is released. Between copies the
+shipper holds a read transaction, so SQLite cannot restart the WAL over
+frames it has not copied. If the WAL restarts anyway, the chain has a
+gap and a new snapshot is taken. Restore rebuilds each WAL generation
+from the copied frames on top of a snapshot, up to the last copy before
+--at. Each run of the shipper names its segments after itself (session),
+since a restarted shipper copies the live WAL again from its start, and
+a restore replays only the segments of the run that took its snapshot.
+
+Backups go to BACKUP_DIR (default backups/), one directory per file:
+the story database (or its shards and catalog), each database's story
+archive (archive.py) and users.json. The archive is append-only, so it
+is copied inside the database snapshot's read transaction, and shipped
+in the same step as the WAL frames that point into it.
+
+    python backup.py snapshot               # snapshot every file now and rotate
+    python backup.py ship                   # snapshot, then ship WAL frames until stopped
+    python backup.py list
+    python backup.py verify                 # recompute every checksum
+    python backup.py restore --to DIR [--at "2026-10-19 12:00:00"]   # UTC
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from archive import archive_path
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+COMPRESS = os.getenv("BACKUP_COMPRESS", "1") != "0"
+SHIP_SECONDS = float(os.getenv("BACKUP_SHIP_SECONDS", "10"))
+# A new base snapshot this often keeps restores from replaying days of WAL
+SNAPSHOT_HOURS = float(os.getenv("BACKUP_SNAPSHOT_HOURS", "24"))
+SNAPSHOT_PAGES = 256
+STEP_SLEEP = 0.005
+# The shipper checkpoints once the WAL is this big, so it does not grow without bound
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+_WAL_HEADER = struct.Struct(">8I")  # magic, version, page size, checkpoint seq, salt1, salt2, checksum1, checksum2
+_FRAME_HEADER = struct.Struct(">6I")  # page number, db size (commit frames only), salt1, salt2, checksum1, checksum2
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def parse_time(value: str) -> str:
+    """'2026-10-19 12:00' (UTC) in the manifest's timestamp format"""
+    return datetime.fromisoformat(value.rstrip("Z")).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def database_files(db_name: str = "stories.db") -> List[str]:
+    """The files behind open_database(): one database, or the shards and their catalog"""
+    shards = int(os.getenv("STORY_SHARDS", "1"))
+    if shards <= 1:
+        return [db_name]
+    from sharding import catalog_path, shard_path
+    return [shard_path(db_name, i) for i in range(shards)] + [catalog_path(db_name)]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BackupSet:
+    """One backed-up file's snapshots and WAL segments, listed in manifest.json"""
+
+    def __init__(self, root: str, name: str):
+        self.name = name
+        self.dir = os.path.join(root, name)
+        os.makedirs(self.dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        self.manifest = {"snapshots": [], "segments": []}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def _save_manifest(self):
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def _store(self, source: str, name: str) -> Dict:
+        """Move source into the set (gzipped if COMPRESS); returns its file, size and checksum"""
+        if COMPRESS:
+            name += ".gz"
+            with open(source, "rb") as src, gzip.open(os.path.join(self.dir, name), "wb", compresslevel=6) as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+            os.remove(source)
+        else:
+            os.replace(source, os.path.join(self.dir, name))
+        path = os.path.join(self.dir, name)
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+        return {"file": name, "bytes": os.path.getsize(path), "sha256": _sha256(path)}
+
+    def add_snapshot(self, source: str, extension: str, generation: Optional[str] = None,
+                     session: Optional[str] = None, taken_at: Optional[str] = None) -> Dict:
+        """Record a finished snapshot file; generation and session name the WAL it continues into, if shipping
+
+        taken_at is when the copied state was current (default: now).
+        """
+        taken_at = taken_at or now()
+        entry = {"taken_at": taken_at, "generation": generation, "session": session,
+                 **self._store(source, f"snapshot-{taken_at.replace(':', '')}{extension}")}
+        self.manifest["snapshots"].append(entry)
+        self._save_manifest()
+        return entry
+
+    def add_segment(self, data: bytes, generation: str, start: int, end: int, gap: bool = False,
+                    shipped_at: Optional[str] = None, session: Optional[str] = None):
+        """Record bytes [start, end) of a WAL generation (or archive file); gap marks frames lost before it"""
+        name = f"wal-{generation}-{start:012d}" + (f"-{session}" if session else "")
+        tmp = os.path.join(self.dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        entry = {"shipped_at": shipped_at or now(), "generation": generation, "session": session,
+                 "start": start, "end": end, "gap": gap, **self._store(tmp, name)}
+        self.manifest["segments"].append(entry)
+        self._save_manifest()
+
+    def read(self, entry: Dict) -> bytes:
+        path = os.path.join(self.dir, entry["file"])
+        if _sha256(path) != entry["sha256"]:
+            raise ValueError(f"{path}: checksum mismatch")
+        opener = gzip.open if entry["file"].endswith(".gz") else open
+        with opener(path, "rb") as f:
+            return f.read()
+
+    def rotate(self, keep: int = KEEP) -> int:
+        """Delete all but the newest keep snapshots and the segments only they needed; returns files deleted"""
+        snapshots, segments = self.manifest["snapshots"], self.manifest["segments"]
+        if len(snapshots) <= keep:
+            return 0
+        dropped, snapshots = snapshots[:-keep], snapshots[-keep:]
+        # Segments from the oldest kept snapshot's generation on (or shipped after it) are still needed
+        oldest = snapshots[0]
+        first = next((i for i, s in enumerate(segments)
+                      if s["generation"] == oldest["generation"] or s["shipped_at"] >= oldest["taken_at"]),
+                     len(segments))
+        dropped += segments[:first]
+        self.manifest["snapshots"], self.manifest["segments"] = snapshots, segments[first:]
+        self._save_manifest()
+        for entry in dropped:
+            os.remove(os.path.join(self.dir, entry["file"]))
+        return len(dropped)
+
+    def verify(self) -> List[str]:
+        """Files that are missing or fail their checksum"""
+        bad = []
+        for entry in self.manifest["snapshots"] + self.manifest["segments"]:
+            path = os.path.join(self.dir, entry["file"])
+            if not os.path.exists(path) or _sha256(path) != entry["sha256"]:
+                bad.append(entry["file"])
+        return bad
+
+
+def _snapshot_from(conn: sqlite3.Connection, backup: BackupSet, taken_at: str, generation: Optional[str] = None,
+                   session: Optional[str] = None) -> Dict:
+    """Copy conn's current read snapshot, begun at taken_at, in paced steps"""
+    tmp = os.path.join(backup.dir, "snapshot.tmp")
+    dest = sqlite3.connect(tmp)
+    conn.backup(dest, pages=SNAPSHOT_PAGES, sleep=STEP_SLEEP)
+    dest.close()
+    return backup.add_snapshot(tmp, ".db", generation, session, taken_at)
+
+
+def _inode(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _snapshot_archive(db_path: str, root: str, inode: Optional[int], generation: Optional[str] = None) -> bool:
+    """Copy a database's story archive from inside its read transaction
+
+    inode is the file's inode from before the transaction began. If
+    compaction replaced the file since, the copy may not match the
+    transaction's offsets and False is returned. generation names the
+    file for the segments shipped after the copy.
+    """
+    path = archive_path(db_path)
+    try:
+        src = open(path, "rb")
+    except FileNotFoundError:
+        return inode is None
+    with src:
+        current = os.fstat(src.fileno()).st_ino
+        if current != inode:
+            return False
+        # Anything the transaction points at was appended before it began
+        backup = BackupSet(root, os.path.basename(path))
+        tmp = os.path.join(backup.dir, "snapshot.tmp")
+        with open(tmp, "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+    backup.add_snapshot(tmp, ".archive", generation or f"{current:x}")
+    backup.rotate()
+    return True
+
+
+def snapshot_database(path: str, backup: BackupSet, attempts: int = 3) -> Dict:
+    """Snapshot a database and its story archive at the same point"""
+    for _ in range(attempts):
+        inode = _inode(archive_path(path))
+        conn = sqlite3.connect(path, isolation_level=None)
+        taken_at = now()  # the snapshot has everything committed before this, maybe a little more
+        conn.execute('BEGIN')
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()  # pins the snapshot
+        if _snapshot_archive(path, os.path.dirname(backup.dir), inode):
+            entry = _snapshot_from(conn, backup, taken_at)
+            conn.execute('COMMIT')
+            conn.close()
+            return entry
+        conn.execute('COMMIT')
+        conn.close()
+    raise RuntimeError(f"{path}: the story archive was compacted during {attempts} snapshot attempts")
+
+
+def snapshot_json(path: str, backup: BackupSet, attempts: int = 5) -> Optional[Dict]:
+    """Copy a JSON file the app rewrites in place, retrying until a copy parses"""
+    if not os.path.exists(path):
+        return None
+    for _ in range(attempts):
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            json.loads(data)
+        except ValueError:
+            time.sleep(0.05)  # caught mid-write
+            continue
+        tmp = os.path.join(backup.dir, "snapshot.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return backup.add_snapshot(tmp, ".json")
+    raise ValueError(f"{path} did not parse in {attempts} attempts")
+
+
+class WalShipper:
+    """Copies one database's committed WAL frames into its backup set"""
+
+    def __init__(self, path: str, backup: BackupSet):
+        self.path = path
+        self.wal_path = path + "-wal"
+        self.backup = backup
+        self.archive_path = archive_path(path)
+        self.archive_backup: Optional[BackupSet] = None  # created once there is an archive to ship
+        self.archive_inode: Optional[int] = None
+        self.archive_generation: Optional[str] = None  # inode numbers come back after compaction; this does not
+        self.archive_offset = 0
+        # A restarted shipper copies the live WAL again from offset 0; its own name keeps both copies
+        self.session = f"{time.time_ns():x}"
+        self.writer = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.reader = sqlite3.connect(path, isolation_level=None)
+        # Checkpoints only when ship() asks; one after our own commit would let the WAL restart unpinned
+        self.writer.execute('PRAGMA wal_autocheckpoint=0')
+        self.writer.execute('CREATE TABLE IF NOT EXISTS backup_ship (id INTEGER PRIMARY KEY, shipped_at TEXT)')
+        self.generation: Optional[str] = None  # (checkpoint seq, salts) of the WAL being copied
+        self.offset = 0  # bytes of it already copied
+        self.pinned: Optional[str] = None  # generation our read transaction keeps from restarting
+        self.pinned_at = ""  # the read transaction sees everything committed before this (and maybe a little after)
+        self.gap = False  # the next segment follows lost frames
+        self.needs_snapshot = False
+        self.wal_bytes = 0
+        self._pending: List[Tuple] = []  # segments read under the write lock, stored after it
+
+    def _wal_generation(self) -> Optional[str]:
+        try:
+            with open(self.wal_path, "rb") as f:
+                header = f.read(_WAL_HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) < _WAL_HEADER.size:
+            return None
+        _, _, _, seq, salt1, salt2, _, _ = _WAL_HEADER.unpack(header)
+        return f"{seq:08x}{salt1:08x}{salt2:08x}"
+
+    def _copy_archive(self) -> int:
+        """Read bytes appended to the story archive since the last copy; the caller holds the write lock"""
+        try:
+            f = open(self.archive_path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.archive_inode:  # new, or rewritten by compaction
+                self.archive_inode, self.archive_offset = inode, 0
+                self.archive_generation = f"{inode:x}-{time.time_ns():x}"
+            f.seek(self.archive_offset)
+            data = f.read()
+        if data:
+            self._pending.append((None, data, self.archive_generation, self.archive_offset,
+                                  self.archive_offset + len(data), False))
+            self.archive_offset += len(data)
+        return len(data)
+
+    def _copy(self) -> int:
+        """Read frames committed since the last copy; the caller holds the write lock. Returns bytes read"""
+        try:
+            f = open(self.wal_path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            header = f.read(_WAL_HEADER.size)
+            if len(header) < _WAL_HEADER.size:
+                return 0
+            _, _, page_size, seq, salt1, salt2, _, _ = _WAL_HEADER.unpack(header)
+            generation = f"{seq:08x}{salt1:08x}{salt2:08x}"
+            if generation != self.generation:
+                if self.pinned is not None and generation != self.pinned:
+                    # Restarted while we were not pinning it: frames in between are lost
+                    self.gap = self.needs_snapshot = True
+                self.generation, self.offset = generation, 0
+            # Frames with this generation's salts are valid; only those up to a commit frame are complete
+            pos = end = max(self.offset, _WAL_HEADER.size)
+            f.seek(pos)
+            while True:
+                head = f.read(_FRAME_HEADER.size)
+                if len(head) < _FRAME_HEADER.size:
+                    break
+                _, commit, frame_salt1, frame_salt2, _, _ = _FRAME_HEADER.unpack(head)
+                if (frame_salt1, frame_salt2) != (salt1, salt2):
+                    break
+                pos += _FRAME_HEADER.size + page_size
+                f.seek(pos)
+                if commit:
+                    end = pos
+            self.wal_bytes = pos
+            if end <= max(self.offset, _WAL_HEADER.size):
+                return 0
+            f.seek(self.offset)
+            data = f.read(end - self.offset)
+        self._pending.append((self.backup, data, generation, self.offset, end, self.gap))
+        self.gap = False
+        self.offset = end
+        return len(data)
+
+    def ship(self) -> int:
+        """Copy new frames under the write lock, then pin the WAL again; returns bytes shipped"""
+        self.writer.execute('BEGIN IMMEDIATE')
+        # With writers held off, the WAL cannot restart once we stop pinning it
+        if self.reader.in_transaction:
+            self.reader.execute('COMMIT')
+        try:
+            shipped_at = now()  # everything committed by now is in the copy
+            shipped = self._copy() + self._copy_archive()
+            if self.wal_bytes > CHECKPOINT_BYTES:
+                self.reader.execute('PRAGMA wal_checkpoint(PASSIVE)')
+                # Only a write transaction begun after a full checkpoint starts the WAL over, and ours
+                # began before it. Everything is copied, so a restart in between loses nothing.
+                self.writer.execute('COMMIT')
+                self.pinned = None
+                self.writer.execute('BEGIN IMMEDIATE')
+                shipped += self._copy() + self._copy_archive()
+            # Our own commit leaves a frame in the WAL, so the read below pins it (and may start a new one)
+            self.writer.execute('INSERT OR REPLACE INTO backup_ship VALUES (1, ?)', (now(),))
+            self.writer.execute('COMMIT')
+        except Exception:
+            if self.writer.in_transaction:
+                self.writer.execute('ROLLBACK')
+            raise
+        self.pinned_at = now()
+        self.reader.execute('BEGIN')
+        self.reader.execute('SELECT shipped_at FROM backup_ship').fetchone()
+        self.pinned = self._wal_generation()
+        # Compressing and syncing is the slow part, done without holding writers up. One timestamp
+        # for both sets, so a restore to any time gets the archive records its rows point at.
+        for backup, data, generation, start, end, gap in self._pending:
+            if backup is None:
+                if self.archive_backup is None:
+                    self.archive_backup = BackupSet(os.path.dirname(self.backup.dir),
+                                                    os.path.basename(self.archive_path))
+                backup = self.archive_backup
+            backup.add_segment(data, generation, start, end, gap, shipped_at, self.session)
+        self._pending = []
+        return shipped
+
+    def snapshot(self) -> Dict:
+        """A base snapshot from the pinned read transaction, which the shipped frames continue"""
+        for _ in range(3):
+            if not self.reader.in_transaction:
+                self.ship()
+            # archive_inode was read under the write lock just before the pin
+            if _snapshot_archive(self.path, os.path.dirname(self.backup.dir), self.archive_inode,
+                                 self.archive_generation):
+                self.archive_backup = None  # reload its manifest, which now lists the snapshot
+                self.needs_snapshot = False
+                return _snapshot_from(self.reader, self.backup, self.pinned_at, self.pinned, self.session)
+            self.reader.execute('COMMIT')
+        raise RuntimeError(f"{self.path}: the story archive was compacted during 3 snapshot attempts")
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+def backup_sets(root: str = BACKUP_DIR, db_name: str = "stories.db") -> Dict[str, str]:
+    """Backup set name -> live path, for the databases and users.json"""
+    files = {os.path.basename(path): path for path in database_files(db_name)}
+    files["users.json"] = "users.json"
+    return files
+
+
+def snapshot_all(root: str = BACKUP_DIR, db_name: str = "stories.db") -> List[Dict]:
+    entries = []
+    for name, path in backup_sets(root, db_name).items():
+        backup = BackupSet(root, name)
+        entry = snapshot_json(path, backup) if name.endswith(".json") else snapshot_database(path, backup)
+        if entry:
+            backup.rotate()
+            entries.append({"name": name, **entry})
+    return entries
+
+
+def ship_forever(root: str = BACKUP_DIR, db_name: str = "stories.db", interval: float = SHIP_SECONDS,
+                 rounds: int = 0):
+    """Snapshot, then ship every interval seconds (rounds > 0 stops after that many)"""
+    shippers = [WalShipper(path, BackupSet(root, name))
+                for name, path in backup_sets(root, db_name).items() if not name.endswith(".json")]
+    users = BackupSet(root, "users.json")
+    last_snapshot = None
+    done = 0
+    try:
+        while not rounds or done < rounds:
+            for shipper in shippers:
+                shipper.ship()
+                if shipper.needs_snapshot:
+                    print(f"{shipper.path}: WAL restarted between copies; taking a new snapshot")
+            if (last_snapshot is None or time.monotonic() - last_snapshot > SNAPSHOT_HOURS * 3600
+                    or any(s.needs_snapshot for s in shippers)):
+                for shipper in shippers:
+                    shipper.snapshot()
+                    shipper.backup.rotate()
+                if snapshot_json("users.json", users):
+                    users.rotate()
+                last_snapshot = time.monotonic()
+            done += 1
+            time.sleep(interval)
+    finally:
+        for shipper in shippers:
+            shipper.close()
+
+
+def restore_database(backup: BackupSet, target: str, at: Optional[str] = None) -> Dict:
+    """Rebuild target from the newest snapshot at or before at, replaying shipped WAL up to at"""
+    snapshots = [s for s in backup.manifest["snapshots"] if at is None or s["taken_at"] <= at]
+    if not snapshots:
+        raise ValueError(f"{backup.name}: no snapshot at or before {at}")
+    base = snapshots[-1]
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    with open(target, "wb") as f:
+        f.write(backup.read(base))
+
+    replayed = 0
+    if base["generation"] and not base["file"].endswith(".json"):
+        # The snapshot continues into the frames its own run of the shipper copied
+        session = base.get("session")
+        segments = backup.manifest["segments"]
+        start = next((i for i, s in enumerate(segments) if s.get("session") == session
+                      and s["generation"] == base["generation"] and s["start"] == 0), None)
+        generations: List[List[Dict]] = []
+        for segment in segments[start:] if start is not None else []:
+            if at is not None and segment["shipped_at"] > at:
+                break
+            if segment.get("session") != session:
+                # A later run copied the live WAL again from its start. That only continues the chain
+                # while the WAL is the generation being replayed; a restart in between lost frames.
+                if segment["start"] != 0 or segment["gap"] or segment["generation"] != generations[-1][0]["generation"]:
+                    break
+                session = segment.get("session")
+                generations[-1] = [segment]
+                continue
+            if segment["gap"] and generations:
+                break
+            if not generations or segment["generation"] != generations[-1][0]["generation"]:
+                if segment["start"] != 0:
+                    break
+                generations.append([])
+            generations[-1].append(segment)
+        # Each generation becomes the WAL again and is checkpointed into the file
+        for generation in generations:
+            with open(target + "-wal", "wb") as f:
+                for segment in generation:
+                    f.write(backup.read(segment))
+            conn = sqlite3.connect(target)
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+            replayed += len(generation)
+
+    conn = sqlite3.connect(target)
+    integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    conn.close()
+    return {"snapshot": base["taken_at"], "segments": replayed, "integrity": integrity}
+
+
+def restore_file(backup: BackupSet, target: str, at: Optional[str] = None) -> Dict:
+    """Rebuild users.json or a story archive: the newest snapshot at or before at, plus appends shipped after it"""
+    snapshots = [s for s in backup.manifest["snapshots"] if at is None or s["taken_at"] <= at]
+    if snapshots:
+        base = snapshots[-1]
+        content, generation, since = bytearray(backup.read(base)), base["generation"], base["taken_at"]
+    else:
+        # An archive created after the last snapshot was shipped from its first byte
+        base, content, generation, since = {"taken_at": None}, bytearray(), None, ""
+    replayed = 0
+    for segment in backup.manifest["segments"]:
+        if segment["shipped_at"] < since:
+            continue
+        if at is not None and segment["shipped_at"] > at:
+            break
+        if segment["generation"] != generation:
+            if segment["start"] != 0:
+                break
+            content, generation = bytearray(), segment["generation"]
+        if segment["start"] > len(content):
+            break
+        content[segment["start"]:] = backup.read(segment)
+        replayed += 1
+    with open(target, "wb") as f:
+        f.write(content)
+    return {"snapshot": base["taken_at"], "segments": replayed, "integrity": "ok"}
+
+
+def restore_all(target_dir: str, root: str = BACKUP_DIR, at: Optional[str] = None) -> Dict[str, Dict]:
+    os.makedirs(target_dir, exist_ok=True)
+    results = {}
+    for name in sorted(os.listdir(root)):
+        backup = BackupSet(root, name)
+        target = os.path.join(target_dir, name)
+        if name.endswith((".json", ".archive")):
+            # These may not have existed yet at that time
+            times = [s["taken_at"] for s in backup.manifest["snapshots"]]
+            times += [s["shipped_at"] for s in backup.manifest["segments"]]
+            if any(at is None or t <= at for t in times):
+                results[name] = restore_file(backup, target, at)
+        elif backup.manifest["snapshots"]:
+            results[name] = restore_database(backup, target, at)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=BACKUP_DIR, help="backup directory")
+    parser.add_argument("--db", default="stories.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="snapshot every file now and rotate")
+    ship = commands.add_parser("ship", help="snapshot, then ship WAL frames until stopped")
+    ship.add_argument("--interval", type=float, default=SHIP_SECONDS)
+    commands.add_parser("list", help="snapshots and shipped WAL per file")
+    commands.add_parser("verify", help="recompute every checksum")
+    restore = commands.add_parser("restore", help="rebuild the files into another directory")
+    restore.add_argument("--to", required=True, help="directory for the restored files")
+    restore.add_argument("--at", help="UTC time to restore to (default: the latest backup)")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        for entry in snapshot_all(args.dir, args.db):
+            print(f"{entry['name']}: {entry['file']} ({entry['bytes'] / 1e6:.1f} MB)")
+    elif args.command == "ship":
+        print(f"shipping to {args.dir} every {args.interval:g}s; Ctrl+C to stop")
+        try:
+            ship_forever(args.dir, args.db, args.interval)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "list":
+        for name in sorted(os.listdir(args.dir)):
+            backup = BackupSet(args.dir, name)
+            segments = backup.manifest["segments"]
+            print(f"{name}: {len(backup.manifest['snapshots'])} snapshots, {len(segments)} WAL segments"
+                  + (f" (last shipped {segments[-1]['shipped_at']})" if segments else ""))
+            for entry in backup.manifest["snapshots"]:
+                print(f"  {entry['taken_at']}  {entry['bytes'] / 1e6:8.1f} MB  {entry['file']}")
+    elif args.command == "verify":
+        failed = {name: BackupSet(args.dir, name).verify() for name in sorted(os.listdir(args.dir))}
+        for name, bad in failed.items():
+            print(f"{name}: {'ok' if not bad else 'BAD ' + ', '.join(bad)}")
+        raise SystemExit(1 if any(failed.values()) else 0)
+    else:
+        at = parse_time(args.at) if args.at else None
+        for name, result in restore_all(args.to, args.dir, at).items():
+            print(f"{name}: snapshot {result['snapshot']} + {result['segments']} WAL segments, "
+                  f"integrity {result['integrity']}")
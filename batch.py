@@ -0,0 +1,197 @@
+"""Batch story generation from a CSV or JSONL prompt file
+
+Usage:
+    python -m batch prompts.jsonl --email demo@example.com --workers 8
+
+Each input record has a prompt and optionally title, genre, length,
+creativity and tags (a list, or a comma-separated string). Stories are
+generated concurrently and saved in batched transactions.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database import Database, open_database
+from huggingface_client import generate_story_detailed
+
+GENRES = ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"]
+
+
+def _jsonl_records(f) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """(line number, record) for each non-blank line; None if the line is not a JSON object"""
+    for line_no, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+def read_prompts(path: str) -> Iterator[Dict]:
+    """Yield normalized prompt records from a .csv or .jsonl file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            records = enumerate(csv.DictReader(f), 1)
+        else:
+            records = _jsonl_records(f)
+
+        for line_no, record in records:
+            if record is None:
+                print(f"skipping record {line_no}: not a JSON object", file=sys.stderr)
+                continue
+
+            prompt = record.get("prompt")
+            if not isinstance(prompt, str) or not prompt.strip():
+                print(f"skipping record {line_no}: no prompt", file=sys.stderr)
+                continue
+            prompt = prompt.strip()
+
+            title = record.get("title")
+            if title is not None and not isinstance(title, str):
+                print(f"skipping record {line_no}: title must be a string", file=sys.stderr)
+                continue
+
+            tags = record.get("tags") or []
+            if isinstance(tags, str):
+                tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
+            if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                print(f"skipping record {line_no}: tags must be a list of strings or a comma-separated string",
+                      file=sys.stderr)
+                continue
+
+            genre = record.get("genre") or "Fantasy"
+            if genre not in GENRES:
+                print(f"record {line_no}: unknown genre {genre!r}, using Fantasy", file=sys.stderr)
+                genre = "Fantasy"
+
+            length, creativity = record.get("length"), record.get("creativity")
+            try:
+                # Empty CSV cells mean the default; an explicit 0 is clamped like any other value
+                length = int(300 if length in (None, "") else length)
+                creativity = float(0.7 if creativity in (None, "") else creativity)
+                if math.isnan(creativity):
+                    raise ValueError
+            except (TypeError, ValueError, OverflowError):
+                print(f"skipping record {line_no}: length must be a whole number and creativity a number",
+                      file=sys.stderr)
+                continue
+
+            yield {
+                "prompt": prompt,
+                "title": (title or prompt[:60]).strip(),
+                "genre": genre,
+                "length": min(max(length, 100), 800),
+                "creativity": min(max(creativity, 0.1), 1.0),
+                "tags": tags,
+            }
+
+
+def generate_one(record: Dict) -> Dict:
+    result = generate_story_detailed(record["prompt"], record["genre"], record["creativity"], record["length"])
+    return {**record, **result}
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_batch(records: List[Dict], db: Database, user_id: str, workers: int, batch_size: int) -> Dict:
+    """Generate and save all records, printing progress; returns summary stats"""
+    pending: List[Dict] = []
+    latencies: List[float] = []
+    sources: Dict[str, int] = {}
+    saved = failed = 0
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal saved
+        if pending:
+            db.save_stories(user_id, [
+                {"title": r["title"], "prompt": r["prompt"], "content": r["text"], "genre": r["genre"],
+                 "creativity": r["creativity"], "tags": r["tags"]}
+                for r in pending
+            ])
+            saved += len(pending)
+            pending.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_one, record) for record in records]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"generation failed: {e}", file=sys.stderr)
+                continue
+
+            latencies.append(result["latency"])
+            sources[result["source"]] = sources.get(result["source"], 0) + 1
+            pending.append(result)
+            if len(pending) >= batch_size:
+                flush()
+
+            elapsed = time.perf_counter() - started
+            print(f"[{done}/{len(records)}] {done / elapsed:.1f} stories/s, {saved} saved", flush=True)
+
+    flush()
+    elapsed = time.perf_counter() - started
+    return {
+        "generated": len(latencies),
+        "saved": saved,
+        "failed": failed,
+        "seconds": elapsed,
+        "stories_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "sources": sources,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="prompts file (.csv or .jsonl)")
+    parser.add_argument("--email", required=True, help="owner of the generated stories")
+    parser.add_argument("--display-name", default=None)
+    parser.add_argument("--db", default="stories.db")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=50, help="stories per save transaction")
+    args = parser.parse_args()
+
+    # Same id derivation as SimpleAuth.register_user, so the stories show up for that login
+    user_id = hashlib.md5(args.email.encode()).hexdigest()
+    db = open_database(args.db)
+    db.create_or_update_user(user_id, args.email, args.display_name or args.email.split("@")[0])
+
+    records = list(read_prompts(args.input))
+    if not records:
+        print("no prompts to generate", file=sys.stderr)
+        sys.exit(1)
+
+    summary = run_batch(records, db, user_id, args.workers, args.batch_size)
+
+    generated = summary["generated"] or 1
+    hf = summary["sources"].get("hf", 0)
+    print()
+    print(f"Generated {summary['generated']} stories ({summary['failed']} failed), "
+          f"saved {summary['saved']} in {summary['seconds']:.1f}s")
+    print(f"Throughput: {summary['stories_per_sec']:.2f} stories/s with {args.workers} workers")
+    print(f"Sources: HF {hf / generated:.0%}, fallback {(generated - hf) / generated:.0%} "
+          f"({', '.join(f'{k}={v}' for k, v in sorted(summary['sources'].items()))})")
+    print(f"Latency: p50 {summary['p50'] * 1000:.0f}ms, p95 {summary['p95'] * 1000:.0f}ms, "
+          f"p99 {summary['p99'] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
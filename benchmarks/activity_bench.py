@@ -0,0 +1,95 @@
+"""Activity dashboard cost from rollups against scanning the stories
+
+Usage:
+    python benchmarks/activity_bench.py --stories 100k
+
+Builds a corpus.py store (heavy-tailed stories per user, two years of
+history) and fills the daily activity rollups with the backfill. Then,
+for users with few, typical and the most stories, times the dashboard's
+data two ways, with the library cache off:
+
+- rollups: Database.get_activity + activity.summary, as the dashboard does
+- stories: the same rows aggregated from the user's stories and chapters
+  on every render (the rollups' own query, run per user)
+
+Also reports the backfill time and save_story / delete_story latency,
+which now includes keeping the rollups current.
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import activity  # noqa: E402
+from corpus import build_corpus, parse_scale  # noqa: E402
+from database import ACTIVITY_QUERY, Database  # noqa: E402
+
+
+def median_ms(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def from_stories(path, user_id):
+    """Aggregate the user's stories for the window directly, without the rollup table"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(
+        f"SELECT * FROM ({ACTIVITY_QUERY.format(where='s.user_id = ?')}) WHERE day > date('now', ?)",
+        (user_id, user_id, f"-{activity.WINDOW_DAYS} days"))]
+    conn.close()
+    return activity.summary(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="100k")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="activity-bench-"), "stories.db")
+    print(f"building {args.stories} stories ...", file=sys.stderr)
+    build_corpus(path, parse_scale(args.stories), seed=args.seed)
+    db = Database(path, cache=None)
+
+    start = time.perf_counter()
+    users, rows = db.rebuild_activity()
+    print(f"backfill: {rows:,} rollup rows for {users:,} users in {time.perf_counter() - start:.1f}s\n")
+
+    conn = sqlite3.connect(path)
+    counts = conn.execute('SELECT user_id, COUNT(*) FROM stories GROUP BY user_id ORDER BY COUNT(*)').fetchall()
+    conn.close()
+    picks = [("fewest", counts[0]), ("median", counts[len(counts) // 2]),
+             ("p99", counts[int(len(counts) * 0.99)]), ("most", counts[-1])]
+
+    print(f"{'user':<8} {'stories':>8} {'rollups':>10} {'stories scan':>13}")
+    for label, (user_id, stories) in picks:
+        rollup = median_ms(lambda: activity.summary(db.get_activity(user_id)))
+        scan = median_ms(lambda: from_stories(path, user_id))
+        assert activity.summary(db.get_activity(user_id)) == from_stories(path, user_id)
+        print(f"{label:<8} {stories:>8,} {rollup:8.2f}ms {scan:11.2f}ms")
+
+    user_id = counts[-1][0]
+    saves, deletes = [], []
+    for _ in range(200):
+        start = time.perf_counter()
+        story_id = db.save_story(user_id, "Bench", "a lighthouse keeper", "The fog came in. " * 60, "Fantasy")
+        saves.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        db.delete_story(story_id, user_id)
+        deletes.append((time.perf_counter() - start) * 1000)
+    print(f"\nsave_story median {statistics.median(saves):.2f}ms, delete_story median {statistics.median(deletes):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Load test for the JSON API (api.py)
+
+Usage:
+    python benchmarks/api_load.py --url http://127.0.0.1:8000 \
+        --email demo@example.com --password secret --workers 16 --duration 30
+
+Each worker repeatedly runs a weighted mix of library reads, favorite
+toggles and (optionally) generations, then latency percentiles and
+throughput are printed per endpoint.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def login(url, email, password):
+    response = requests.post(f"{url}/auth/token", json={"email": email, "password": password}, timeout=10)
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+def worker(url, token, deadline, generate_weight, results, errors, lock):
+    session = requests.Session()  # keep-alive per worker
+    session.headers["Authorization"] = f"Bearer {token}"
+    story_ids = []
+
+    operations = [
+        ("list", 5), ("search", 3), ("stats", 2), ("detail", 3), ("favorite", 1), ("generate", generate_weight)
+    ]
+    names = [name for name, weight in operations if weight]
+    weights = [weight for name, weight in operations if weight]
+
+    while time.monotonic() < deadline:
+        op = random.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if op == "list":
+                response = session.get(f"{url}/stories", params={"limit": 20}, timeout=30)
+                if response.ok:
+                    story_ids = [s["story_id"] for s in response.json()["stories"]] or story_ids
+            elif op == "search":
+                response = session.get(f"{url}/stories", params={"q": random.choice(["the", "dragon", "night"])},
+                                       timeout=30)
+            elif op == "stats":
+                response = session.get(f"{url}/stats", timeout=30)
+            elif op == "detail":
+                if not story_ids:
+                    continue
+                response = session.get(f"{url}/stories/{random.choice(story_ids)}", timeout=30)
+            elif op == "favorite":
+                if not story_ids:
+                    continue
+                response = session.post(f"{url}/stories/{random.choice(story_ids)}/favorite", timeout=30)
+            else:
+                response = session.post(f"{url}/generate", json={
+                    "prompt": "a lighthouse keeper who hears music in the fog",
+                    "genre": random.choice(["Fantasy", "Mystery", "Horror"]),
+                    "length": random.choice([150, 300, 500]),
+                    "save": True
+                }, timeout=60)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.ok:
+                    results[op].append(elapsed)
+                else:
+                    errors[f"{op}:{response.status_code}"] += 1
+        except requests.RequestException as e:
+            with lock:
+                errors[f"{op}:{type(e).__name__}"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--generate-weight", type=int, default=1,
+                        help="relative weight of /generate calls (0 for read/write only)")
+    args = parser.parse_args()
+
+    token = login(args.url, args.email, args.password)
+    results = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    threads = [
+        threading.Thread(target=worker, args=(args.url, token, deadline, args.generate_weight, results, errors, lock))
+        for _ in range(args.workers)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+
+    total = sum(len(samples) for samples in results.values())
+    print(f"{args.workers} workers, {wall:.1f}s, {total} requests, {total / wall:.1f} req/s")
+    print(f"{'endpoint':<10} {'count':>7} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for op, samples in sorted(results.items()):
+        print(f"{op:<10} {len(samples):>7} {statistics.mean(samples) * 1000:>9.1f} "
+              f"{percentile(samples, 50) * 1000:>8.1f} {percentile(samples, 95) * 1000:>8.1f} "
+              f"{percentile(samples, 99) * 1000:>8.1f}")
+    if errors:
+        print("errors:", dict(errors))
+
+
+if __name__ == "__main__":
+    main()
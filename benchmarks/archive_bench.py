@@ -0,0 +1,101 @@
+"""Database size and read latency before and after archiving old stories
+
+Usage:
+    python benchmarks/archive_bench.py --stories 100k --after-days 180
+
+Builds a corpus.py store whose stories span two years of edits. Runs the
+archive job with --after-days (no story has been opened, so idle days
+do not matter), then VACUUMs. Reports:
+
+- the job's time
+- the database file before and after, and the archive file
+- get_story latency for recent stories and for archived ones
+- a page of the busiest user's library, which reads archived text for
+  every old story on the page
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import build_corpus, parse_scale  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def report(title, rows):
+    print(f"{title:<28} {'median':>9} {'p95':>9}")
+    for name, fn, calls in rows:
+        median, p95 = timed(fn, calls)
+        print(f"  {name:<26} {median:>7.3f}ms {p95:>7.3f}ms")
+
+
+def timed(fn, calls):
+    for args in calls:
+        fn(*args)  # the day's first get_story records read_at; time the reads after it
+    samples = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), sorted(samples)[int(len(samples) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="100k")
+    parser.add_argument("--after-days", type=int, default=180)
+    parser.add_argument("--reads", type=int, default=500, help="get_story calls per group")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="archive-bench-"), "stories.db")
+    print(f"building {args.stories} stories ...", file=sys.stderr)
+    build_corpus(path, parse_scale(args.stories), seed=args.seed)
+    db = Database(path, cache=None)
+    conn = sqlite3.connect(path)
+    cutoff = f"-{args.after_days} days"
+    old = [row for row in conn.execute(
+        "SELECT story_id, user_id FROM stories WHERE updated_at < datetime('now', ?)", (cutoff,))]
+    recent = [row for row in conn.execute(
+        "SELECT story_id, user_id FROM stories WHERE updated_at >= datetime('now', ?)", (cutoff,))]
+    busiest = conn.execute('SELECT user_id FROM stories GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+    conn.close()
+    rng = random.Random(args.seed)
+    old, recent = rng.sample(old, min(args.reads, len(old))), rng.sample(recent, min(args.reads, len(recent)))
+    pages = [(busiest, 50, offset) for offset in range(0, 2000, 50)]
+
+    before = os.path.getsize(path)
+    rows = [("get_story (recent)", db.get_story, recent), ("get_story (old)", db.get_story, old),
+            ("library page of 50", db.get_user_stories, pages)]
+    report("before archiving", rows)
+
+    start = time.perf_counter()
+    stories, text = db.archive_stories(after_days=args.after_days, idle_days=0)
+    job = time.perf_counter() - start
+    # The reads above marked their stories as opened; archive those too so old means archived
+    conn = sqlite3.connect(path)
+    conn.execute('UPDATE stories SET read_at = NULL')
+    conn.commit()
+    conn.close()
+    more, more_text = db.archive_stories(after_days=args.after_days, idle_days=0)
+    stories, text = stories + more, text + more_text
+    start = time.perf_counter()
+    db.vacuum()
+    vacuum = time.perf_counter() - start
+
+    status = db.archive_status()
+    print(f"\narchived {stories:,} stories ({text / 1e6:.1f} MB of text) in {job:.1f}s, vacuum {vacuum:.1f}s")
+    print(f"database {before / 1e6:.1f} MB -> {status['db_bytes'] / 1e6:.1f} MB, "
+          f"archive {status['archive_bytes'] / 1e6:.1f} MB ({status['archive_bytes'] / text:.0%} of the text)\n")
+    report("after archiving", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Request latency while backup.py snapshots and ships the database
+
+Usage:
+    python benchmarks/backup_bench.py --stories 100k --seconds 20 --ship-interval 1
+
+Builds a corpus.py store, then runs the same request mix for --seconds
+three times: with no backup running, while `backup.py snapshot` copies
+the database, and while `backup.py ship` copies WAL frames every
+--ship-interval seconds. Each request is a get_story, or one time in
+--write-every an update_story that appends a sentence. The backup runs
+in its own process, as it would next to the app.
+
+Reports get_story and update_story latency (median, p95, p99, max) per
+phase, how long the snapshot took and how much WAL was shipped.
+
+Then checks restores across a shipper restart. The shipper runs twice
+for --restart-seconds each, saving a story every 20 ms, while the
+benchmark keeps a connection open, as the app does, so the second run
+finds the same live WAL. Restoring to each snapshot, and to a sample of
+segments, must bring back every story saved before that time.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import backup  # noqa: E402
+from corpus import build_corpus, parse_scale  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def backup_process(workdir, *args):
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "backup.py"), "--dir", "backups", *args],
+                            cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def manifest(workdir):
+    path = os.path.join(workdir, "backups", "stories.db", "manifest.json")
+    if not os.path.exists(path):
+        return {"snapshots": [], "segments": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def run_requests(db, stories, seconds, write_every, rng, until=None):
+    """Requests for seconds (or until until() is true, if later); returns (read, write) latencies in ms"""
+    reads, writes = [], []
+    start = time.perf_counter()
+    n = 0
+    while time.perf_counter() - start < seconds or (until is not None and not until()):
+        story_id, user_id = rng.choice(stories)
+        n += 1
+        began = time.perf_counter()
+        if n % write_every == 0:
+            story = db.get_story(story_id, user_id)
+            db.update_story(story_id, user_id, content=story["content"] + " The night grew quiet.")
+            writes.append((time.perf_counter() - began) * 1000)
+        else:
+            db.get_story(story_id, user_id)
+            reads.append((time.perf_counter() - began) * 1000)
+    return reads, writes
+
+
+def summary(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(len(samples) * q), len(samples) - 1)]  # noqa: E731
+    return (f"{len(samples):>7}  {statistics.median(samples):>7.2f}ms {pick(0.95):>7.2f}ms "
+            f"{pick(0.99):>7.2f}ms {samples[-1]:>8.1f}ms")
+
+
+def check_restart(workdir, db, seconds, interval, points=8):
+    """Ship twice with a restart in between, then restore to points times; returns (restores, misses)"""
+    conn = sqlite3.connect(db.db_name)
+    user_id = conn.execute('SELECT user_id FROM users LIMIT 1').fetchone()[0]
+    conn.close()
+    saved = []
+    for _ in range(2):
+        ship = backup_process(workdir, "ship", "--interval", str(interval))
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            saved.append((db.save_story(user_id, "Restart", "a shipper restart", "The tide went out. " * 40),
+                          backup.now()))
+            time.sleep(0.02)
+        ship.send_signal(signal.SIGINT)
+        ship.wait()
+
+    root = os.path.join(workdir, "backups")
+    shipped = manifest(workdir)
+    first = saved[0][1]
+    times = [s["taken_at"] for s in shipped["snapshots"] if s["taken_at"] >= first]
+    segments = [s["shipped_at"] for s in shipped["segments"] if s["shipped_at"] >= times[0]]
+    times += segments[::max(len(segments) // points, 1)]
+    misses = 0
+    target = os.path.join(workdir, "restored")
+    for at in sorted(times):
+        backup.restore_all(target, root, at)
+        conn = sqlite3.connect(os.path.join(target, "stories.db"))
+        restored = {row[0] for row in conn.execute("SELECT story_id FROM stories WHERE title = 'Restart'")}
+        conn.close()
+        missing = [story_id for story_id, saved_at in saved if saved_at <= at and story_id not in restored]
+        if missing:
+            misses += 1
+            print(f"restore to {at}: {len(missing)} stories saved before it are missing", file=sys.stderr)
+    return len(times), misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="100k")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--ship-interval", type=float, default=1.0)
+    parser.add_argument("--write-every", type=int, default=10, help="one update_story per this many requests")
+    parser.add_argument("--restart-seconds", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="backup-bench-")
+    path = os.path.join(workdir, "stories.db")
+    print(f"building {args.stories} stories ...", file=sys.stderr)
+    build_corpus(path, parse_scale(args.stories), seed=args.seed)
+    db = Database(path, cache=None)
+    conn = sqlite3.connect(path)
+    stories = conn.execute('SELECT story_id, user_id FROM stories').fetchall()
+    conn.close()
+    rng = random.Random(args.seed)
+    results = []
+
+    results.append(("no backup", *run_requests(db, stories, args.seconds, args.write_every, rng)))
+
+    snapshot = backup_process(workdir, "snapshot")
+    start = time.perf_counter()
+    results.append(("during snapshot", *run_requests(db, stories, 0, args.write_every, rng,
+                                                      until=lambda: snapshot.poll() is not None)))
+    took = time.perf_counter() - start
+    if snapshot.returncode:
+        raise SystemExit(snapshot.stderr.read().decode())
+    size = manifest(workdir)["snapshots"][-1]["bytes"]
+
+    ship = backup_process(workdir, "ship", "--interval", str(args.ship_interval))
+    # Skip its opening snapshot, measured above
+    while len(manifest(workdir)["snapshots"]) < 2 and ship.poll() is None:
+        time.sleep(0.1)
+    shipped_before = len(manifest(workdir)["segments"])
+    results.append((f"shipping every {args.ship_interval:g}s",
+                    *run_requests(db, stories, args.seconds, args.write_every, rng)))
+    ship.send_signal(signal.SIGINT)
+    ship.wait()
+    segments = manifest(workdir)["segments"][shipped_before:]
+
+    print(f"\nsnapshot of {os.path.getsize(path) / 1e6:.1f} MB took {took:.1f}s ({size / 1e6:.1f} MB stored); "
+          f"shipped {len(segments)} WAL segments, {sum(s['end'] - s['start'] for s in segments) / 1e6:.1f} MB\n")
+    print(f"{'':<24} {'':<10} {'count':>7}  {'median':>9} {'p95':>9} {'p99':>9} {'max':>10}")
+    for name, reads, writes in results:
+        print(f"{name:<24} get_story  {summary(reads)}")
+        print(f"{'':<24} update     {summary(writes)}")
+
+    # The app keeps the WAL open across the restart, so the second run copies the same generation again
+    hold = sqlite3.connect(path)
+    restores, misses = check_restart(workdir, db, args.restart_seconds, args.ship_interval)
+    hold.close()
+    print(f"\nshipper restart: {misses} of {restores} restores were missing stories saved before their time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Synthetic users and stories for database benchmarks
+
+Usage:
+    python benchmarks/corpus.py --stories 1000000 --out bench_data/1m.db
+
+Builds a stories.db-compatible file with the schema from Database.init_db:
+
+- stories per user follow a heavy-tailed (Pareto) distribution, so a few
+  users own thousands of stories and most own a handful
+- lengths follow the app's length slider (100-800 words, mostly near the
+  300-word default); genres are skewed towards Fantasy and Adventure
+- text is cut from template-engine stories of the same genre, created_at
+  rises with story_id over the last two years, ~10% are favorites
+
+Rows are written with executemany in large transactions with
+synchronous=OFF, and the story indexes are built after the load: about
+35k stories/s on one core, so 10M rows take around five minutes (and
+roughly 30 GB of disk).
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from template_engine import LIBRARIES, compose_story  # noqa: E402
+
+LENGTHS = list(range(100, 801, 50))
+LENGTH_WEIGHTS = [4, 5, 8, 10, 20, 9, 8, 6, 5, 4, 3, 2, 2, 2, 2]
+GENRE_WEIGHTS = {"Fantasy": 22, "Adventure": 16, "Mystery": 12, "Sci-Fi": 12, "Romance": 10,
+                 "Horror": 8, "Comedy": 8, "Thriller": 7, "Drama": 5}
+PROMPTS = ["a dragon who is afraid of fire", "a detective on a night train", "a robot learning to paint",
+           "two rivals stuck in a lift", "a lighthouse keeper who hears music in the fog",
+           "a map that redraws itself", "the last bakery on the moon", "a letter delivered fifty years late"]
+TAGS = ["draft", "kids", "dark", "short", "series", "favourite-world", "contest", "bedtime"]
+STORIES_PER_USER = 40  # mean, when the user count is not given
+HISTORY_DAYS = 730
+INDEXES = ["idx_user_stories", "idx_story_genre", "idx_story_favorite"]
+
+
+def parse_scale(value: str) -> int:
+    """'10k', '2.5m' or '100000' -> row count"""
+    value = value.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+def user_id_for(index: int) -> str:
+    return hashlib.md5(f"bench{index}@example.com".encode()).hexdigest()
+
+
+def _word_pools(rng: random.Random, words_per_genre: int = 20_000):
+    """Long runs of template text per genre to slice story bodies from"""
+    pools = {}
+    for genre in GENRE_WEIGHTS:
+        genre_key = genre if genre in LIBRARIES else next(iter(LIBRARIES))
+        words = []
+        while len(words) < words_per_genre:
+            words.extend(compose_story(rng.choice(PROMPTS), genre_key, 800, rng=rng).split())
+        pools[genre] = words
+    return pools
+
+
+def build_corpus(path: str, stories: int, users: int = 0, seed: int = 0, batch_size: int = 50_000,
+                 progress: bool = False) -> Dict:
+    """Create path (replacing it) with the given number of synthetic stories"""
+    rng = random.Random(seed)
+    users = users or max(stories // STORIES_PER_USER, 1)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    db = Database(path, cache=None)
+    db.init_db()  # the file may have been initialized (and deleted) earlier in this process
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    for index in INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {index}')
+
+    start = time.perf_counter()
+    now = datetime.now().replace(microsecond=0)
+    conn.executemany('INSERT INTO users (user_id, email, display_name, created_at, last_login) VALUES (?, ?, ?, ?, ?)', (
+        (user_id_for(i), f"bench{i}@example.com", f"Bench {i}",
+         str(now - timedelta(days=rng.uniform(0, HISTORY_DAYS))), str(now))
+        for i in range(users)
+    ))
+    conn.commit()
+
+    # Heavy-tailed ownership: cumulative Pareto weights, sampled per batch
+    cum_weights = list(itertools.accumulate(rng.paretovariate(1.5) for _ in range(users)))
+    user_ids = [user_id_for(i) for i in range(users)]
+    pools = _word_pools(rng)
+    genres, genre_weights = list(GENRE_WEIGHTS), list(GENRE_WEIGHTS.values())
+    first = now - timedelta(days=HISTORY_DAYS)
+    step = HISTORY_DAYS * 86400 / stories
+
+    written = 0
+    while written < stories:
+        count = min(batch_size, stories - written)
+        owners = rng.choices(user_ids, cum_weights=cum_weights, k=count)
+        story_genres = rng.choices(genres, genre_weights, k=count)
+        lengths = rng.choices(LENGTHS, LENGTH_WEIGHTS, k=count)
+        rows = []
+        for i in range(count):
+            genre, length = story_genres[i], lengths[i]
+            pool = pools[genre]
+            offset = rng.randrange(len(pool) - length)
+            prompt = rng.choice(PROMPTS)
+            created = str(first + timedelta(seconds=int((written + i) * step)))
+            rows.append((
+                owners[i], f"{genre} story {written + i}", prompt, " ".join(pool[offset:offset + length]),
+                genre, round(rng.uniform(0.3, 1.0), 2), length, created, created,
+                rng.random() < 0.1, f'["{rng.choice(TAGS)}"]' if rng.random() < 0.2 else None,
+            ))
+        conn.executemany('''
+            INSERT INTO stories (user_id, title, prompt, content, genre, creativity, word_count,
+                                 created_at, updated_at, is_favorite, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        written += count
+        if progress:
+            rate = written / (time.perf_counter() - start)
+            print(f"\r  {written:,}/{stories:,} stories ({rate:,.0f}/s)", end="", file=sys.stderr, flush=True)
+    conn.close()
+    if progress:
+        print(file=sys.stderr)
+
+    db.init_db()  # recreates the indexes
+    conn = sqlite3.connect(path)
+    conn.execute('ANALYZE')
+    conn.close()
+    return {"path": path, "stories": stories, "users": users, "seed": seed,
+            "seconds": round(time.perf_counter() - start, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="100k", help="number of stories (10k, 1m, ...)")
+    parser.add_argument("--users", type=int, default=0, help=f"default: stories / {STORIES_PER_USER}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_data/corpus.db")
+    args = parser.parse_args()
+
+    info = build_corpus(args.out, parse_scale(args.stories), args.users, args.seed, progress=True)
+    size = os.path.getsize(args.out) / 1e6
+    print(f"{info['stories']:,} stories for {info['users']:,} users in {info['seconds']}s -> {args.out} ({size:,.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Per-method Database benchmark at several corpus sizes
+
+Usage:
+    python benchmarks/db_bench.py --scales 10k,100k,1m
+    python benchmarks/db_bench.py --scales 10k,100k,1m --baseline benchmarks/db_baseline.json
+    python benchmarks/db_bench.py --scales 10k,100k,1m --compare benchmarks/db_baseline.json
+
+For each scale a synthetic corpus (corpus.py) is built once under
+--data-dir and reused by later runs with the same scale and seed. Every
+Database method is then timed with the library cache off, for the user
+who owns the most stories and for the median user. Writes are undone
+(save then delete, toggle twice, update then restore) so the corpus can
+be reused.
+
+Prints the median latency of each method per scale. --baseline saves
+median and p95 as JSON; --compare prints old -> new per cell and exits 1
+if any median grew by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import build_corpus, parse_scale  # noqa: E402
+from database import Database  # noqa: E402
+
+CONTENT = " ".join(["The lantern swung as the ferry crossed the dark water."] * 30)
+
+
+def scale_label(rows):
+    if rows >= 1_000_000 and rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}m"
+    if rows >= 1_000 and rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def corpus_path(data_dir, rows, seed, rebuild):
+    path = os.path.join(data_dir, f"corpus-{scale_label(rows)}-{seed}.db")
+    if rebuild or not os.path.exists(path):
+        print(f"building {scale_label(rows)} corpus -> {path}", file=sys.stderr)
+        build_corpus(path, rows, seed=seed, progress=True)
+    return path
+
+
+def sample_users(db):
+    """(heaviest user, median user) by story count"""
+    conn = db.get_connection()
+    rows = conn.execute('SELECT user_id, COUNT(*) AS n FROM stories GROUP BY user_id ORDER BY n DESC').fetchall()
+    conn.close()
+    return rows[0]['user_id'], rows[len(rows) // 2]['user_id']
+
+
+def cases(db, heavy, median):
+    """(name, callable) pairs; each callable leaves the corpus as it found it"""
+    story_id = db.get_user_stories(heavy, limit=1)[0]['story_id']
+    original = db.get_story(story_id, heavy)['content']
+    genre = db.get_genres()[0]
+
+    def save_then_delete():
+        db.delete_story(db.save_story(heavy, "Bench", "a bench prompt", CONTENT, genre="Fantasy"), heavy)
+
+    def save_batch_then_delete():
+        for new_id in db.save_stories(heavy, [{"title": "Bench", "prompt": "p", "content": CONTENT}] * 20):
+            db.delete_story(new_id, heavy)
+
+    def toggle_twice():
+        db.toggle_favorite(story_id, heavy)
+        db.toggle_favorite(story_id, heavy)
+
+    def update_and_restore():
+        db.update_story(story_id, heavy, content=CONTENT)
+        db.update_story(story_id, heavy, content=original)
+
+    def iterate_texts():
+        for _ in zip(range(5000), db.iter_story_texts()):
+            pass
+
+    return [
+        ("get_user", lambda: db.get_user(heavy)),
+        ("create_or_update_user", lambda: db.create_or_update_user(median, "bench-median@example.com", "Median")),
+        ("get_user_stories (heavy)", lambda: db.get_user_stories(heavy, limit=20)),
+        ("get_user_stories (median)", lambda: db.get_user_stories(median, limit=20)),
+        ("get_user_stories (deep page)", lambda: db.get_user_stories(heavy, limit=20, offset=1000)),
+        ("get_user_stories (genre)", lambda: db.get_user_stories(heavy, limit=20, genre=genre)),
+        ("get_user_stories (favorites)", lambda: db.get_user_stories(heavy, limit=20, favorite_only=True)),
+        ("get_user_stories (collapsed)", lambda: db.get_user_stories(heavy, limit=20, collapse_duplicates=True)),
+        ("count_stories (heavy)", lambda: db.count_stories(heavy)),
+        ("count_stories (query)", lambda: db.count_stories(heavy, query="lantern")),
+        ("search_stories (heavy)", lambda: db.search_stories(heavy, "dragon", limit=20)),
+        ("search_stories (median)", lambda: db.search_stories(median, "dragon", limit=20)),
+        ("search_stories (no match)", lambda: db.search_stories(heavy, "zzqxj", limit=20)),
+        ("get_stats (heavy)", lambda: db.get_stats(heavy)),
+        ("get_stats (median)", lambda: db.get_stats(median)),
+        ("get_story", lambda: db.get_story(story_id, heavy)),
+        ("find_duplicates", lambda: db.find_duplicates(story_id, heavy)),
+        ("get_suggestion_terms (heavy)", lambda: db.get_suggestion_terms(heavy)),
+        ("get_genres", db.get_genres),
+        ("iter_story_texts (5k rows)", iterate_texts),
+        ("save_story + delete_story", save_then_delete),
+        ("save_stories x20 + deletes", save_batch_then_delete),
+        ("toggle_favorite x2", toggle_twice),
+        ("update_story x2", update_and_restore),
+    ]
+
+
+def time_case(fn, repeat, budget):
+    """Median and p95 in ms over up to `repeat` calls, stopping after `budget` seconds"""
+    fn()  # warm the page cache
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < repeat and (len(samples) < 3 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"median_ms": statistics.median(samples),
+            "p95_ms": samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))],
+            "runs": len(samples)}
+
+
+def bench_scale(path, repeat, budget):
+    db = Database(path, cache=None)
+    heavy, median = sample_users(db)
+    return {name: time_case(fn, repeat, budget) for name, fn in cases(db, heavy, median)}
+
+
+def print_table(results):
+    labels = list(results)
+    names = list(next(iter(results.values())))
+    width = max(len(name) for name in names)
+    print(f"{'median ms':<{width}}" + "".join(f"{label:>10}" for label in labels))
+    for name in names:
+        print(f"{name:<{width}}" + "".join(f"{results[label][name]['median_ms']:>10.2f}" for label in labels))
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["scales"]
+    regressed = False
+    for label, timings in results.items():
+        for name, timing in timings.items():
+            before = baseline.get(label, {}).get(name)
+            if not before:
+                continue
+            change = timing["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+            flag = "REGRESSED" if change > tolerance else ""
+            regressed |= change > tolerance
+            print(f"  {label:>5} {name:<30} {before['median_ms']:>9.2f} -> {timing['median_ms']:>9.2f} ms "
+                  f"({change:+.0%}) {flag}")
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10k,100k", help="comma-separated story counts (10k, 1m, ...)")
+    parser.add_argument("--data-dir", default="bench_data", help="where corpora are kept between runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rebuild", action="store_true", help="regenerate corpora even if present")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per method")
+    parser.add_argument("--budget", type=float, default=2.0, help="max seconds per method (min 3 calls)")
+    parser.add_argument("--baseline", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median increase for --compare")
+    args = parser.parse_args()
+
+    results = {}
+    for rows in (parse_scale(scale) for scale in args.scales.split(",")):
+        path = corpus_path(args.data_dir, rows, args.seed, args.rebuild)
+        results[scale_label(rows)] = bench_scale(path, args.repeat, args.budget)
+    print_table(results)
+
+    if args.baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "repeat": args.repeat, "scales": results}, f, indent=2)
+    if args.compare:
+        print(f"\ncompared with {args.compare}:")
+        if not compare(results, args.compare, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Memory and time of a bulk export, streamed against loaded-in-memory
+
+Usage:
+    python benchmarks/export_bench.py --stories 10k
+
+Builds a corpus.py store where a single user owns every story, then
+exports the whole library in each format two ways:
+
+- streamed: export.export_file, which writes stories from
+  Database.iter_user_stories into a spooled temporary file
+- in memory: every story and its chapters loaded into a list first,
+  then the archive built in a BytesIO (how a naive export does it)
+
+Reports each run's wall time, archive size and peak Python allocation
+(tracemalloc), plus the process's peak RSS at the end. Each variant
+runs in a fresh subprocess so one run's peak doesn't hide another's.
+"""
+import argparse
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import export  # noqa: E402
+from corpus import build_corpus, parse_scale, user_id_for  # noqa: E402
+from database import Database  # noqa: E402
+
+USER = user_id_for(0)
+
+
+def in_memory(db, fmt, out):
+    stories = []
+    offset = 0
+    while True:
+        page = db.get_user_stories(USER, limit=500, offset=offset)
+        if not page:
+            break
+        for story in page:
+            stories.append(dict(story, chapters=db.get_chapters(story['story_id'], USER)))
+        offset += len(page)
+    if fmt == "zip":
+        return export.write_zip(stories, out)
+    return export.write_epub(stories, out)
+
+
+def run(path, fmt, mode):
+    db = Database(path, cache=None)
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "streamed":
+        spool, count = export.export_file(db, USER, fmt)
+    else:
+        spool = io.BytesIO()
+        count = in_memory(db, fmt, spool)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    size = spool.seek(0, os.SEEK_END)
+    spool.close()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(f"{fmt:<5} {mode:<10} {count:>7,} stories  {seconds:6.2f}s  {size / 1e6:7.1f} MB archive  "
+          f"peak alloc {peak / 1e6:7.1f} MB  peak RSS {rss:6.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="10k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run", nargs=3, metavar=("PATH", "FORMAT", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(*args.run)
+        return
+
+    path = os.path.join(tempfile.mkdtemp(prefix="export-bench-"), "stories.db")
+    print(f"building {args.stories} stories ...", file=sys.stderr)
+    build_corpus(path, parse_scale(args.stories), users=1, seed=args.seed)
+    for fmt in export.FORMATS:
+        for mode in ("streamed", "in-memory"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--run", path, fmt, mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
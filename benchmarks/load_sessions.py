@@ -0,0 +1,244 @@
+"""Concurrent-session load test for the Streamlit app
+
+Usage:
+    python benchmarks/load_sessions.py --sessions 1,5,10,20 --duration 20
+    python benchmarks/load_sessions.py --sessions 1,5,10,20 --baseline benchmarks/sessions_baseline.json
+    python benchmarks/load_sessions.py --sessions 1,5,10,20 --compare benchmarks/sessions_baseline.json
+
+Each simulated user is a streamlit.testing.v1.AppTest session running
+app.py, already authenticated, doing a weighted mix of generating
+stories, browsing and paging the library, searching and toggling
+favorites. Generation goes to the OpenAI stub server
+(openai_stub_server.py) through the backend registry, with --hf-delay
+standing in for remote latency.
+
+AppTest keeps the Streamlit runtime in a process-wide singleton, so
+sessions cannot share a process; each one runs in its own worker
+process against the same stories.db and stub server. That measures
+SQLite contention and backend concurrency limits, but not GIL contention
+between sessions inside one `streamlit run` process.
+
+For each concurrency level it reports rerun latency percentiles,
+throughput, "database is locked" errors and other script exceptions.
+--baseline writes the results as JSON; --compare fails (exit 1) if a
+level's p95 rerun latency regressed by more than --tolerance.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import multiprocessing
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+APP = os.path.join(REPO, "app.py")
+PROMPTS = ["a dragon who is afraid of fire", "a detective on a night train", "a robot learning to paint",
+           "two rivals stuck in a lift", "a lighthouse keeper who hears music in the fog"]
+SEARCHES = ["dragon", "night", "robot", "the", "music"]
+ACTIONS = [("generate", 2), ("browse", 4), ("page", 2), ("search", 3), ("favorite", 2)]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def user_for(index):
+    email = f"load{index}@example.com"
+    return {'user_id': hashlib.md5(email.encode()).hexdigest(), 'email': email, 'display_name': f"Load {index}"}
+
+
+def seed_library(users, stories_per_user):
+    from database import Database
+    from template_engine import compose_story
+
+    db = Database()
+    for user in users:
+        db.create_or_update_user(user['user_id'], user['email'], user['display_name'])
+        db.save_stories(user['user_id'], [
+            {"title": f"Seed {i}", "prompt": PROMPTS[i % len(PROMPTS)], "genre": "Fantasy",
+             "content": compose_story(PROMPTS[i % len(PROMPTS)], "Fantasy", 300)}
+            for i in range(stories_per_user)
+        ])
+
+
+class Session:
+    """One authenticated AppTest session and its counters"""
+
+    def __init__(self, user, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.at.session_state['authenticated'] = True
+        self.at.session_state['user'] = user
+        self.latencies = []
+        self.lock_errors = 0
+        self.exceptions = 0
+        self.stories = 0
+        self.rng = random.Random(user['user_id'])
+
+    def run(self, element=None):
+        """Rerun the script (through a widget if given) and record latency and errors"""
+        start = time.perf_counter()
+        (element or self.at).run()
+        self.latencies.append(time.perf_counter() - start)
+        for exception in self.at.exception:
+            if "database is locked" in str(exception.message):
+                self.lock_errors += 1
+            else:
+                self.exceptions += 1
+
+    def goto(self, page):
+        radio = self.at.sidebar.radio[0]
+        if radio.value != page:
+            self.run(radio.set_value(page))
+
+    def generate(self):
+        self.goto("✍️ Generate Story")
+        self.at.text_area[0].input(self.rng.choice(PROMPTS))
+        self.at.text_input[0].input(f"Load story {len(self.latencies)}")
+        self.run(self.at.button(key="generate_story_btn").click())
+        self.stories += 1
+
+    def browse(self):
+        self.goto("📚 My Library")
+        self.run()
+
+    def page(self):
+        self.goto("📚 My Library")
+        buttons = [b for b in self.at.button if b.key == "page_next" and not b.disabled]
+        self.run(buttons[0].click() if buttons else None)
+
+    def search(self):
+        self.goto("📚 My Library")
+        self.run(self.at.text_input(key="library_search").input(self.rng.choice(SEARCHES)))
+
+    def favorite(self):
+        self.goto("📚 My Library")
+        buttons = [b for b in self.at.button if (b.key or "").startswith("fav_")]
+        if buttons:
+            self.run(self.rng.choice(buttons).click())
+
+    def loop(self, deadline):
+        self.run()
+        names = [name for name, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(names, weights)[0])()
+
+
+def _worker(user, duration, timeout, ready, results):
+    session = Session(user, timeout)
+    session.run()  # first run imports the app; not part of the measured window
+    session.latencies.clear()
+    ready.wait()
+    started = time.perf_counter()
+    session.loop(time.monotonic() + duration)
+    results.put({"latencies": session.latencies, "stories": session.stories,
+                 "lock_errors": session.lock_errors, "exceptions": session.exceptions,
+                 "elapsed": time.perf_counter() - started})
+
+
+def run_level(count, duration, timeout):
+    ready = multiprocessing.Barrier(count)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, args=(user_for(i), duration, timeout, ready, results))
+               for i in range(count)]
+    for worker in workers:
+        worker.start()
+    sessions = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = max(session["elapsed"] for session in sessions)
+
+    latencies = [latency for session in sessions for latency in session["latencies"]]
+    return {
+        "sessions": count,
+        "reruns": len(latencies),
+        "reruns_per_sec": len(latencies) / elapsed,
+        "stories_per_sec": sum(session["stories"] for session in sessions) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "lock_errors": sum(session["lock_errors"] for session in sessions),
+        "exceptions": sum(session["exceptions"] for session in sessions),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {level["sessions"]: level for level in json.load(f)["levels"]}
+    regressed = False
+    for level in results:
+        before = baseline.get(level["sessions"])
+        if not before:
+            continue
+        change = level["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        flag = "REGRESSED" if change > tolerance else "ok"
+        regressed |= change > tolerance or level["lock_errors"] > before["lock_errors"]
+        print(f"  {level['sessions']:>4} sessions: p95 {before['p95_ms']:.0f} -> {level['p95_ms']:.0f} ms "
+              f"({change:+.0%}), lock errors {before['lock_errors']} -> {level['lock_errors']}  {flag}")
+    return not regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,5,10,20", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--hf-delay", type=float, default=0.5, help="stub generation latency in seconds")
+    parser.add_argument("--seed-stories", type=int, default=40, help="stories per user before the run")
+    parser.add_argument("--timeout", type=float, default=60.0, help="AppTest rerun timeout")
+    parser.add_argument("--baseline", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase for --compare")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.sessions.split(",")]
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    compare_with = os.path.abspath(args.compare) if args.compare else None
+
+    from openai_stub_server import start_server
+
+    server = start_server(delay=args.hf_delay)
+    workdir = tempfile.mkdtemp(prefix="storygen-load-")
+    os.chdir(workdir)  # stories.db, users.json and telemetry.db go here
+    os.environ["GENERATION_BACKENDS"] = json.dumps([
+        {"type": "openai", "name": "stub", "base_url": f"http://127.0.0.1:{server.server_address[1]}",
+         "priority": 10, "max_concurrency": 64},
+        {"type": "template", "priority": 20},
+    ])
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("TELEMETRY_DB", os.path.join(workdir, "telemetry.db"))
+
+    seed_library([user_for(i) for i in range(max(levels))], args.seed_stories)
+
+    results = []
+    print(f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'story/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'locked':>7} {'errors':>7}")
+    for count in levels:
+        level = run_level(count, args.duration, args.timeout)
+        results.append(level)
+        print(f"{level['sessions']:>8} {level['reruns']:>7} {level['reruns_per_sec']:>8.1f} "
+              f"{level['stories_per_sec']:>8.2f} {level['p50_ms']:>8.0f} {level['p95_ms']:>8.0f} "
+              f"{level['p99_ms']:>8.0f} {level['lock_errors']:>7} {level['exceptions']:>7}")
+    server.shutdown()
+
+    if baseline:
+        with open(baseline, "w", encoding="utf-8") as f:
+            json.dump({"duration": args.duration, "hf_delay": args.hf_delay, "levels": results}, f, indent=2)
+    if compare_with:
+        print(f"\ncompared with {args.compare}:")
+        if not compare(results, compare_with, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
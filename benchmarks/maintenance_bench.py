@@ -0,0 +1,141 @@
+"""Cost and effect of the maintenance jobs after heavy deletes
+
+Usage:
+    python benchmarks/maintenance_bench.py --stories 100k --delete 0.4
+
+Builds a corpus.py store, switches it to incremental auto-vacuum, then
+deletes a random --delete share of the stories. Runs every job in
+maintenance.JOBS once, while a writer thread keeps saving stories.
+Reports:
+
+- each job's time and result
+- save_story latency with no job running, and while the jobs run (the
+  worst case is how long a vacuum step or ANALYZE held the write lock)
+- the file size and free pages before and after
+- library reads before and after ANALYZE
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import maintenance  # noqa: E402
+from corpus import build_corpus, parse_scale  # noqa: E402
+from database import Database  # noqa: E402
+
+USER = "maintenance-bench"
+
+
+def space(path):
+    conn = sqlite3.connect(path)
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.close()
+    return f"{os.path.getsize(path) / 1e6:.1f} MB file, {free * page_size / 1e6:.1f} MB free"
+
+
+def latencies(samples):
+    samples = sorted(samples)
+    return (f"{len(samples):>5} saves  median {statistics.median(samples):6.2f}ms  "
+            f"p99 {samples[int(len(samples) * 0.99)]:6.2f}ms  max {samples[-1]:7.1f}ms")
+
+
+def reads(db, calls, repeat=20):
+    results = []
+    for name, fn, args in calls:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(*args)
+            samples.append((time.perf_counter() - start) * 1000)
+        results.append((name, statistics.median(samples)))
+    return results
+
+
+class Writer(threading.Thread):
+    """Saves a story every few milliseconds and records how long each save took"""
+
+    def __init__(self, db):
+        super().__init__(daemon=True)
+        self.db = db
+        self.samples = []
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            self.db.save_story(USER, "Bench", "a lighthouse keeper", "The fog came in. " * 60)
+            self.samples.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.005)
+
+
+def with_writer(db, fn):
+    writer = Writer(db)
+    writer.start()
+    try:
+        result = fn()
+    finally:
+        writer.stop.set()
+        writer.join()
+    return result, writer.samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", default="100k")
+    parser.add_argument("--delete", type=float, default=0.4, help="share of stories to delete")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="maintenance-bench-"), "stories.db")
+    print(f"building {args.stories} stories ...", file=sys.stderr)
+    build_corpus(path, parse_scale(args.stories), seed=args.seed)
+    db = Database(path, cache=None)
+    db.create_or_update_user(USER, "maintenance-bench@example.com", "Maintenance Bench")
+    start = time.perf_counter()
+    db.vacuum()
+    print(f"switched to incremental auto-vacuum in {time.perf_counter() - start:.1f}s: {space(path)}")
+
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute('SELECT story_id FROM stories')]
+    doomed = random.Random(args.seed).sample(ids, int(len(ids) * args.delete))
+    with conn:
+        conn.executemany('DELETE FROM story_chapters WHERE story_id = ?', ((i,) for i in doomed))
+        conn.executemany('DELETE FROM stories WHERE story_id = ?', ((i,) for i in doomed))
+    busiest = conn.execute('SELECT user_id FROM stories GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    print(f"deleted {len(doomed):,} stories: {space(path)}\n")
+
+    calls = [("get_user_stories (busiest)", db.get_user_stories, (busiest, 50, 0)),
+             ("count_stories (busiest)", db.count_stories, (busiest,)),
+             ("search_stories (busiest)", db.search_stories, (busiest, "dragon")),
+             ("get_global_stats", db.get_global_stats, ())]
+    before = reads(db, calls)
+
+    _, baseline = with_writer(db, lambda: time.sleep(5))
+    runs = []
+    _, during = with_writer(db, lambda: [runs.append(maintenance.run_job(db, name, force=True))
+                                         for name in maintenance.JOBS])
+    for run in runs:
+        print(f"{run['job']:<20} {run['seconds']:7.2f}s  {run['result']}")
+    print(f"\nno job running   {latencies(baseline)}")
+    print(f"jobs running     {latencies(during)}")
+    print(f"\nafter: {space(path)}\n")
+
+    after = reads(db, calls)
+    print(f"{'median read':<28} {'before':>9} {'after':>9}")
+    for (name, old), (_, new) in zip(before, after):
+        print(f"  {name:<26} {old:7.2f}ms {new:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
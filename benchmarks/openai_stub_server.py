@@ -0,0 +1,117 @@
+"""Minimal stand-in for an OpenAI-compatible completions server
+
+Usage:
+    python benchmarks/openai_stub_server.py --port 8080 [--delay 0.2]
+    python benchmarks/openai_stub_server.py --selftest
+
+Answers POST /v1/completions with template-engine stories so the "openai" backend
+can be exercised without a real llama.cpp/vLLM/Ollama server. --selftest
+starts the stub on a free port and runs the backend registry against it.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_engine import compose_story  # noqa: E402
+
+
+def make_handler(delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real servers
+
+        def do_POST(self):
+            if self.path != "/v1/completions":
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if delay:
+                time.sleep(delay)
+            max_tokens = body.get("max_tokens", 100)
+            n = body.get("n", 1)
+            words = max(int(max_tokens * 0.75), 1)
+            payload = json.dumps({
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "model": body.get("model", "stub"),
+                "choices": [{"index": i, "text": compose_story("a lighthouse", "Mystery", words),
+                             "finish_reason": "length"} for i in range(n)],
+                "usage": {"completion_tokens": max_tokens * n},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_server(port: int = 0, delay: float = 0.0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def selftest():
+    from backends import BackendRegistry
+
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    registry = BackendRegistry.from_config([
+        {"type": "openai", "name": "stub", "base_url": base_url, "priority": 10, "max_concurrency": 2,
+         "candidates": 3},
+        {"type": "template", "priority": 20},
+    ])
+
+    source, text = registry.generate("a lighthouse", "Mystery", 0.7, 120)
+    assert source == "stub", source
+    assert len(text.split()) <= 120, len(text.split())
+
+    start = time.perf_counter()
+    for _ in range(50):
+        registry.generate("a lighthouse", "Mystery", 0.7, 120)
+    per_call = (time.perf_counter() - start) / 50
+    server.shutdown()
+    server.server_close()
+
+    unreachable = BackendRegistry.from_config([
+        {"type": "openai", "name": "stub", "base_url": base_url, "priority": 10, "timeout": 2},
+        {"type": "template", "priority": 20},
+    ])
+    source, _ = unreachable.generate("a lighthouse", "Mystery", 0.7, 120)
+    assert source == "local", source
+    print(f"ok: stub backend served requests ({per_call * 1000:.1f} ms/call with keep-alive), "
+          f"fell back to templates when the server was down")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--selftest", action="store_true")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+        return
+
+    server = start_server(args.port, args.delay)
+    print(f"OpenAI stub listening on http://127.0.0.1:{args.port}/v1/completions")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
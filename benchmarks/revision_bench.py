@@ -0,0 +1,135 @@
+"""Storage and rebuild cost of story revisions
+
+Usage:
+    python benchmarks/revision_bench.py --edits 200 --words 400 --snapshot-every 5,10,20 --rewrite-words 800,2400
+
+For each SNAPSHOT_EVERY value a fresh database gets one template story,
+which is then edited --edits times through update_story. Each edit
+rewrites a few words, inserts a sentence or deletes one, the kind of
+touch-ups the edit form sees. Only the last MAX_REVISIONS revisions are
+kept, as in the app.
+
+Reports the stored revision bytes against the story size (and what full
+copies would have cost), the average delta, the time per edit, and the
+median and worst time to rebuild a kept revision with get_revision.
+
+Then, for each --rewrite-words length, times update_story when the
+whole story is replaced by a different one of that length (the worst
+case for the word diff) and reports the size of the revision stored.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import revisions  # noqa: E402
+from database import Database  # noqa: E402
+from template_engine import compose_story  # noqa: E402
+
+USER = "revision-bench"
+FILLER = ["quietly", "again", "at last", "without a word", "in the rain", "once more", "by the river"]
+
+
+def small_edit(text, rng):
+    """Reword, add or drop a little of the text"""
+    words = text.split(" ")
+    kind = rng.random()
+    if kind < 0.6:
+        for _ in range(rng.randint(1, 3)):
+            words[rng.randrange(len(words))] = rng.choice(FILLER)
+    elif kind < 0.85:
+        at = rng.randrange(len(words))
+        words[at:at] = f"The night grew {rng.choice(FILLER)}.".split()
+    else:
+        at = rng.randrange(max(len(words) - 8, 1))
+        del words[at:at + rng.randint(1, 8)]
+    return " ".join(words)
+
+
+def run(snapshot_every, edits, words, seed):
+    revisions.SNAPSHOT_EVERY = snapshot_every
+    rng = random.Random(seed)
+    path = os.path.join(tempfile.mkdtemp(prefix="revision-bench-"), "stories.db")
+    db = Database(path, cache=None)
+    db.create_or_update_user(USER, "revision-bench@example.com", "Revision Bench")
+    text = compose_story("a map that redraws itself", "Fantasy", words, rng=rng)
+    story_id = db.save_story(USER, "Bench", "a map that redraws itself", text, genre="Fantasy")
+
+    full_copies = 0
+    start = time.perf_counter()
+    for _ in range(edits):
+        full_copies += len(text.encode("utf-8"))
+        text = small_edit(text, rng)
+        db.update_story(story_id, USER, content=text)
+    per_edit = (time.perf_counter() - start) / edits * 1000
+
+    kept = db.get_revisions(story_id, USER)
+    full_copies = full_copies * len(kept) / edits
+    rebuilds = []
+    for rev in kept:
+        start = time.perf_counter()
+        db.get_revision(story_id, USER, 1, rev['revision_no'])
+        rebuilds.append((time.perf_counter() - start) * 1000)
+
+    deltas = [rev['size'] for rev in kept if not rev['is_snapshot']]
+    return {
+        "story_bytes": len(text.encode("utf-8")),
+        "kept": len(kept),
+        "stored": sum(rev['size'] for rev in kept),
+        "full_copies": full_copies,
+        "avg_delta": statistics.mean(deltas) if deltas else 0.0,
+        "edit_ms": per_edit,
+        "rebuild_median_ms": statistics.median(rebuilds),
+        "rebuild_max_ms": max(rebuilds),
+    }
+
+
+def rewrites(words, seed, repeat=5):
+    """Time update_story replacing the whole text, as a regenerate-and-save does"""
+    rng = random.Random(seed)
+    path = os.path.join(tempfile.mkdtemp(prefix="revision-bench-"), "stories.db")
+    db = Database(path, cache=None)
+    db.create_or_update_user(USER, "revision-bench@example.com", "Revision Bench")
+    text = compose_story("a map that redraws itself", "Fantasy", words, rng=rng)
+    story_id = db.save_story(USER, "Bench", "a map that redraws itself", text, genre="Fantasy")
+    times = []
+    for _ in range(repeat):
+        text = compose_story("a map that redraws itself", "Fantasy", words, rng=rng)
+        start = time.perf_counter()
+        db.update_story(story_id, USER, content=text)
+        times.append((time.perf_counter() - start) * 1000)
+    sizes = [rev['size'] for rev in db.get_revisions(story_id, USER)[:repeat]]
+    return statistics.median(times), max(times), statistics.mean(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--words", type=int, default=400, help="story length")
+    parser.add_argument("--snapshot-every", default=str(revisions.SNAPSHOT_EVERY),
+                        help="comma-separated SNAPSHOT_EVERY values")
+    parser.add_argument("--rewrite-words", default="800,2400", help="comma-separated story lengths to rewrite")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'every':>5} {'kept':>5} {'stored':>9} {'vs story':>9} {'vs copies':>10} {'avg delta':>10} "
+          f"{'edit ms':>8} {'rebuild med':>12} {'max':>7}")
+    for every in (int(n) for n in args.snapshot_every.split(",")):
+        r = run(every, args.edits, args.words, args.seed)
+        print(f"{every:>5} {r['kept']:>5} {r['stored']:>8,}B {r['stored'] / r['story_bytes']:>8.2f}x "
+              f"{r['stored'] / r['full_copies']:>9.1%} {r['avg_delta']:>9.0f}B {r['edit_ms']:>8.2f} "
+              f"{r['rebuild_median_ms']:>10.2f}ms {r['rebuild_max_ms']:>5.2f}ms")
+
+    print(f"\n{'rewrite':>7} {'median':>9} {'max':>9} {'stored':>8}")
+    for words in (int(n) for n in args.rewrite_words.split(",")):
+        median, worst, size = rewrites(words, args.seed)
+        print(f"{words:>7} {median:>7.1f}ms {worst:>7.1f}ms {size:>7,.0f}B")
+
+
+if __name__ == "__main__":
+    main()
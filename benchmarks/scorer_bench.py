@@ -0,0 +1,75 @@
+"""Speed and sanity check for the candidate scorer (scoring.py)
+
+Usage:
+    python benchmarks/scorer_bench.py [--seconds 1.0] [--bad-rate 0.3]
+
+Times pick_best over three candidates at several story lengths, checks that
+degenerate candidates (loops, prompt echo, cut-off or too-short text) rank
+below a normal story, and shows how often a request would still need a
+second round trip when one sample in --bad-rate is unusable.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from huggingface_client import build_hf_prompt  # noqa: E402
+from scoring import MIN_SCORE, pick_best, score_story  # noqa: E402
+from template_engine import LIBRARIES, compose_story  # noqa: E402
+
+LENGTHS = [100, 300, 800]
+PROMPT = "a lighthouse keeper who hears music in the fog"
+GENRE = "Mystery"
+
+
+def candidates_for(length):
+    # 100-word stories from different genres stand in for varied model prose;
+    # one long template story loops its arc and would score as repetitive
+    genres = list(LIBRARIES)
+    good = " ".join(compose_story(PROMPT, genres[i % len(genres)], min(100, length - i * 100))
+                    for i in range((length + 99) // 100))
+    words = good.split()
+    hf_prompt = build_hf_prompt(PROMPT, GENRE, length)
+    return hf_prompt, {
+        "good": good,
+        "loop": " ".join((words[:12] * (length // 12 + 1))[:length]),
+        "echo": " ".join((hf_prompt.split() * 4 + words)[:length]),
+        "cut off": " ".join(words[:length - 1]).rstrip(".!?") + " and then the",
+        "too short": " ".join(words[:length // 4]),
+    }
+
+
+def bench(texts, length, hf_prompt, seconds):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        pick_best(texts, length, hf_prompt, PROMPT)
+        count += 1
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per length")
+    parser.add_argument("--bad-rate", type=float, default=0.3, help="share of unusable samples")
+    args = parser.parse_args()
+
+    for length in LENGTHS:
+        hf_prompt, texts = candidates_for(length)
+        scores = {name: score_story(text, length, hf_prompt, PROMPT) for name, text in texts.items()}
+        assert scores["good"] >= MIN_SCORE, scores
+        assert all(scores["good"] > score for name, score in scores.items() if name != "good"), scores
+        per_call = bench([texts["loop"], texts["cut off"], texts["good"]], length, hf_prompt, args.seconds)
+        ranked = "  ".join(f"{name} {score:.2f}" for name, score in scores.items())
+        print(f"{length:>4}w  pick_best(3): {per_call * 1e6:7.1f} us   {ranked}")
+
+    print(f"\nrequests needing another round trip at {args.bad_rate:.0%} unusable samples:")
+    for n in (1, 2, 3, 4):
+        print(f"  {n} candidate{'s' if n > 1 else ' '} per call: {args.bad_rate ** n:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
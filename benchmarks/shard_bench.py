@@ -0,0 +1,89 @@
+"""Write throughput of the sharded story store by shard count
+
+Usage:
+    python benchmarks/shard_bench.py --shards 1,2,4,8 --writers 8 --seconds 5
+
+Each level gets a fresh store in a temporary directory. --writers
+processes each save stories for random users (save_story, one commit per
+story, like the app) for --seconds. "plain" is a single unsharded
+Database with the same pool size, for reference; 1 shard shows what the
+catalog lookups cost. Writers on different shards only contend for CPU
+and disk, so throughput grows with the shard count on machines with more
+cores than one writer can use; on a single core it stays flat.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from sharding import SHARD_POOL_SIZE, ShardedDatabase  # noqa: E402
+
+CONTENT = " ".join(["The lantern swung as the ferry crossed the dark water."] * 30)
+USERS = [f"shard-bench-{i}" for i in range(200)]
+
+
+def open_store(path, shards):
+    if shards == 0:
+        return Database(path, cache=None, pool_size=SHARD_POOL_SIZE)
+    return ShardedDatabase(path, shards, cache=None)
+
+
+def _writer(path, shards, seconds, seed, ready, results):
+    db = open_store(path, shards)
+    rng = random.Random(seed)
+    ready.wait()
+    saved, locked = 0, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            db.save_story(rng.choice(USERS), "Bench", "a bench prompt", CONTENT, genre="Fantasy")
+            saved += 1
+        except Exception as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    results.put((saved, locked))
+
+
+def run_level(shards, writers, seconds):
+    directory = tempfile.mkdtemp(prefix="shard-bench-")
+    path = os.path.join(directory, "stories.db")
+    db = open_store(path, shards)
+    for user_id in USERS:
+        db.create_or_update_user(user_id, f"{user_id}@example.com", user_id)
+
+    ready = multiprocessing.Barrier(writers)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_writer, args=(path, shards, seconds, i, ready, results))
+                 for i in range(writers)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(saved for saved, _ in totals) / seconds, sum(locked for _, locked in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts")
+    parser.add_argument("--writers", type=int, default=8, help="writer processes")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'saves/s':>10} {'speedup':>8} {'locked':>7}   ({args.writers} writers)")
+    plain, locked = run_level(0, args.writers, args.seconds)
+    print(f"{'plain':>6} {plain:>10.0f} {1.0:>7.2f}x {locked:>7}")
+    for shards in (int(n) for n in args.shards.split(",")):
+        rate, locked = run_level(shards, args.writers, args.seconds)
+        print(f"{shards:>6} {rate:>10.0f} {rate / plain:>7.2f}x {locked:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Query latency and recall of the "more like this" vector index
+
+Usage:
+    python benchmarks/similarity_bench.py --rows 1m --pool 2000
+
+--pool template stories (the corpus.py genre mix) are encoded with
+similarity_index's hashed TF-IDF. Recall@10 compares the index's
+neighbours with exact cosine similarity over the same stories' full
+TF-IDF vectors.
+
+For latency, the index files are filled with --rows vectors: pool vectors
+with a little noise, memory-mapped as in the app. The benchmark then
+times queries over one user's rows: a user who owns 95% of the index, a
+batch of 16 queries for that user, and a user who owns the other 5%.
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import GENRE_WEIGHTS, PROMPTS, parse_scale  # noqa: E402
+from similarity_index import DIMENSIONS, VectorIndex, _word_counts  # noqa: E402
+from template_engine import LIBRARIES, compose_story  # noqa: E402
+
+K = 10
+
+
+def pool_texts(size, rng):
+    genres = list(GENRE_WEIGHTS)
+    weights = list(GENRE_WEIGHTS.values())
+    texts = []
+    for genre in rng.choices(genres, weights, k=size):
+        genre = genre if genre in LIBRARIES else next(iter(LIBRARIES))
+        texts.append(compose_story(rng.choice(PROMPTS), genre, rng.choice([150, 300, 500]), rng=rng))
+    return texts
+
+
+def exact_vectors(texts):
+    """Unhashed sublinear TF-IDF, as sparse dicts"""
+    counts = [_word_counts(text) for text in texts]
+    df = {}
+    for words in counts:
+        for word in words:
+            df[word] = df.get(word, 0) + 1
+    n = len(texts)
+    vectors = []
+    for words in counts:
+        vector = {word: (1 + math.log(tf)) * (math.log((1 + n) / (1 + df[word])) + 1) for word, tf in words.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        vectors.append({word: w / norm for word, w in vector.items()})
+    return vectors
+
+
+def recall(texts, queries, rng):
+    index = VectorIndex("")
+    for text in texts:
+        index.count(text)
+    hashed = np.array([index.encode(text) for text in texts], np.float32)
+    exact = exact_vectors(texts)
+    hits = 0
+    for q in rng.sample(range(len(texts)), queries):
+        scores = [sum(w * other.get(word, 0.0) for word, w in exact[q].items()) for other in exact]
+        scores[q] = -1
+        truth = set(sorted(range(len(texts)), key=lambda i: -scores[i])[:K])
+        approx = hashed @ hashed[q]
+        approx[q] = -1
+        hits += len(truth & set(np.argsort(-approx)[:K].tolist()))
+    return hits / (queries * K), hashed
+
+
+def fill_index(path, rows, pool, rng_np):
+    """rows noisy copies of the pool vectors; user 2 owns every 20th row and user 1 the rest"""
+    vectors = np.lib.format.open_memmap(os.path.join(path, "fill.npy"), mode="w+", dtype=np.float32,
+                                        shape=(rows, DIMENSIONS))
+    for start in range(0, rows, 100_000):
+        end = min(start + 100_000, rows)
+        block = pool[rng_np.integers(0, len(pool), end - start)]
+        block = block + rng_np.normal(0, 0.02, block.shape).astype(np.float32)
+        vectors[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    index = VectorIndex(path)
+    users = np.full(rows, 1, np.int64)
+    users[::20] = 2
+    index.save(vectors, np.arange(1, rows + 1, dtype=np.int64), users, np.zeros(1, np.int32), rows, rows)
+    del vectors
+    os.remove(os.path.join(path, "fill.npy"))
+    index.load()
+    return index
+
+
+def time_query(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1m", help="index size for the latency runs (100k, 1m, ...)")
+    parser.add_argument("--pool", type=int, default=2000, help="template stories for recall and as row templates")
+    parser.add_argument("--queries", type=int, default=50, help="queries for recall@10")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng, rng_np = random.Random(args.seed), np.random.default_rng(args.seed)
+    texts = pool_texts(args.pool, rng)
+    score, pool = recall(texts, args.queries, rng)
+    print(f"recall@{K} vs exact TF-IDF over {args.pool} stories: {score:.0%} ({DIMENSIONS} dimensions)")
+
+    rows = parse_scale(args.rows)
+    index = fill_index(tempfile.mkdtemp(prefix="similarity-bench-"), rows, pool, rng_np)
+    query = pool[0]
+    batch = pool[:16]
+    small = len(range(0, rows, 20))
+    for name, fn in [
+        (f"1 query, user with {rows - small:,} rows", lambda: index.top_k(query, K, owner=1)),
+        (f"16 queries, user with {rows - small:,} rows", lambda: index.top_k(batch, K, owner=1)),
+        (f"1 query, user with {small:,} rows", lambda: index.top_k(query, K, owner=2)),
+    ]:
+        median, worst = time_query(fn, args.repeat)
+        print(f"  {name:<36} median {median:7.1f} ms   max {worst:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Throughput benchmark for the local template engine
+
+Usage:
+    python benchmarks/template_bench.py [--seconds 1.0]
+
+Prints stories/sec on a single core for each genre and target length,
+and checks that every story hits its word target exactly.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_engine import LIBRARIES, compose_story  # noqa: E402
+
+LENGTHS = [100, 300, 500, 800]
+PROMPT = "a lighthouse keeper who hears music in the fog"
+
+
+def bench(genre, length, seconds):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        story = compose_story(PROMPT, genre, length)
+        count += 1
+    elapsed = time.perf_counter() - start
+    assert len(story.split()) == length, (genre, length, len(story.split()))
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per cell")
+    args = parser.parse_args()
+
+    print(f"{'genre':<10}" + "".join(f"{length:>10}w" for length in LENGTHS) + "   (stories/sec, one core)")
+    for genre in LIBRARIES:
+        rates = [bench(genre, length, args.seconds) for length in LENGTHS]
+        print(f"{genre:<10}" + "".join(f"{rate:>11.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Wasted-token comparison: fixed 1.33 tokens/word budget vs calibrated budgets
+
+Usage:
+    python benchmarks/token_waste.py --telemetry telemetry.db
+    python benchmarks/token_waste.py workload.jsonl
+    python benchmarks/token_waste.py --synthetic 2000
+
+--telemetry replays recorded traffic from telemetry.py's generation_events.
+Only events whose words per token is exact are used: streamed stories, and
+non-streamed ones that came out under the target (trimmed text hides how
+many words the tokens held).
+A workload line is {"genre": ..., "target_words": ..., "words_per_token": ...};
+words_per_token is what the model actually produced for that request (e.g.
+generated words / details.generated_tokens from logged HF responses).
+--synthetic draws requests with GPT-2-like ratios per genre.
+
+Each request is replayed under three schemes:
+- fixed:      max_new_tokens = min(1.33 * words, 800), min_new_tokens = 70%
+- calibrated: TokenCalibrator budget, full-length generation
+- streamed:   calibrated budget plus STREAM_OVERRUN_WORDS, stream closed
+              at the first sentence end at or after the target (stream_story)
+Tokens that only produce words cut by trim_to_word_count count as waste.
+Short counts stories that end before the target.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calibration import TokenCalibrator  # noqa: E402
+from huggingface_client import STREAM_OVERRUN_WORDS  # noqa: E402
+
+# Rough GPT-2 words per token: plain prose tokenizes better than invented names and jargon
+GENRE_WORDS_PER_TOKEN = {
+    "Fantasy": 0.74, "Sci-Fi": 0.71, "Mystery": 0.80, "Romance": 0.82, "Horror": 0.79,
+    "Adventure": 0.78, "Comedy": 0.81, "Drama": 0.83, "Thriller": 0.80,
+}
+TARGETS = [100, 200, 300, 500, 800]
+
+
+def synthetic_workload(count, rng):
+    for _ in range(count):
+        genre = rng.choice(list(GENRE_WORDS_PER_TOKEN))
+        yield {
+            "genre": genre,
+            "target_words": rng.choice(TARGETS),
+            "words_per_token": rng.gauss(GENRE_WORDS_PER_TOKEN[genre], 0.03),
+        }
+
+
+def read_workload(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_telemetry(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    rows = conn.execute('''
+        SELECT genre, requested_words, produced_words, tokens FROM generation_events
+        WHERE genre IS NOT NULL AND tokens > 0 AND requested_words > 0 AND produced_words > 0
+          AND (source = 'hf-stream' OR produced_words < requested_words)
+        ORDER BY ts
+    ''').fetchall()
+    conn.close()
+    for genre, requested, produced, tokens in rows:
+        yield {"genre": genre, "target_words": requested, "words_per_token": produced / tokens}
+
+
+def full_generation(max_tokens, wpt, target):
+    """GPT-2 rarely emits EOS, so a non-streamed request runs to max_new_tokens"""
+    words = int(max_tokens * wpt)
+    delivered = min(words, target)
+    return max_tokens, delivered
+
+
+def streamed_generation(max_tokens, wpt, target, rng):
+    """Walk sentence by sentence and stop where stream_story would"""
+    words = 0
+    while words < target:
+        words += rng.randint(8, 24)
+    if words > target + STREAM_OVERRUN_WORDS:
+        words = target + STREAM_OVERRUN_WORDS
+        tokens = math.ceil(words / wpt) + 1  # the token that crossed the limit
+    else:
+        tokens = math.ceil(words / wpt)
+    if tokens > max_tokens:
+        return max_tokens, int(max_tokens * wpt)
+    return tokens, words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workload", nargs="?", help="JSONL workload file")
+    parser.add_argument("--telemetry", help="replay recorded requests from this telemetry database")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many synthetic requests instead")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    if not args.workload and not args.telemetry and not args.synthetic:
+        parser.error("give a workload file, --telemetry DB or --synthetic N")
+
+    rng = random.Random(args.seed)
+    if args.telemetry:
+        requests, source = list(read_telemetry(args.telemetry)), args.telemetry
+    elif args.synthetic:
+        requests, source = list(synthetic_workload(args.synthetic, rng)), "synthetic"
+    else:
+        requests, source = list(read_workload(args.workload)), args.workload
+    if not requests:
+        sys.exit(f"no usable requests in {source}")
+    calibrator = TokenCalibrator(os.path.join(tempfile.mkdtemp(), "calibration.json"))
+
+    totals = {name: {"tokens": 0, "useful": 0, "short": 0} for name in ("fixed", "calibrated", "streamed")}
+    for request in requests:
+        genre, target, wpt = request["genre"], request["target_words"], request["words_per_token"]
+
+        fixed = min(int(target * 1.33), 800)
+        max_tokens, _ = calibrator.token_budget("gpt2", genre, target)
+        stream_tokens, _ = calibrator.token_budget("gpt2", genre, target + STREAM_OVERRUN_WORDS)
+        results = {
+            "fixed": full_generation(fixed, wpt, target),
+            "calibrated": full_generation(max_tokens, wpt, target),
+            "streamed": streamed_generation(stream_tokens, wpt, target, rng),
+        }
+        for name, (tokens, delivered) in results.items():
+            totals[name]["tokens"] += tokens
+            totals[name]["useful"] += min(math.ceil(delivered / wpt), tokens)
+            totals[name]["short"] += delivered < target
+        calibrator.record("gpt2", genre, int(max_tokens * wpt), max_tokens)
+
+    print(f"{len(requests)} requests ({source})")
+    print(f"{'scheme':<12}{'tokens':>12}{'wasted':>12}{'waste %':>10}{'short':>8}")
+    for name, total in totals.items():
+        wasted = total["tokens"] - total["useful"]
+        print(f"{name:<12}{total['tokens']:>12}{wasted:>12}{100 * wasted / total['tokens']:>9.1f}%"
+              f"{total['short']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Process-wide read cache for per-user library views"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class LibraryCache:
+    """Thread-safe LRU cache keyed by per-user version counters.
+
+    Keys include the user's current version (kept in the database, see
+    Database.cache_version), so a write in any process only has to bump the
+    version and every older entry for that user becomes unreachable and ages
+    out of the LRU on its own.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Look up a key, returning (hit, value)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, scope: Hashable, version: int, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value for key within scope at version, loading it on a miss
+
+        The caller reads the version before loading, so a write that lands in
+        between is cached under the old version at worst.
+        """
+        full_key = (scope, version, key)
+        hit, value = self.get(full_key)
+        if hit:
+            return value
+        value = loader()
+        self.put(full_key, value)
+        return value
+
+    def clear(self):
+        """Drop all entries and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict:
+        """Hit-ratio metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every Database instance (and every Streamlit session thread) in this process
+library_cache = LibraryCache(int(os.getenv("LIBRARY_CACHE_SIZE", "2048")))
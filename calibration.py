@@ -0,0 +1,94 @@
+"""Words-per-token calibration for sizing generation requests
+
+Instead of the fixed max_length * 1.33 token budget, each (model, genre)
+pair keeps an exponentially weighted average of the words per token
+actually observed in completed generations. Requests then ask for just
+enough tokens to reach the word target plus a small safety margin.
+"""
+import json
+import math
+import os
+import threading
+from typing import Dict, Tuple
+
+CALIBRATION_FILE = os.getenv("CALIBRATION_FILE", os.path.join("models", "calibration.json"))
+
+DEFAULT_WORDS_PER_TOKEN = 0.75  # the old 1.33 tokens per word
+SMOOTHING = 0.2                 # weight of the newest observation
+WARMUP_SAMPLES = 5              # use the wide margin until we have this many
+WARM_MARGIN = 0.03
+COLD_MARGIN = 0.20
+SAVE_EVERY = 20
+
+
+class TokenCalibrator:
+    def __init__(self, path: str = CALIBRATION_FILE):
+        self.path = path
+        self._estimates: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self.load()
+
+    @staticmethod
+    def _key(model: str, genre: str) -> str:
+        return f"{model}|{genre}"
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self._estimates = json.load(f)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self._estimates, indent=2)
+            self._unsaved = 0
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def words_per_token(self, model: str, genre: str) -> Tuple[float, int]:
+        """Current estimate and how many samples it is based on"""
+        with self._lock:
+            estimate = self._estimates.get(self._key(model, genre))
+        if not estimate:
+            return DEFAULT_WORDS_PER_TOKEN, 0
+        return estimate["words_per_token"], estimate["samples"]
+
+    def token_budget(self, model: str, genre: str, target_words: int, cap: int = 800) -> Tuple[int, int]:
+        """(max_new_tokens, min_new_tokens) for a word target"""
+        words_per_token, samples = self.words_per_token(model, genre)
+        needed = target_words / words_per_token
+        margin = WARM_MARGIN if samples >= WARMUP_SAMPLES else COLD_MARGIN
+        max_tokens = min(math.ceil(needed * (1 + margin)), cap)
+        # No more than the target can take if words per token is margin better than estimated, so holding
+        # off the end of text never produces words that get trimmed
+        min_tokens = min(int(needed * (1 - margin)), max_tokens)
+        return max_tokens, min_tokens
+
+    def record(self, model: str, genre: str, words: int, tokens: int):
+        """Feed back the words and tokens of a completed generation"""
+        if words <= 0 or tokens <= 0:
+            return
+        observed = words / tokens
+        with self._lock:
+            key = self._key(model, genre)
+            estimate = self._estimates.get(key)
+            if estimate is None:
+                self._estimates[key] = {"words_per_token": observed, "samples": 1}
+            else:
+                estimate["words_per_token"] += SMOOTHING * (observed - estimate["words_per_token"])
+                estimate["samples"] += 1
+            self._unsaved += 1
+            should_save = self._unsaved >= SAVE_EVERY
+        if should_save:
+            try:
+                self.save()
+            except OSError:
+                pass
+
+
+calibrator = TokenCalibrator()
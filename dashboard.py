@@ -0,0 +1,72 @@
+"""Writing activity dashboard, drawn from the daily activity rollups"""
+import html
+
+import streamlit as st
+
+from activity import MIX_MONTHS, TREND_WEEKS, WINDOW_DAYS, daily_totals, heatmap, summary, today
+from database import open_database
+
+# Heatmap colours by level, from no words to the busiest days
+LEVEL_COLORS = ["#1e293b", "#5b2333", "#8a2c44", "#b93753", "#e94560"]
+
+
+def heatmap_html(days, until):
+    """A year of days as a grid of squares, a column per week"""
+    columns = []
+    for week in heatmap(days, until):
+        cells = []
+        for cell in week:
+            if cell is None:
+                cells.append('<div style="width:12px;height:12px"></div>')
+                continue
+            tip = html.escape(f"{cell['day']:%a %d %b %Y}: {cell['words']:,} words")
+            cells.append(f'<div title="{tip}" style="width:12px;height:12px;border-radius:2px;'
+                         f'background:{LEVEL_COLORS[cell["level"]]}"></div>')
+        columns.append(f'<div style="display:flex;flex-direction:column;gap:3px">{"".join(cells)}</div>')
+    return f'<div style="display:flex;gap:3px;overflow-x:auto;padding:4px 0">{"".join(columns)}</div>'
+
+
+def show_activity_page(user_id):
+    """Heatmap, weekly trend, genre mix and streaks for one user"""
+    db = open_database()
+
+    st.title("📈 Writing Activity")
+
+    until = today()
+    rows = db.get_activity(user_id)
+    data = summary(rows, until)
+    if not data['active_days']:
+        st.info("Nothing written in the last year yet. Generate a story and it will show up here.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Current streak", f"{data['current_streak']} days")
+    with col2:
+        st.metric("Longest streak", f"{data['longest_streak']} days")
+    with col3:
+        st.metric("Words in the last year", f"{data['words']:,}")
+    with col4:
+        st.metric("Days written", data['active_days'])
+
+    st.subheader("Every day")
+    st.markdown(heatmap_html(daily_totals(rows), until), unsafe_allow_html=True)
+    st.caption(f"Words written per day over the last {WINDOW_DAYS // 7} weeks (UTC). Hover a square for details.")
+
+    st.subheader("Weekly trend")
+    weeks = data['weeks']
+    st.bar_chart({'week': [week['week'] for week in weeks], 'words': [week['words'] for week in weeks]},
+                 x='week', y='words')
+    st.caption(f"Words per week, last {TREND_WEEKS} weeks; "
+               f"{sum(week['stories'] for week in weeks):,} stories started in that time.")
+
+    st.subheader("Genre mix")
+    mix = data['genre_mix']
+    genres = sorted({genre for month in mix.values() for genre in month})
+    if genres:
+        chart = {'month': list(mix)}
+        for genre in genres:
+            chart[genre] = [month.get(genre, 0) for month in mix.values()]
+        st.bar_chart(chart, x='month', y=genres)
+        st.caption(f"Words per genre per month, last {MIX_MONTHS} months.")
+
@@ -1,25 +1,242 @@
 """Database models and operations for the Story Generator"""
+import os
 import sqlite3
-from datetime import datetime
-from typing import List, Optional, Dict
+import functools
+import queue
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Tuple
 import json
+from cache import LibraryCache, library_cache
+from metrics import db_latency
+from profiling import span
+import activity
+import archive
+import dedupe
+import revisions
+
+
+def cached_read(method):
+    """Serve a per-user read from the library cache.
+    
+    The wrapped method must take user_id as its first argument. Results are
+    shared between callers and must be treated as read-only.
+    """
+    @functools.wraps(method)
+    def wrapper(self, user_id, *args, **kwargs):
+        if self.cache is None:
+            return method(self, user_id, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        return self.cache.get_or_load(
+            (self.db_name, user_id), self.cache_version(user_id), key,
+            lambda: method(self, user_id, *args, **kwargs)
+        )
+    return wrapper
+
+
+def timed_query(method):
+    """Record the method's latency in the storygen_db_query_seconds histogram
+    
+    Calls also show up as db.<method> spans in rerun profiles.
+    """
+    span_name = f"db.{method.__name__}"
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        global last_query_at
+        last_query_at = time.monotonic()
+        with span(span_name), db_latency.time(method=method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# time.monotonic() of the latest timed call in this process; maintenance.py waits for a quiet spell
+last_query_at = 0.0
+
+
+# Between chapters when a story is read as one text
+CHAPTER_SEPARATOR = "\n\n"
+
+# Title, opening, prompt, or any later chapter
+SEARCH_CLAUSE = (
+    'title LIKE ? OR content LIKE ? OR prompt LIKE ? OR (chapter_count > 1 AND EXISTS '
+    '(SELECT 1 FROM story_chapters c WHERE c.story_id = stories.story_id AND c.content LIKE ?))'
+)
+
+# Library rows with the number of near-duplicates grouped under each
+COLLAPSED_COLUMNS = '*, (SELECT COUNT(*) FROM stories d WHERE d.duplicate_of = stories.story_id) AS duplicate_count'
+
+# Stories' share of the daily_user_activity rollups, per user, day and genre: a story counts on the
+# day it was started, and each chapter's words on the day that chapter was written. {where} picks the stories.
+ACTIVITY_QUERY = '''
+    SELECT user_id, day, genre, SUM(stories) AS stories, SUM(words) AS words FROM (
+        SELECT s.user_id, substr(s.created_at, 1, 10) AS day, COALESCE(s.genre, '') AS genre, 1 AS stories,
+               s.word_count - CASE WHEN s.chapter_count > 1 THEN (
+                   SELECT COALESCE(SUM(c.word_count), 0) FROM story_chapters c WHERE c.story_id = s.story_id
+               ) ELSE 0 END AS words
+        FROM stories s WHERE {where}
+        UNION ALL
+        SELECT s.user_id, substr(c.created_at, 1, 10), COALESCE(s.genre, ''), 0, c.word_count
+        FROM story_chapters c JOIN stories s ON s.story_id = c.story_id WHERE {where} AND s.chapter_count > 1
+    ) GROUP BY user_id, day, genre HAVING SUM(stories) != 0 OR SUM(words) != 0
+'''
+
+# Database files whose schema has already been checked in this process
+_initialized_dbs = set()
+
+# Callbacks run after every story write: listener(db, event, user_id, old, new)
+_write_listeners = []
+
+
+def check_story_fields(**fields):
+    """Raise TypeError unless each given field is None or a string (tags: a list of strings)
+    
+    Writes call this before taking the write lock.
+    """
+    for name, value in fields.items():
+        if value is None:
+            continue
+        if name == 'tags':
+            if not isinstance(value, list) or not all(isinstance(tag, str) for tag in value):
+                raise TypeError("tags must be a list of strings")
+        elif not isinstance(value, str):
+            raise TypeError(f"{name} must be a string, not {type(value).__name__}")
+
+
+def register_write_listener(listener):
+    """Register a callback for story writes (save, update, delete, favorite).
+    
+    old and new are story dicts (or None) describing the row before and
+    after the write. Listeners run after commit and must not raise.
+    """
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() hands it back to its pool instead of closing"""
+    pool: Optional["ConnectionPool"] = None
+    
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections shared across threads"""
+    
+    def __init__(self, db_name: str, size: int):
+        self.db_name = db_name
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.db_name, factory=PooledConnection, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.pool = self
+            return conn
+    
+    def release(self, conn: sqlite3.Connection) -> bool:
+        """Return a connection to the pool; False means the caller should really close it"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+            return True
+        except queue.Full:
+            return False
+
 
 class Database:
-    def __init__(self, db_name: str = "stories.db"):
+    def __init__(self, db_name: str = "stories.db", cache: Optional[LibraryCache] = library_cache,
+                 pool_size: int = 0):
         self.db_name = db_name
-        self.init_db()
+        self.cache = cache
+        self.pool = ConnectionPool(db_name, pool_size) if pool_size > 0 else None
+        if db_name not in _initialized_dbs:
+            self.init_db()
+            _initialized_dbs.add(db_name)
+    
+    def cache_version(self, user_id: str) -> int:
+        """The user's write counter; every process sharing the file keys its cached reads on it"""
+        conn = self.get_connection()
+        row = conn.execute('SELECT version FROM cache_versions WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return row[0] if row else 0
+    
+    def _bump_version(self, conn: sqlite3.Connection, user_id: str):
+        conn.execute('''
+            INSERT INTO cache_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        ''', (user_id,))
+    
+    def invalidate_user(self, user_id: str):
+        """Bump the user's cache version after a write made outside _begin_write"""
+        conn = self.get_connection()
+        try:
+            self._bump_version(conn, user_id)
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def notify_write(self, event: str, user_id: str, old: Optional[Dict] = None, new: Optional[Dict] = None):
+        """Tell write listeners about a change (the write already bumped the cache version)"""
+        for listener in _write_listeners:
+            listener(self, event, user_id, old, new)
+    
+    def next_story_id(self) -> Optional[int]:
+        """Id for a new story; None lets SQLite assign the next rowid"""
+        return None
+    
+    def _begin_write(self, conn: sqlite3.Connection, user_id: str):
+        """Take the write lock before reading anything a write of user_id's depends on
+        
+        The user's cache version is bumped in the same transaction, so cached
+        reads in every process see the write once it commits. A shard also
+        checks here that the user's writes still go to it.
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        self._bump_version(conn, user_id)
     
     def get_connection(self):
         """Get database connection"""
+        if self.pool is not None:
+            return self.pool.acquire()
         conn = sqlite3.connect(self.db_name)
         conn.row_factory = sqlite3.Row
         return conn
     
+    def _hydrate(self, story: Dict) -> Dict:
+        """Fill in the text of an archived story from the archive file"""
+        if story.get('archive_offset') is not None:
+            store = archive.open_archive(self.db_name)
+            try:
+                story['content'] = store.read(story['story_id'], story['archive_offset'], story['archive_length'])
+            except archive.ArchiveError:
+                # compact_archive moved the record after this row was read; look where it is now
+                conn = self.get_connection()
+                row = conn.execute('SELECT content, archive_offset, archive_length FROM stories WHERE story_id = ?',
+                                   (story['story_id'],)).fetchone()
+                conn.close()
+                if row is None or row['archive_offset'] == story['archive_offset']:
+                    raise
+                story['content'] = row['content'] if row['archive_offset'] is None else store.read(
+                    story['story_id'], row['archive_offset'], row['archive_length'])
+        return story
+    
     def init_db(self):
         """Initialize database tables"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # New files hand freed pages back in small steps (maintenance.py); older ones switch at vacuum()
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        
+        # WAL lets readers run alongside the single writer
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -51,33 +268,122 @@ class Database:
             )
         ''')
         
+        # Chapters after the first; chapter 1 is stories.content, so single-chapter stories need no rows
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS story_chapters (
+                story_id INTEGER NOT NULL,
+                chapter_no INTEGER NOT NULL,
+                title TEXT,
+                content TEXT NOT NULL,
+                word_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (story_id, chapter_no)
+            )
+        ''')
+        
+        # Earlier versions of each chapter, as snapshots and deltas (see revisions.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS story_revisions (
+                story_id INTEGER NOT NULL,
+                chapter_no INTEGER NOT NULL,
+                revision_no INTEGER NOT NULL,
+                is_snapshot INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                word_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (story_id, chapter_no, revision_no)
+            )
+        ''')
+        
+        # MinHash signature of each story's opening chapter and its LSH band keys (see dedupe.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS story_signatures (
+                story_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS story_lsh (
+                band_key INTEGER NOT NULL,
+                story_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, story_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Stories and words per user, day and genre, kept current by every write (see activity.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_user_activity (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                stories INTEGER NOT NULL DEFAULT 0,
+                words INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day, genre)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Per-user write counter that cached reads are keyed on (see cached_read)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                user_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        
+        # Stories from before chapters are single-chapter stories
+        columns = [row['name'] for row in cursor.execute('PRAGMA table_info(stories)')]
+        if 'chapter_count' not in columns:
+            cursor.execute('ALTER TABLE stories ADD COLUMN chapter_count INTEGER NOT NULL DEFAULT 1')
+        # A near-duplicate points at the original it is grouped under
+        if 'duplicate_of' not in columns:
+            cursor.execute('ALTER TABLE stories ADD COLUMN duplicate_of INTEGER')
+        # Where an archived story's text sits in the archive file (see archive.py); NULL while it is in content
+        if 'archive_offset' not in columns:
+            cursor.execute('ALTER TABLE stories ADD COLUMN archive_offset INTEGER')
+            cursor.execute('ALTER TABLE stories ADD COLUMN archive_length INTEGER')
+        # Last day the story was opened, for the archive job
+        if 'read_at' not in columns:
+            cursor.execute('ALTER TABLE stories ADD COLUMN read_at TIMESTAMP')
+        
         # Create indexes for faster queries
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stories ON stories(user_id, created_at DESC)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_story_genre ON stories(genre)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_story_favorite ON stories(user_id, is_favorite)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_story_duplicates ON stories(duplicate_of) '
+                       'WHERE duplicate_of IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lsh_story ON story_lsh(story_id)')
         
         conn.commit()
         conn.close()
     
     # User operations
+    @timed_query
     def create_or_update_user(self, user_id: str, email: str, display_name: str | None = None, photo_url: str | None = None):
         """Create or update user in database"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO users (user_id, email, display_name, photo_url, last_login)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(user_id) DO UPDATE SET
-                email = excluded.email,
-                display_name = excluded.display_name,
-                photo_url = excluded.photo_url,
-                last_login = CURRENT_TIMESTAMP
-        ''', (user_id, email, display_name, photo_url))
-        
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            cursor.execute('''
+                INSERT INTO users (user_id, email, display_name, photo_url, last_login)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    email = excluded.email,
+                    display_name = excluded.display_name,
+                    photo_url = excluded.photo_url,
+                    last_login = CURRENT_TIMESTAMP
+            ''', (user_id, email, display_name, photo_url))
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
     
+    @timed_query
     def get_user(self, user_id: str) -> Optional[Dict]:
         """Get user by ID"""
         conn = self.get_connection()
@@ -90,45 +396,179 @@ class Database:
         return dict(row) if row else None
     
     # Story operations
+    @timed_query
     def save_story(self, user_id: str, title: str, prompt: str, content: str, 
                    genre: Optional[str] = None, creativity: float = 0.7, tags: Optional[List[str]] = None) -> int:
-        """Save a new story"""
+        """Save a new story
+        
+        With DEDUPE_ON_SAVE=skip a near-duplicate of an existing story is
+        not saved, and the existing story's id is returned instead.
+        """
+        check_story_fields(title=title, prompt=prompt, content=content, genre=genre, tags=tags)
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            word_count = len(content.split())
+            tags_json = json.dumps(tags) if tags else None
+            
+            signature = dedupe.signature(content) if dedupe.ON_SAVE != 'off' else None
+            if dedupe.ON_SAVE == 'skip':
+                original = self._find_original(cursor, user_id, signature)
+                if original:
+                    return original
+            
+            cursor.execute('''
+                INSERT INTO stories (story_id, user_id, title, prompt, content, genre, creativity, word_count, tags)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self.next_story_id(), user_id, title, prompt, content, genre, creativity, word_count, tags_json))
+            
+            story_id = cursor.lastrowid
+            duplicate_of = self._sign_story(cursor, story_id, user_id, signature) if signature else None
+            self._count_activity(cursor, story_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_write('save', user_id, new={
+            'story_id': story_id, 'user_id': user_id, 'title': title, 'prompt': prompt,
+            'content': content, 'genre': genre, 'creativity': creativity,
+            'word_count': word_count, 'tags': tags_json, 'duplicate_of': duplicate_of
+        })
+        
+        return story_id if story_id else 0
+    
+    @timed_query
+    def save_stories(self, user_id: str, stories: List[Dict]) -> List[int]:
+        """Save many stories in one transaction
+        
+        Each dict takes the save_story keyword arguments (title, prompt,
+        content, genre, creativity, tags). DEDUPE_ON_SAVE applies to each
+        story, including against earlier stories in the same batch.
+        """
+        for story in stories:
+            check_story_fields(title=story['title'], prompt=story['prompt'], content=story['content'],
+                               genre=story.get('genre'), tags=story.get('tags'))
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            saved = []
+            ids = []
+            for story in stories:
+                content = story['content']
+                tags = story.get('tags')
+                signature = dedupe.signature(content) if dedupe.ON_SAVE != 'off' else None
+                if dedupe.ON_SAVE == 'skip':
+                    original = self._find_original(cursor, user_id, signature)
+                    if original:
+                        ids.append(original)
+                        continue
+                row = {
+                    'story_id': self.next_story_id(), 'user_id': user_id,
+                    'title': story['title'], 'prompt': story['prompt'],
+                    'content': content, 'genre': story.get('genre'),
+                    'creativity': story.get('creativity', 0.7),
+                    'word_count': len(content.split()),
+                    'tags': json.dumps(tags) if tags else None
+                }
+                cursor.execute('''
+                    INSERT INTO stories (story_id, user_id, title, prompt, content, genre, creativity, word_count, tags)
+                    VALUES (:story_id, :user_id, :title, :prompt, :content, :genre, :creativity, :word_count, :tags)
+                ''', row)
+                row['story_id'] = cursor.lastrowid
+                row['duplicate_of'] = (self._sign_story(cursor, row['story_id'], user_id, signature)
+                                       if signature else None)
+                self._count_activity(cursor, row['story_id'])
+                saved.append(row)
+                ids.append(row['story_id'])
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        for row in saved:
+            self.notify_write('save', user_id, new=row)
+        
+        return ids
+    
+    @cached_read
+    @timed_query
+    def get_user_stories(self, user_id: str, limit: int = 50, offset: int = 0,
+                         genre: Optional[str] = None, favorite_only: bool = False,
+                         collapse_duplicates: bool = False) -> List[Dict]:
+        """Get all stories for a user with pagination
+        
+        collapse_duplicates leaves out near-duplicates and counts them on
+        their original instead (duplicate_count).
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        word_count = len(content.split())
-        tags_json = json.dumps(tags) if tags else None
+        sql = f'SELECT {COLLAPSED_COLUMNS if collapse_duplicates else "*"} FROM stories WHERE user_id = ?'
+        params: List = [user_id]
         
-        cursor.execute('''
-            INSERT INTO stories (user_id, title, prompt, content, genre, creativity, word_count, tags)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, title, prompt, content, genre, creativity, word_count, tags_json))
+        if collapse_duplicates:
+            sql += ' AND duplicate_of IS NULL'
         
-        story_id = cursor.lastrowid
-        conn.commit()
+        if genre:
+            sql += ' AND genre = ?'
+            params.append(genre)
+        
+        if favorite_only:
+            sql += ' AND is_favorite = 1'
+        
+        sql += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
+        
+        cursor.execute(sql, params)
+        
+        rows = cursor.fetchall()
         conn.close()
         
-        return story_id if story_id else 0
+        return [self._hydrate(dict(row)) for row in rows]
     
-    def get_user_stories(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
-        """Get all stories for a user with pagination"""
+    @cached_read
+    @timed_query
+    def count_stories(self, user_id: str, query: Optional[str] = None, genre: Optional[str] = None,
+                      favorite_only: bool = False, collapse_duplicates: bool = False) -> int:
+        """Count stories matching the same filters used by the paginated queries"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM stories 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ? OFFSET ?
-        ''', (user_id, limit, offset))
+        sql = 'SELECT COUNT(*) FROM stories WHERE user_id = ?'
+        params: List = [user_id]
         
-        rows = cursor.fetchall()
+        if collapse_duplicates:
+            sql += ' AND duplicate_of IS NULL'
+        
+        if query:
+            sql += f' AND ({SEARCH_CLAUSE})'
+            params.extend([f'%{query}%'] * 4)
+        
+        if genre:
+            sql += ' AND genre = ?'
+            params.append(genre)
+        
+        if favorite_only:
+            sql += ' AND is_favorite = 1'
+        
+        cursor.execute(sql, params)
+        count = cursor.fetchone()[0]
         conn.close()
         
-        return [dict(row) for row in rows]
+        return count
     
-    def get_story(self, story_id: int, user_id: str) -> Optional[Dict]:
-        """Get a specific story"""
+    @timed_query
+    def get_story(self, story_id: int, user_id: str, touch: bool = True) -> Optional[Dict]:
+        """Get a specific story; touch=False reads it without counting as an open (see archive.py)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -138,79 +578,545 @@ class Database:
         ''', (story_id, user_id))
         
         row = cursor.fetchone()
+        if not row:
+            conn.close()
+            return None
+        
+        story = self._hydrate(dict(row))
+        if story['chapter_count'] > 1:
+            cursor.execute('SELECT content FROM story_chapters WHERE story_id = ? ORDER BY chapter_no', (story_id,))
+            story['content'] = CHAPTER_SEPARATOR.join([story['content']] + [r['content'] for r in cursor.fetchall()])
+        # Opening a story keeps it out of the archive; recorded once a day so most opens stay read-only
+        if touch and (not story['read_at'] or story['read_at'] < datetime.now(timezone.utc).strftime('%Y-%m-%d')):
+            try:
+                cursor.execute('UPDATE stories SET read_at = CURRENT_TIMESTAMP WHERE story_id = ?', (story_id,))
+                conn.commit()
+            except sqlite3.OperationalError:
+                pass  # busy writer or a shard move; the next open records it
         conn.close()
         
-        return dict(row) if row else None
+        return story
     
+    def get_story_summaries(self, story_ids: List[int], user_id: str) -> Dict[int, Dict]:
+        """Title, genre, word count and date of the user's stories among story_ids, without their text"""
+        if not story_ids:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT story_id, title, genre, word_count, created_at FROM stories
+            WHERE user_id = ? AND story_id IN ({",".join("?" * len(story_ids))})
+        ''', [user_id, *story_ids])
+        summaries = {row['story_id']: dict(row) for row in cursor.fetchall()}
+        conn.close()
+        
+        return summaries
+    
+    @timed_query
     def update_story(self, story_id: int, user_id: str, title: Optional[str] = None, 
-                     content: Optional[str] = None, genre: Optional[str] = None, tags: Optional[List[str]] = None):
-        """Update an existing story"""
+                     content: Optional[str] = None, genre: Optional[str] = None,
+                     tags: Optional[List[str]] = None) -> bool:
+        """Update an existing story; content replaces the first chapter (the whole text of most stories)"""
+        check_story_fields(title=title, content=content, genre=genre, tags=tags)
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            cursor.execute('SELECT * FROM stories WHERE story_id = ? AND user_id = ?', (story_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            
+            old = self._hydrate(dict(row))
+            changes = {}
+            
+            if title is not None:
+                changes['title'] = title
+            if content is not None:
+                # content is the first chapter; only its word count changes. New text is hot again.
+                changes['content'] = content
+                changes['word_count'] = old['word_count'] - len(old['content'].split()) + len(content.split())
+                changes['archive_offset'] = changes['archive_length'] = None
+            if genre is not None:
+                changes['genre'] = genre
+            if tags is not None:
+                changes['tags'] = json.dumps(tags)
+            
+            if content is not None and content != old['content']:
+                self._record_revision(cursor, story_id, 1, old['content'])
+            
+            if changes:
+                updates = [f"{column} = ?" for column in changes]
+                updates.append("updated_at = CURRENT_TIMESTAMP")
+                params = list(changes.values()) + [story_id, user_id]
+            
+                query = f"UPDATE stories SET {', '.join(updates)} WHERE story_id = ? AND user_id = ?"
+                # A new word count or genre moves the story's share of the rollups
+                recount = 'word_count' in changes or 'genre' in changes
+                if recount:
+                    self._count_activity(cursor, story_id, -1)
+                cursor.execute(query, params)
+                if recount:
+                    self._count_activity(cursor, story_id)
+                if content is not None and content != old['content'] and dedupe.ON_SAVE != 'off':
+                    self._sign_story(cursor, story_id, user_id, dedupe.signature(content))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if changes:
+            self.notify_write('update', user_id, old=old, new={**old, **changes})
+        
+        return True
+    
+    @timed_query
+    def delete_story(self, story_id: int, user_id: str):
+        """Delete a story"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            cursor.execute('SELECT * FROM stories WHERE story_id = ? AND user_id = ?', (story_id, user_id))
+            row = cursor.fetchone()
+            if row:
+                self._count_activity(cursor, story_id, -1)
+            
+            cursor.execute('DELETE FROM stories WHERE story_id = ? AND user_id = ?', (story_id, user_id))
+            if row:
+                cursor.execute('DELETE FROM story_chapters WHERE story_id = ?', (story_id,))
+                cursor.execute('DELETE FROM story_revisions WHERE story_id = ?', (story_id,))
+                cursor.execute('DELETE FROM story_signatures WHERE story_id = ?', (story_id,))
+                cursor.execute('DELETE FROM story_lsh WHERE story_id = ?', (story_id,))
+                # The oldest remaining duplicate becomes the original of the rest
+                cursor.execute('SELECT MIN(story_id) FROM stories WHERE duplicate_of = ?', (story_id,))
+                heir = cursor.fetchone()[0]
+                if heir:
+                    cursor.execute('''
+                        UPDATE stories SET duplicate_of = CASE WHEN story_id = ? THEN NULL ELSE ? END
+                        WHERE duplicate_of = ?
+                    ''', (heir, heir, story_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if row:
+            self.notify_write('delete', user_id, old=dict(row))
+    
+    @timed_query
+    def toggle_favorite(self, story_id: int, user_id: str):
+        """Toggle favorite status of a story"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            cursor.execute('''
+                UPDATE stories 
+                SET is_favorite = NOT is_favorite 
+                WHERE story_id = ? AND user_id = ?
+            ''', (story_id, user_id))
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_write('favorite', user_id, new={'story_id': story_id, 'user_id': user_id})
+    
+    # Chapter operations
+    @timed_query
+    def add_chapter(self, story_id: int, user_id: str, content: str, title: Optional[str] = None) -> int:
+        """Append a chapter; returns its number, or 0 if the story does not exist"""
+        check_story_fields(content=content, title=title)
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            
+            # Take the write lock first so two continuations cannot claim the same chapter number
+            self._begin_write(conn, user_id)
+            cursor.execute('SELECT genre, chapter_count FROM stories WHERE story_id = ? AND user_id = ?',
+                           (story_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return 0
+            
+            chapter_no = row['chapter_count'] + 1
+            word_count = len(content.split())
+            self._count_activity(cursor, story_id, -1)
+            cursor.execute('''
+                INSERT INTO story_chapters (story_id, chapter_no, title, content, word_count)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (story_id, chapter_no, title, content, word_count))
+            cursor.execute('''
+                UPDATE stories
+                SET chapter_count = ?, word_count = word_count + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE story_id = ?
+            ''', (chapter_no, word_count, story_id))
+            self._count_activity(cursor, story_id)
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_write('chapter', user_id, new={
+            'story_id': story_id, 'user_id': user_id, 'chapter_no': chapter_no, 'title': title,
+            'content': content, 'genre': row['genre'], 'word_count': word_count
+        })
+        
+        return chapter_no
+    
+    @timed_query
+    def get_chapters(self, story_id: int, user_id: str) -> List[Dict]:
+        """All chapters in order; chapter 1 is the story's own content"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        updates = []
-        params = []
-        
-        if title is not None:
-            updates.append("title = ?")
-            params.append(title)
-        if content is not None:
-            updates.append("content = ?")
-            params.append(content)
-            updates.append("word_count = ?")
-            params.append(len(content.split()))
-        if genre is not None:
-            updates.append("genre = ?")
-            params.append(genre)
-        if tags is not None:
-            updates.append("tags = ?")
-            params.append(json.dumps(tags))
+        cursor.execute('''
+            SELECT story_id, content, archive_offset, archive_length, word_count, chapter_count, created_at, updated_at
+            FROM stories WHERE story_id = ? AND user_id = ?
+        ''', (story_id, user_id))
+        story = cursor.fetchone()
+        if not story:
+            conn.close()
+            return []
+        story = self._hydrate(dict(story))
+        
+        chapters = []
+        if story['chapter_count'] > 1:
+            cursor.execute('''
+                SELECT chapter_no, title, content, word_count, created_at, updated_at FROM story_chapters
+                WHERE story_id = ? ORDER BY chapter_no
+            ''', (story_id,))
+            chapters = [dict(row) for row in cursor.fetchall()]
+        conn.close()
         
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.extend([story_id, user_id])
+        opening_words = story['word_count'] - sum(chapter['word_count'] for chapter in chapters)
+        return [{'chapter_no': 1, 'title': None, 'content': story['content'], 'word_count': opening_words,
+                 'created_at': story['created_at'], 'updated_at': story['updated_at']}] + chapters
+    
+    @timed_query
+    def update_chapter(self, story_id: int, user_id: str, chapter_no: int, content: str,
+                       title: Optional[str] = None) -> bool:
+        """Rewrite one chapter and adjust the story's word count by the difference"""
+        if chapter_no == 1:
+            return self.update_story(story_id, user_id, content=content)
+        check_story_fields(content=content, title=title)
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            self._begin_write(conn, user_id)
+            
+            cursor.execute('''
+                SELECT c.* FROM story_chapters c JOIN stories s ON s.story_id = c.story_id
+                WHERE c.story_id = ? AND c.chapter_no = ? AND s.user_id = ?
+            ''', (story_id, chapter_no, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            
+            old = dict(row)
+            word_count = len(content.split())
+            if content != old['content']:
+                self._record_revision(cursor, story_id, chapter_no, old['content'])
+            self._count_activity(cursor, story_id, -1)
+            cursor.execute('''
+                UPDATE story_chapters
+                SET content = ?, title = COALESCE(?, title), word_count = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE story_id = ? AND chapter_no = ?
+            ''', (content, title, word_count, story_id, chapter_no))
+            cursor.execute('''
+                UPDATE stories SET word_count = word_count + ?, updated_at = CURRENT_TIMESTAMP WHERE story_id = ?
+            ''', (word_count - old['word_count'], story_id))
+            self._count_activity(cursor, story_id)
             
-            query = f"UPDATE stories SET {', '.join(updates)} WHERE story_id = ? AND user_id = ?"
-            cursor.execute(query, params)
             conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.notify_write('chapter_update', user_id, old=old, new={
+            **old, 'content': content, 'word_count': word_count, 'title': title or old['title']
+        })
         
+        return True
+    
+    @timed_query
+    def get_story_context(self, story_id: int, user_id: str, max_words: int = 300) -> str:
+        """The last max_words words of a story, reading only the chapters needed"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT c.content FROM story_chapters c JOIN stories s ON s.story_id = c.story_id
+            WHERE c.story_id = ? AND s.user_id = ? ORDER BY c.chapter_no DESC
+        ''', (story_id, user_id))
+        
+        words: List[str] = []
+        for row in cursor:
+            words[:0] = row['content'].split()
+            if len(words) >= max_words:
+                break
+        else:
+            cursor.execute('''
+                SELECT story_id, content, archive_offset, archive_length FROM stories WHERE story_id = ? AND user_id = ?
+            ''', (story_id, user_id))
+            row = cursor.fetchone()
+            if row:
+                words[:0] = self._hydrate(dict(row))['content'].split()
         conn.close()
+        
+        return " ".join(words[-max_words:])
     
-    def delete_story(self, story_id: int, user_id: str):
-        """Delete a story"""
+    # Revision operations
+    def _revision_chain(self, cursor, story_id: int, chapter_no: int, revision_no: int) -> Optional[str]:
+        """Rebuild one revision from the nearest snapshot at or before it"""
+        cursor.execute('''
+            SELECT is_snapshot, data FROM story_revisions
+            WHERE story_id = ? AND chapter_no = ? AND revision_no <= ? AND revision_no >= (
+                SELECT MAX(revision_no) FROM story_revisions
+                WHERE story_id = ? AND chapter_no = ? AND revision_no <= ? AND is_snapshot = 1
+            )
+            ORDER BY revision_no
+        ''', (story_id, chapter_no, revision_no, story_id, chapter_no, revision_no))
+        return revisions.rebuild((bool(row['is_snapshot']), row['data']) for row in cursor.fetchall())
+    
+    def _record_revision(self, cursor, story_id: int, chapter_no: int, content: str):
+        """Keep the text an edit is about to replace, inside the edit's transaction"""
+        cursor.execute('SELECT MAX(revision_no) FROM story_revisions WHERE story_id = ? AND chapter_no = ?',
+                       (story_id, chapter_no))
+        last = cursor.fetchone()[0]
+        revision_no = (last or 0) + 1
+        base = self._revision_chain(cursor, story_id, chapter_no, last) if last else None
+        is_snapshot, data = revisions.encode(base, content, revision_no)
+        cursor.execute('''
+            INSERT INTO story_revisions (story_id, chapter_no, revision_no, is_snapshot, data, word_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (story_id, chapter_no, revision_no, int(is_snapshot), data, len(content.split())))
+        
+        if revision_no > revisions.MAX_REVISIONS:
+            self._drop_revisions_before(cursor, story_id, chapter_no, revision_no - revisions.MAX_REVISIONS + 1)
+    
+    def _drop_revisions_before(self, cursor, story_id: int, chapter_no: int, first_kept: int) -> int:
+        """Delete older revisions, turning the first kept one into a snapshot if it was a delta"""
+        cursor.execute('''
+            SELECT revision_no, is_snapshot FROM story_revisions
+            WHERE story_id = ? AND chapter_no = ? AND revision_no >= ? ORDER BY revision_no LIMIT 1
+        ''', (story_id, chapter_no, first_kept))
+        row = cursor.fetchone()
+        if row and not row['is_snapshot']:
+            text = self._revision_chain(cursor, story_id, chapter_no, row['revision_no'])
+            cursor.execute('''
+                UPDATE story_revisions SET is_snapshot = 1, data = ?
+                WHERE story_id = ? AND chapter_no = ? AND revision_no = ?
+            ''', (revisions.encode_snapshot(text), story_id, chapter_no, row['revision_no']))
+        cursor.execute('DELETE FROM story_revisions WHERE story_id = ? AND chapter_no = ? AND revision_no < ?',
+                       (story_id, chapter_no, first_kept))
+        return cursor.rowcount
+    
+    @timed_query
+    def get_revisions(self, story_id: int, user_id: str, chapter_no: int = 1) -> List[Dict]:
+        """Earlier versions of a chapter, newest first (without their text)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM stories WHERE story_id = ? AND user_id = ?', (story_id, user_id))
-        conn.commit()
+        cursor.execute('''
+            SELECT r.revision_no, r.word_count, r.created_at, r.is_snapshot, LENGTH(r.data) AS size
+            FROM story_revisions r JOIN stories s ON s.story_id = r.story_id
+            WHERE r.story_id = ? AND r.chapter_no = ? AND s.user_id = ?
+            ORDER BY r.revision_no DESC
+        ''', (story_id, chapter_no, user_id))
+        rows = cursor.fetchall()
         conn.close()
+        
+        return [dict(row) for row in rows]
     
-    def toggle_favorite(self, story_id: int, user_id: str):
-        """Toggle favorite status of a story"""
+    @timed_query
+    def get_revision(self, story_id: int, user_id: str, chapter_no: int, revision_no: int) -> Optional[str]:
+        """Text of one earlier version"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        cursor.execute('SELECT 1 FROM stories WHERE story_id = ? AND user_id = ?', (story_id, user_id))
+        if not cursor.fetchone():
+            conn.close()
+            return None
         cursor.execute('''
-            UPDATE stories 
-            SET is_favorite = NOT is_favorite 
-            WHERE story_id = ? AND user_id = ?
+            SELECT 1 FROM story_revisions WHERE story_id = ? AND chapter_no = ? AND revision_no = ?
+        ''', (story_id, chapter_no, revision_no))
+        text = self._revision_chain(cursor, story_id, chapter_no, revision_no) if cursor.fetchone() else None
+        conn.close()
+        
+        return text
+    
+    def restore_revision(self, story_id: int, user_id: str, chapter_no: int, revision_no: int) -> bool:
+        """Make an earlier version current; the version it replaces becomes a new revision"""
+        text = self.get_revision(story_id, user_id, chapter_no, revision_no)
+        if text is None:
+            return False
+        return self.update_chapter(story_id, user_id, chapter_no, text)
+    
+    @timed_query
+    def prune_revisions(self, max_age_days: int = revisions.RETENTION_DAYS) -> int:
+        """Delete revisions older than max_age_days for all users; returns how many were deleted"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            # Taken before the read: a deferred read transaction can't be upgraded once another write commits
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cutoff = f'-{max_age_days} days'
+            cursor.execute('''
+                SELECT story_id, chapter_no, MAX(revision_no) + 1 AS first_kept FROM story_revisions
+                WHERE created_at < datetime('now', ?)
+                GROUP BY story_id, chapter_no
+            ''', (cutoff,))
+            chains = cursor.fetchall()
+            deleted = sum(self._drop_revisions_before(cursor, chain['story_id'], chain['chapter_no'],
+                                                      chain['first_kept'])
+                          for chain in chains)
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return deleted
+    
+    # Near-duplicates
+    def _near_duplicates(self, cursor, user_id: str, signature, story_id: int = 0,
+                         originals_only: bool = False) -> List[Dict]:
+        """The user's stories sharing an LSH band with signature, most similar first, at or above the threshold"""
+        keys = dedupe.band_keys(user_id, signature)
+        cursor.execute(f'''
+            SELECT s.story_id, s.title, s.created_at, s.duplicate_of, g.signature FROM stories s
+            JOIN story_signatures g ON g.story_id = s.story_id
+            WHERE s.story_id IN (SELECT story_id FROM story_lsh WHERE band_key IN ({', '.join('?' * len(keys))}))
+            AND s.user_id = ? AND s.story_id != ? {'AND s.duplicate_of IS NULL' if originals_only else ''}
+        ''', (*keys, user_id, story_id))
+        
+        similar = []
+        for row in cursor.fetchall():
+            score = dedupe.similarity(signature, dedupe.unpack(row['signature']))
+            if score >= dedupe.THRESHOLD:
+                similar.append({'story_id': row['story_id'], 'title': row['title'], 'created_at': row['created_at'],
+                                'duplicate_of': row['duplicate_of'], 'similarity': score})
+        similar.sort(key=lambda story: -story['similarity'])
+        return similar
+    
+    def _find_original(self, cursor, user_id: str, signature, story_id: int = 0) -> Optional[int]:
+        """The most similar story that is not itself a near-duplicate, if any"""
+        similar = self._near_duplicates(cursor, user_id, signature, story_id, originals_only=True)
+        return similar[0]['story_id'] if similar else None
+    
+    def _sign_story(self, cursor, story_id: int, user_id: str, signature) -> Optional[int]:
+        """Store a story's signature and band keys and group it under its original; returns the original's id"""
+        original = self._find_original(cursor, user_id, signature, story_id)
+        cursor.execute('INSERT OR REPLACE INTO story_signatures (story_id, signature) VALUES (?, ?)',
+                       (story_id, dedupe.pack(signature)))
+        cursor.execute('DELETE FROM story_lsh WHERE story_id = ?', (story_id,))
+        cursor.executemany('INSERT OR IGNORE INTO story_lsh (band_key, story_id) VALUES (?, ?)',
+                           [(key, story_id) for key in dedupe.band_keys(user_id, signature)])
+        # An edited original takes its own duplicates along when it becomes a duplicate itself
+        cursor.execute('UPDATE stories SET duplicate_of = ? WHERE story_id = ? OR (? IS NOT NULL AND duplicate_of = ?)',
+                       (original, story_id, original, story_id))
+        return original
+    
+    @timed_query
+    def find_duplicates(self, story_id: int, user_id: str) -> List[Dict]:
+        """The user's other stories that are near-duplicates of this one, most similar first"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT g.signature FROM story_signatures g JOIN stories s ON s.story_id = g.story_id
+            WHERE g.story_id = ? AND s.user_id = ?
         ''', (story_id, user_id))
+        row = cursor.fetchone()
+        similar = self._near_duplicates(cursor, user_id, dedupe.unpack(row['signature']), story_id) if row else []
+        conn.close()
         
-        conn.commit()
+        return similar
+    
+    @timed_query
+    def similar_stories(self, story_id: int, user_id: str, k: int = 5) -> List[Dict]:
+        """The user's k stories most like this one, by cosine similarity of TF-IDF vectors (see similarity_index.py)"""
+        from similarity_index import similarity_indexes
+        return similarity_indexes.similar_stories(self, story_id, user_id, k)
+    
+    def index_duplicates(self, batch_size: int = 500) -> Tuple[int, int]:
+        """Sign stories that have no signature yet, oldest first, and group them under their originals
+        
+        Returns (stories signed, near-duplicates found).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        indexed, linked, last_id = 0, 0, 0
+        while True:
+            cursor.execute('''
+                SELECT s.story_id, s.user_id, s.content, s.archive_offset, s.archive_length FROM stories s
+                LEFT JOIN story_signatures g ON g.story_id = s.story_id
+                WHERE s.story_id > ? AND g.story_id IS NULL
+                ORDER BY s.story_id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            users = set()
+            for row in rows:
+                content = self._hydrate(dict(row))['content']
+                if self._sign_story(cursor, row['story_id'], row['user_id'], dedupe.signature(content)):
+                    linked += 1
+                    users.add(row['user_id'])
+            conn.commit()
+            for user_id in users:
+                self.invalidate_user(user_id)
+            indexed += len(rows)
+            last_id = rows[-1]['story_id']
+        conn.close()
+        
+        return indexed, linked
+    
+    def get_duplicate_ids(self) -> List[Tuple[int, str]]:
+        """(story_id, user_id) of every story grouped under an original"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT story_id, user_id FROM stories WHERE duplicate_of IS NOT NULL ORDER BY story_id')
+        rows = [(row['story_id'], row['user_id']) for row in cursor.fetchall()]
         conn.close()
+        
+        return rows
     
+    @cached_read
+    @timed_query
     def search_stories(self, user_id: str, query: str, genre: Optional[str] = None, 
-                       favorite_only: bool = False, limit: int = 50) -> List[Dict]:
+                       favorite_only: bool = False, limit: int = 50, offset: int = 0,
+                       collapse_duplicates: bool = False) -> List[Dict]:
         """Search stories by title or content with filters"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        sql = '''
-            SELECT * FROM stories 
-            WHERE user_id = ? 
-            AND (title LIKE ? OR content LIKE ? OR prompt LIKE ?)
-        '''
-        params: List = [user_id, f'%{query}%', f'%{query}%', f'%{query}%']
+        columns = COLLAPSED_COLUMNS if collapse_duplicates else '*'
+        sql = f'SELECT {columns} FROM stories WHERE user_id = ? AND ({SEARCH_CLAUSE})'
+        params: List = [user_id] + [f'%{query}%'] * 4
+        
+        if collapse_duplicates:
+            sql += ' AND duplicate_of IS NULL'
         
         if genre:
             sql += ' AND genre = ?'
@@ -219,15 +1125,127 @@ class Database:
         if favorite_only:
             sql += ' AND is_favorite = 1'
         
-        sql += ' ORDER BY created_at DESC LIMIT ?'
-        params.append(limit)
+        sql += ' ORDER BY created_at DESC LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
         
         cursor.execute(sql, params)
         rows = cursor.fetchall()
         conn.close()
         
+        return [self._hydrate(dict(row)) for row in rows]
+    
+    @timed_query
+    def get_suggestion_terms(self, user_id: str) -> List[Dict]:
+        """Get the title and tags of every story, for building the typeahead index"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT story_id, title, tags FROM stories WHERE user_id = ?', (user_id,))
+        rows = cursor.fetchall()
+        conn.close()
+        
         return [dict(row) for row in rows]
     
+    def iter_story_texts(self, genre: Optional[str] = None, after_story_id: int = 0, batch_size: int = 500,
+                         with_user: bool = False):
+        """Yield (story_id, content) for all users' stories, oldest first, without loading them all at once
+        
+        with_user yields (story_id, user_id, content) instead.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        sql = ('SELECT story_id, user_id, content, archive_offset, archive_length, chapter_count FROM stories '
+               'WHERE story_id > ?')
+        params: List = [after_story_id]
+        if genre:
+            sql += ' AND genre = ?'
+            params.append(genre)
+        cursor.execute(sql + ' ORDER BY story_id', params)
+        
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    content = self._hydrate(dict(row))['content']
+                    if row['chapter_count'] > 1:
+                        chapters = conn.execute('SELECT content FROM story_chapters WHERE story_id = ? ORDER BY chapter_no',
+                                                (row['story_id'],)).fetchall()
+                        content = CHAPTER_SEPARATOR.join([content] + [c['content'] for c in chapters])
+                    yield (row['story_id'], row['user_id'], content) if with_user else (row['story_id'], content)
+        finally:
+            conn.close()
+    
+    def iter_user_stories(self, user_id: str, query: Optional[str] = None, genre: Optional[str] = None,
+                          favorite_only: bool = False, collapse_duplicates: bool = False,
+                          story_ids: Optional[List[int]] = None, batch_size: int = 200):
+        """Yield one user's stories oldest first, each with all its chapters, without loading them all at once
+        
+        Takes the library filters, or story_ids for a hand-picked set. Each
+        story has a 'chapters' list shaped like get_chapters().
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        sql = 'SELECT * FROM stories WHERE user_id = ?'
+        params: List = [user_id]
+        
+        if story_ids is not None:
+            sql += ' AND story_id IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps([int(story_id) for story_id in story_ids]))
+        
+        if collapse_duplicates:
+            sql += ' AND duplicate_of IS NULL'
+        
+        if query:
+            sql += f' AND ({SEARCH_CLAUSE})'
+            params.extend([f'%{query}%'] * 4)
+        
+        if genre:
+            sql += ' AND genre = ?'
+            params.append(genre)
+        
+        if favorite_only:
+            sql += ' AND is_favorite = 1'
+        
+        cursor.execute(sql + ' ORDER BY created_at, story_id', params)
+        
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    story = self._hydrate(dict(row))
+                    chapters = []
+                    if story['chapter_count'] > 1:
+                        chapters = [dict(c) for c in conn.execute('''
+                            SELECT chapter_no, title, content, word_count FROM story_chapters
+                            WHERE story_id = ? ORDER BY chapter_no
+                        ''', (story['story_id'],))]
+                    opening_words = story['word_count'] - sum(chapter['word_count'] for chapter in chapters)
+                    story['chapters'] = [{'chapter_no': 1, 'title': None, 'content': story['content'],
+                                          'word_count': opening_words}] + chapters
+                    yield story
+        finally:
+            conn.close()
+    
+    @timed_query
+    def get_genres(self) -> List[str]:
+        """Get every genre that has at least one story"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT DISTINCT genre FROM stories WHERE genre IS NOT NULL')
+        genres = [row['genre'] for row in cursor.fetchall()]
+        conn.close()
+        
+        return genres
+    
+    @cached_read
+    @timed_query
     def get_stats(self, user_id: str) -> Dict:
         """Get user statistics"""
         conn = self.get_connection()
@@ -260,3 +1278,239 @@ class Database:
             **dict(row),
             'genres': [dict(g) for g in genre_stats]
         }
+    
+    @timed_query
+    def get_global_stats(self) -> Dict:
+        """Totals across all users, for the admin page"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT 
+                (SELECT COUNT(*) FROM users) as total_users,
+                COUNT(*) as total_stories,
+                COALESCE(SUM(word_count), 0) as total_words,
+                COUNT(CASE WHEN is_favorite = 1 THEN 1 END) as favorite_count
+            FROM stories
+        ''')
+        
+        row = cursor.fetchone()
+        
+        cursor.execute('''
+            SELECT genre, COUNT(*) as count 
+            FROM stories 
+            WHERE genre IS NOT NULL
+            GROUP BY genre
+        ''')
+        
+        genres = {g['genre']: g['count'] for g in cursor.fetchall()}
+        conn.close()
+        
+        return {**dict(row), 'genres': genres}
+    
+    # Activity rollups
+    def _count_activity(self, cursor, story_id: int, sign: int = 1):
+        """Add a story's share of the activity rollups, or take it away with sign=-1, in the caller's transaction"""
+        cursor.execute(ACTIVITY_QUERY.format(where='s.story_id = ?'), (story_id, story_id))
+        rows = [(row['user_id'], row['day'], row['genre'], sign * row['stories'], sign * row['words'])
+                for row in cursor.fetchall()]
+        cursor.executemany('''
+            INSERT INTO daily_user_activity (user_id, day, genre, stories, words) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day, genre) DO UPDATE SET
+                stories = stories + excluded.stories, words = words + excluded.words
+        ''', rows)
+        if sign < 0:
+            cursor.executemany('''
+                DELETE FROM daily_user_activity
+                WHERE user_id = ? AND day = ? AND genre = ? AND stories <= 0 AND words <= 0
+            ''', [row[:3] for row in rows])
+    
+    @cached_read
+    @timed_query
+    def get_activity(self, user_id: str, days: int = activity.WINDOW_DAYS) -> List[Dict]:
+        """The user's rollup rows (day, genre, stories, words) for the last days days, oldest first
+        
+        Reads only daily_user_activity, so the cost depends on the window,
+        not on how many stories the user has.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT day, genre, stories, words FROM daily_user_activity
+            WHERE user_id = ? AND day > date('now', ?)
+            ORDER BY day, genre
+        ''', (user_id, f"-{int(days)} days"))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return rows
+    
+    def rebuild_activity(self, user_id: Optional[str] = None) -> Tuple[int, int]:
+        """Recompute the activity rollups from the stories, one user per transaction
+        
+        Fills them in for stories written before the rollups existed, and
+        repairs any drift. Returns (users, rollup rows).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if user_id is not None:
+            users = [user_id]
+        else:
+            cursor.execute('SELECT user_id FROM stories UNION SELECT user_id FROM daily_user_activity')
+            users = [row[0] for row in cursor.fetchall()]
+        
+        total = 0
+        for user in users:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM daily_user_activity WHERE user_id = ?', (user,))
+            cursor.execute(f'''
+                INSERT INTO daily_user_activity (user_id, day, genre, stories, words)
+                {ACTIVITY_QUERY.format(where='s.user_id = ?')}
+            ''', (user, user))
+            total += cursor.rowcount
+            conn.commit()
+            self.invalidate_user(user)
+        conn.close()
+        
+        return len(users), total
+    
+    # Archive operations
+    def _archive_excluded_users(self) -> set:
+        """Users whose stories must keep their text in the database for now"""
+        return set()
+    
+    def archive_stories(self, after_days: int = archive.AFTER_DAYS, idle_days: int = archive.IDLE_DAYS,
+                        batch_size: int = 200) -> Tuple[int, int]:
+        """Move the text of stories not edited for after_days nor opened for idle_days into the archive file
+        
+        Returns (stories archived, bytes of text moved). Cached reads stay
+        valid since the text they hold is unchanged.
+        """
+        store = archive.open_archive(self.db_name)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        archived, moved, last_id = 0, 0, 0
+        while True:
+            # The write lock keeps edits out between reading a text and blanking it
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT story_id, user_id, content FROM stories
+                WHERE story_id > ? AND archive_offset IS NULL AND updated_at < datetime('now', ?)
+                AND (read_at IS NULL OR read_at < datetime('now', ?)) AND LENGTH(content) >= ?
+                ORDER BY story_id LIMIT ?
+            ''', (last_id, f'-{after_days} days', f'-{idle_days} days', archive.MIN_CHARS, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                conn.commit()
+                break
+            last_id = rows[-1]['story_id']
+            excluded = self._archive_excluded_users()
+            rows = [row for row in rows if row['user_id'] not in excluded]
+            if rows:
+                locations = store.append([(row['story_id'], row['content']) for row in rows])
+                cursor.executemany('''
+                    UPDATE stories SET content = '', archive_offset = ?, archive_length = ? WHERE story_id = ?
+                ''', [(offset, length, row['story_id']) for (offset, length), row in zip(locations, rows)])
+                archived += len(rows)
+                moved += sum(len(row['content'].encode('utf-8')) for row in rows)
+            conn.commit()
+        conn.close()
+        
+        return archived, moved
+    
+    def _restore_archived(self, cursor, user_id: Optional[str] = None, limit: int = -1) -> int:
+        """Put archived text back into the stories rows (one user's, or anyone's); the caller commits"""
+        sql = 'SELECT story_id, archive_offset, archive_length FROM stories WHERE archive_offset IS NOT NULL'
+        params: List = []
+        if user_id is not None:
+            sql += ' AND user_id = ?'
+            params.append(user_id)
+        rows = cursor.execute(sql + ' LIMIT ?', params + [limit]).fetchall()
+        store = archive.open_archive(self.db_name)
+        cursor.executemany('''
+            UPDATE stories SET content = ?, archive_offset = NULL, archive_length = NULL WHERE story_id = ?
+        ''', [(store.read(*row), row[0]) for row in rows])
+        return len(rows)
+    
+    def restore_archived(self, user_id: Optional[str] = None, batch_size: int = 500) -> int:
+        """Move archived text back into the database, for one user or everyone; returns stories restored"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        restored = 0
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            count = self._restore_archived(cursor, user_id, batch_size)
+            conn.commit()
+            restored += count
+            if count < batch_size:
+                break
+        conn.close()
+        
+        return restored
+    
+    def compact_archive(self) -> int:
+        """Rewrite the archive file without the records of edited and deleted stories; returns bytes reclaimed"""
+        store = archive.open_archive(self.db_name)
+        before = store.size()
+        if not before:
+            return 0
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Writers and the archive job wait until the new file and offsets are in place together
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT story_id, archive_offset, archive_length FROM stories
+            WHERE archive_offset IS NOT NULL ORDER BY archive_offset
+        ''')
+        rows = [tuple(row) for row in cursor.fetchall()]
+        locations = store.write_compacted(rows)
+        cursor.executemany('UPDATE stories SET archive_offset = ? WHERE story_id = ?',
+                           [(offset, row[0]) for (offset, _), row in zip(locations, rows)])
+        store.swap_compacted()
+        conn.commit()
+        conn.close()
+        # Rows read before the commit find their records again under the new offsets (see _hydrate)
+        store.drop_previous()
+        
+        return before - store.size()
+    
+    def archive_status(self) -> Dict:
+        """Archived stories, archive bytes (live and on disk) and database bytes (in use and free)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(archive_length), 0) FROM stories WHERE archive_offset IS NOT NULL')
+        archived, live = cursor.fetchone()
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        pages = cursor.execute('PRAGMA page_count').fetchone()[0]
+        free = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.close()
+        
+        return {'archived': archived, 'live_bytes': live + archived * archive.record_size(0),
+                'archive_bytes': archive.open_archive(self.db_name).size(),
+                'db_bytes': pages * page_size, 'free_bytes': free * page_size}
+    
+    def vacuum(self):
+        """Rebuild the database file so pages freed by archiving go back to the disk (blocks writers meanwhile)
+        
+        Also switches the file to incremental auto-vacuum, so afterwards maintenance.py can free pages
+        in small steps without another rebuild.
+        """
+        conn = self.get_connection()
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.close()
+
+
+def open_database(db_name: str = "stories.db", pool_size: int = 0) -> Database:
+    """The app's story store: a single file, or STORY_SHARDS shard files (see sharding.py)"""
+    shards = int(os.getenv("STORY_SHARDS", "1"))
+    if shards <= 1:
+        return Database(db_name, pool_size=pool_size)
+    from sharding import sharded_database
+    return sharded_database(db_name, shards, pool_size=pool_size)
@@ -0,0 +1,111 @@
+"""MinHash signatures for finding near-duplicate stories
+
+A story's signature is SIGNATURE_SIZE 32-bit minimums over its 3-word
+shingles. It uses one-permutation hashing: each shingle is hashed once,
+and the low bits of the hash pick the slot it competes for. So signing
+costs one crc32 per shingle, however long the signature is. Empty slots
+borrow from the next filled one. The share of equal slots between two
+signatures estimates the Jaccard similarity of their shingle sets.
+
+For LSH the signature is cut into BANDS bands. Each band is hashed
+together with the user id into one 64-bit key. Stories sharing any key
+are candidates, and only those are compared slot by slot. With 8 bands
+of 8 slots, pairs at 0.9 similarity share a key 99% of the time (77% at
+0.8). Same-genre template stories, which overlap about 0.4, share one
+0.5% of the time, so a lookup touches a small fraction of a library.
+
+Run as a script to sign existing stories and link their duplicates
+(and optionally delete them):
+
+    python dedupe.py               # index stories saved before dedupe or with DEDUPE_ON_SAVE=off
+    python dedupe.py --delete      # also delete every story linked to an earlier original
+"""
+import hashlib
+import os
+import re
+import zlib
+from array import array
+from typing import List
+
+SIGNATURE_SIZE = 64
+BANDS = 8
+ROWS = SIGNATURE_SIZE // BANDS
+SHINGLE_WORDS = 3
+
+THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.8"))
+# link: save and group under the original; skip: don't save, return the original's id; off: no signing on save
+ON_SAVE = os.getenv("DEDUPE_ON_SAVE", "link")
+
+_WORD_RE = re.compile(r"\w+")
+_EMPTY = 0xFFFFFFFF
+
+
+def shingles(text: str) -> List[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+
+def signature(text: str) -> array:
+    """SIGNATURE_SIZE slot minimums (uint32) over the text's shingles"""
+    sig = array("I", [_EMPTY]) * SIGNATURE_SIZE
+    for shingle in shingles(text):
+        h = zlib.crc32(shingle.encode("utf-8"))
+        slot, value = h % SIGNATURE_SIZE, h // SIGNATURE_SIZE
+        if value < sig[slot]:
+            sig[slot] = value
+    # Densify: an empty slot takes the value of the next filled one, offset so the copies differ
+    filled = [i for i in range(SIGNATURE_SIZE) if sig[i] != _EMPTY]
+    if filled and len(filled) < SIGNATURE_SIZE:
+        for i in range(SIGNATURE_SIZE):
+            if sig[i] == _EMPTY:
+                j = next((k for k in filled if k > i), filled[0])
+                sig[i] = (sig[j] + (j - i) % SIGNATURE_SIZE * 0x9E3779B1) & 0xFFFFFFFF
+    return sig
+
+
+def band_keys(user_id: str, sig: array) -> List[int]:
+    """One signed 64-bit key per band, scoped to the user"""
+    data = sig.tobytes()
+    width = ROWS * sig.itemsize
+    prefix = user_id.encode("utf-8")
+    return [int.from_bytes(hashlib.blake2b(prefix + bytes([band]) + data[band * width:(band + 1) * width],
+                                           digest_size=8).digest(), "big", signed=True)
+            for band in range(BANDS)]
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+
+def pack(sig: array) -> bytes:
+    return sig.tobytes()
+
+
+def unpack(data: bytes) -> array:
+    sig = array("I")
+    sig.frombytes(data)
+    return sig
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from database import open_database
+
+    parser = argparse.ArgumentParser(description="Sign stories without a signature and link near-duplicates")
+    parser.add_argument("--delete", action="store_true", help="delete stories linked to an earlier original")
+    args = parser.parse_args()
+
+    db = open_database()
+    start = time.perf_counter()
+    indexed, linked = db.index_duplicates()
+    print(f"signed {indexed} stories, {linked} near-duplicates found in {time.perf_counter() - start:.1f}s")
+    if args.delete:
+        duplicates = db.get_duplicate_ids()
+        for story_id, user_id in duplicates:
+            db.delete_story(story_id, user_id)
+        print(f"deleted {len(duplicates)} near-duplicates")
@@ -0,0 +1,194 @@
+"""Bulk export of a user's library as a ZIP of Markdown files or one EPUB
+
+Stories come from Database.iter_user_stories, a batch of rows at a time.
+Each one is written into the archive as soon as it arrives, so memory
+holds one story plus the archive's index, whatever the library's size.
+The archive is built in a temporary file that stays in memory up to
+SPOOL_BYTES and moves to disk after that.
+
+ZIP: one Markdown file per story, with the prompt, tags and every chapter.
+EPUB: one XHTML document per story with a table of contents, readable in
+any EPUB 3 reader.
+"""
+import html
+import json
+import re
+import tempfile
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+SPOOL_BYTES = 8 * 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+
+# format -> (label, MIME type, file extension)
+FORMATS = {
+    "zip": ("Markdown files (ZIP)", "application/zip", ".zip"),
+    "epub": ("E-book (EPUB)", "application/epub+zip", ".epub"),
+}
+
+
+def safe_name(title: str) -> str:
+    """A title usable as a file name"""
+    return re.sub(r"[^\w\-]+", "_", title).strip("_")[:80] or "story"
+
+
+def _date_time(timestamp: str) -> Tuple[int, int, int, int, int, int]:
+    try:
+        stamp = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        stamp = datetime.now()
+    return max(stamp, datetime(1980, 1, 1)).timetuple()[:6]  # ZIP dates start in 1980
+
+
+def _tags(story: Dict) -> List[str]:
+    try:
+        return json.loads(story.get('tags') or "[]")
+    except ValueError:
+        return []
+
+
+def _chapters(story: Dict) -> List[Dict]:
+    return story.get('chapters') or [{'chapter_no': 1, 'title': None, 'content': story['content']}]
+
+
+def story_markdown(story: Dict) -> str:
+    """One story as Markdown: title, details, prompt, tags and every chapter"""
+    details = [story['genre'] or "", f"{story['word_count']} words", (story['created_at'] or "")[:10]]
+    lines = [f"# {story['title']}", "", f"*{' · '.join(part for part in details if part)}*", "",
+             f"> {story['prompt']}", ""]
+    tags = _tags(story)
+    if tags:
+        lines += [" ".join(f"`{tag}`" for tag in tags), ""]
+    chapters = _chapters(story)
+    for chapter in chapters:
+        if len(chapters) > 1:
+            heading = f"## Chapter {chapter['chapter_no']}"
+            lines += [heading + (f": {chapter['title']}" if chapter['title'] else ""), ""]
+        lines += [chapter['content'].strip(), ""]
+    return "\n".join(lines)
+
+
+def write_zip(stories: Iterable[Dict], out: BinaryIO) -> int:
+    """Write each story as a Markdown file into a ZIP on out; returns the number of stories"""
+    count = 0
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        for count, story in enumerate(stories, 1):
+            entry = zipfile.ZipInfo(f"{count:05d}_{safe_name(story['title'])}.md", _date_time(story['updated_at']))
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(entry, story_markdown(story))
+    return count
+
+
+def _paragraphs(text: str) -> str:
+    blocks = [block.strip() for block in re.split(r"\n\s*\n", text) if block.strip()]
+    return "\n".join(f"<p>{html.escape(block).replace(chr(10), '<br/>')}</p>" for block in blocks)
+
+
+def story_xhtml(story: Dict) -> str:
+    """One story as an EPUB content document"""
+    title = html.escape(story['title'])
+    body = [f"<h1>{title}</h1>", f"<blockquote><p>{html.escape(story['prompt'])}</p></blockquote>"]
+    chapters = _chapters(story)
+    for chapter in chapters:
+        if len(chapters) > 1:
+            heading = f"Chapter {chapter['chapter_no']}" + (f": {chapter['title']}" if chapter['title'] else "")
+            body.append(f"<h2>{html.escape(heading)}</h2>")
+        body.append(_paragraphs(chapter['content']))
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f'<head><title>{title}</title></head>\n<body>\n' + "\n".join(body) + "\n</body>\n</html>\n")
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def write_epub(stories: Iterable[Dict], out: BinaryIO, title: str = "My Stories", author: str = "") -> int:
+    """Write the stories as one EPUB 3 book on out, a story per document; returns the number of stories"""
+    contents: List[Tuple[str, str]] = []  # (file, title) per story, for the package and the table of contents
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as book:
+        # Readers find the format from an uncompressed mimetype entry at the very start
+        book.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        book.writestr("META-INF/container.xml", CONTAINER_XML)
+        for story in stories:
+            name = f"story-{story['story_id']}.xhtml"
+            book.writestr(f"OEBPS/{name}", story_xhtml(story))
+            contents.append((name, story['title']))
+
+        toc = "\n".join(f'<li><a href="{name}">{html.escape(story_title)}</a></li>' for name, story_title in contents)
+        book.writestr("OEBPS/nav.xhtml", (
+            '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f'<head><title>{html.escape(title)}</title></head>\n<body>\n'
+            f'<nav epub:type="toc"><h1>{html.escape(title)}</h1>\n<ol>\n{toc}\n</ol></nav>\n</body>\n</html>\n'))
+        items = "\n".join(f'    <item id="s{i}" href="{name}" media-type="application/xhtml+xml"/>'
+                          for i, (name, _) in enumerate(contents))
+        spine = "\n".join(f'    <itemref idref="s{i}"/>' for i in range(len(contents)))
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        creator = f"\n    <dc:creator>{html.escape(author)}</dc:creator>" if author else ""
+        book.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:uuid:{uuid.uuid4()}</dc:identifier>
+    <dc:title>{html.escape(title)}</dc:title>{creator}
+    <dc:language>en</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{items}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+""")
+    return len(contents)
+
+
+def export_file(db, user_id: str, fmt: str, author: str = "", **filters) -> Tuple[BinaryIO, int]:
+    """Export the user's stories matching filters (see iter_user_stories) into a temporary file
+
+    Returns the file, rewound, and the number of stories in it. The
+    caller closes the file, which deletes it.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    stories = db.iter_user_stories(user_id, **filters)
+    try:
+        if fmt == "zip":
+            count = write_zip(stories, spool)
+        else:
+            count = write_epub(stories, spool, author=author)
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        stories.close()
+    spool.seek(0)
+    return spool, count
+
+
+def iter_file(f: BinaryIO, chunk_size: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Read f in chunks for a streamed response, closing it at the end"""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def download_name(fmt: str, label: Optional[str] = None) -> str:
+    stamp = datetime.now().strftime("%Y-%m-%d")
+    return f"{safe_name(label or 'stories')}_{stamp}{FORMATS[fmt][2]}"
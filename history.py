@@ -1,9 +1,18 @@
 """Story history and management UI"""
 import streamlit as st
-from database import Database
+from database import open_database
+from export import FORMATS, download_name, export_file, safe_name, story_markdown
+from huggingface_client import continue_story
+from search_index import MIN_QUERY_LENGTH, normalize_query, suggestion_indexes
+from profiling import span
 from datetime import datetime
 import json
 
+PAGE_SIZES = [10, 20, 50]
+CONTEXT_WORDS = 300  # words of the story so far sent with a continuation request
+SIMILAR_STORIES = 5
+DISPLAY_MODES = ["Compact", "Expanded"]
+
 def parse_tags(tags_json):
     """Parse tags from JSON string"""
     if tags_json:
@@ -22,13 +31,16 @@ def show_story_card(story, db, on_edit_callback=None):
             st.markdown(f"### {story['title']}")
             created = datetime.fromisoformat(story['created_at']).strftime("%B %d, %Y at %I:%M %p")
             genre_badge = f"🏷️ {story['genre']}" if story['genre'] else ""
-            st.caption(f"📅 {created} | 📝 {story['word_count']} words | {genre_badge}")
+            chapters = f" | 📖 {story['chapter_count']} chapters" if story['chapter_count'] > 1 else ""
+            duplicates = f" | 🗂️ +{story['duplicate_count']} similar" if story.get('duplicate_count') else ""
+            st.caption(f"📅 {created} | 📝 {story['word_count']} words{chapters}{duplicates} | {genre_badge}")
         
         with col2:
             is_fav = story['is_favorite']
             if st.button("⭐" if is_fav else "☆", key=f"fav_{story['story_id']}", help="Toggle favorite"):
                 db.toggle_favorite(story['story_id'], story['user_id'])
                 st.rerun()
+            show_select_box(story)
         
         # Show preview
         preview = story['content'][:200] + "..." if len(story['content']) > 200 else story['content']
@@ -56,8 +68,8 @@ def show_story_card(story, db, on_edit_callback=None):
             if st.button("💾 Download", key=f"download_{story['story_id']}"):
                 st.download_button(
                     label="Download as Markdown",
-                    data=story['content'],
-                    file_name=f"{story['title'].replace(' ', '_')}.md",
+                    data=story_markdown(with_chapters(story, db)),
+                    file_name=f"{safe_name(story['title'])}.md",
                     mime="text/markdown",
                     key=f"dl_btn_{story['story_id']}"
                 )
@@ -69,6 +81,81 @@ def show_story_card(story, db, on_edit_callback=None):
         st.divider()
 
 
+def with_chapters(story, db):
+    """The story with its chapters attached, for export"""
+    if story['chapter_count'] > 1:
+        return {**story, 'chapters': db.get_chapters(story['story_id'], story['user_id'])}
+    return story
+
+
+def _toggle_export_selection(story_id):
+    st.session_state.setdefault('export_selection', set()).symmetric_difference_update({story_id})
+
+
+def show_select_box(story):
+    """Checkbox that adds the story to the export selection"""
+    st.checkbox("Select", value=story['story_id'] in st.session_state.get('export_selection', set()),
+                key=f"select_{story['story_id']}", on_change=_toggle_export_selection, args=(story['story_id'],),
+                help="Select for export", label_visibility="collapsed")
+
+
+def show_story_row(story, db):
+    """Display a compact one-line story row"""
+    col1, col2, col3, col4 = st.columns([6, 1, 1, 1])
+    
+    with col1:
+        genre_badge = f" | 🏷️ {story['genre']}" if story['genre'] else ""
+        duplicates = f" | 🗂️ +{story['duplicate_count']} similar" if story.get('duplicate_count') else ""
+        st.markdown(f"**{story['title']}**")
+        st.caption(f"📝 {story['word_count']} words{genre_badge}{duplicates}")
+    
+    with col2:
+        is_fav = story['is_favorite']
+        if st.button("⭐" if is_fav else "☆", key=f"fav_{story['story_id']}", help="Toggle favorite"):
+            db.toggle_favorite(story['story_id'], story['user_id'])
+            st.rerun()
+    
+    with col3:
+        if st.button("👁️", key=f"view_{story['story_id']}", help="View full story"):
+            st.session_state['viewing_story'] = story['story_id']
+            st.rerun()
+    
+    with col4:
+        show_select_box(story)
+
+
+def show_story_page(stories, db, display_mode):
+    """Render only the current page of stories in the chosen display mode"""
+    with span("history.render_stories"):
+        for story in stories:
+            if display_mode == "Compact":
+                show_story_row(story, db)
+            else:
+                show_story_card(story, db)
+
+
+def show_pagination(total, page_size):
+    """Show page controls and return the zero-based page index"""
+    page_count = max(1, (total + page_size - 1) // page_size)
+    page = min(st.session_state.get('library_page', 0), page_count - 1)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col1:
+        if st.button("⬅️ Previous", key="page_prev", disabled=page == 0):
+            page -= 1
+    
+    with col3:
+        if st.button("Next ➡️", key="page_next", disabled=page >= page_count - 1):
+            page += 1
+    
+    with col2:
+        st.caption(f"Page {page + 1} of {page_count}")
+    
+    st.session_state['library_page'] = page
+    return page
+
+
 def show_story_detail(story, db):
     """Show full story detail"""
     st.markdown(f"# {story['title']}")
@@ -93,7 +180,16 @@ def show_story_detail(story, db):
     st.info(story['prompt'])
     
     st.markdown("### Story")
-    st.markdown(story['content'])
+    story = with_chapters(story, db)
+    if story['chapter_count'] > 1:
+        for chapter in story['chapters']:
+            heading = f"Chapter {chapter['chapter_no']}"
+            if chapter['title']:
+                heading += f": {chapter['title']}"
+            st.markdown(f"#### {heading}")
+            st.markdown(chapter['content'])
+    else:
+        st.markdown(story['content'])
     
     # Tags
     tags = parse_tags(story.get('tags'))
@@ -101,8 +197,20 @@ def show_story_detail(story, db):
         st.markdown("### Tags")
         st.markdown(" ".join([f"`{tag}`" for tag in tags]))
     
+    duplicates = db.find_duplicates(story['story_id'], story['user_id'])
+    if duplicates:
+        with st.expander(f"🗂️ {len(duplicates)} near-duplicate {'story' if len(duplicates) == 1 else 'stories'}"):
+            for duplicate in duplicates:
+                col1, col2 = st.columns([5, 1])
+                with col1:
+                    st.markdown(f"**{duplicate['title']}** · {duplicate['similarity']:.0%} similar")
+                with col2:
+                    if st.button("👁️", key=f"view_duplicate_{duplicate['story_id']}", help="View this story"):
+                        st.session_state['viewing_story'] = duplicate['story_id']
+                        st.rerun()
+    
     st.markdown("---")
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
     
     with col1:
         if st.button("⬅️ Back to Library", type="primary"):
@@ -113,8 +221,8 @@ def show_story_detail(story, db):
     with col2:
         st.download_button(
             "💾 Download",
-            data=story['content'],
-            file_name=f"{story['title'].replace(' ', '_')}.md",
+            data=story_markdown(story),
+            file_name=f"{safe_name(story['title'])}.md",
             mime="text/markdown"
         )
     
@@ -124,12 +232,125 @@ def show_story_detail(story, db):
             if 'viewing_story' in st.session_state:
                 del st.session_state['viewing_story']
             st.rerun()
+    
+    with col4:
+        if st.button("➕ Continue Story"):
+            st.session_state['continuing_story'] = story['story_id']
+            st.rerun()
+    
+    with col5:
+        if st.button("🕘 History"):
+            st.session_state['story_history'] = story['story_id']
+            st.rerun()
+    
+    with col6:
+        if st.button("🔎 More Like This"):
+            st.session_state['similar_story'] = story['story_id']
+            st.rerun()
+    
+    if st.session_state.get('similar_story') == story['story_id']:
+        show_similar_stories(story, db)
+    
+    if st.session_state.get('continuing_story') == story['story_id']:
+        show_continue_form(story, db)
+    
+    if st.session_state.get('story_history') == story['story_id']:
+        show_revision_history(story, db)
+
+
+def show_similar_stories(story, db):
+    """The stories in the library closest to this one"""
+    st.markdown("### 🔎 More Like This")
+    with st.spinner("Finding similar stories..."):
+        similar = db.similar_stories(story['story_id'], story['user_id'], k=SIMILAR_STORIES)
+    if not similar:
+        st.info("No other stories in your library to compare with yet.")
+    for other in similar:
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            genre_badge = f" | 🏷️ {other['genre']}" if other['genre'] else ""
+            st.markdown(f"**{other['title']}**")
+            st.caption(f"{other['similarity']:.0%} similar | 📝 {other['word_count']} words{genre_badge}")
+        with col2:
+            if st.button("👁️", key=f"view_similar_{other['story_id']}", help="View this story"):
+                st.session_state['viewing_story'] = other['story_id']
+                del st.session_state['similar_story']
+                st.rerun()
+    
+    if st.button("❌ Close", key="close_similar"):
+        del st.session_state['similar_story']
+        st.rerun()
+
+
+def show_continue_form(story, db):
+    """Generate the next chapter from the end of the story so far"""
+    with st.form("continue_story_form"):
+        st.markdown(f"### ➕ Chapter {story['chapter_count'] + 1}")
+        chapter_title = st.text_input("Chapter title (optional)")
+        length = st.slider("Length (words)", 100, 800, 300, 50)
+        creativity = st.slider("Creativity", 0.1, 1.0, story['creativity'] or 0.7, 0.05)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            write = st.form_submit_button("✨ Write Next Chapter", type="primary")
+        with col2:
+            cancel = st.form_submit_button("❌ Cancel")
+    
+    if write:
+        context = db.get_story_context(story['story_id'], story['user_id'], CONTEXT_WORDS)
+        with st.spinner("🎭 Continuing your story..."):
+            chapter = continue_story(story['prompt'], context, story['genre'] or "Fantasy", creativity, length)
+        if chapter.startswith("Unable"):
+            st.error(chapter)
+            return
+        db.add_chapter(story['story_id'], story['user_id'], chapter, title=chapter_title.strip() or None)
+        del st.session_state['continuing_story']
+        st.rerun()
+    
+    if cancel:
+        del st.session_state['continuing_story']
+        st.rerun()
+
+
+def show_revision_history(story, db):
+    """Browse earlier versions of a chapter and restore one"""
+    st.markdown("### 🕘 Revision History")
+    chapter_no = 1
+    if story['chapter_count'] > 1:
+        chapter_no = st.selectbox("Chapter", range(1, story['chapter_count'] + 1), key="history_chapter_no")
+    
+    revisions = db.get_revisions(story['story_id'], story['user_id'], chapter_no)
+    if not revisions:
+        st.info("No earlier versions yet. A version is saved each time you edit the story.")
+    else:
+        labels = {rev['revision_no']: f"#{rev['revision_no']} · {rev['created_at']} · {rev['word_count']} words"
+                  for rev in revisions}
+        revision_no = st.selectbox("Version", list(labels), format_func=labels.get, key="history_revision_no")
+        text = db.get_revision(story['story_id'], story['user_id'], chapter_no, revision_no)
+        st.text_area("Content", text or "", height=300, disabled=True, key=f"history_preview_{revision_no}")
+        if st.button("↩️ Restore this version", type="primary"):
+            db.restore_revision(story['story_id'], story['user_id'], chapter_no, revision_no)
+            st.success("✅ Version restored!")
+            del st.session_state['story_history']
+            st.rerun()
+    
+    if st.button("❌ Close History"):
+        del st.session_state['story_history']
+        st.rerun()
 
 
 def show_edit_form(story, db, user_id):
     """Show edit form for a story"""
     st.markdown(f"## ✏️ Editing: {story['title']}")
     
+    # Only the chosen chapter is loaded into the editor and written back
+    chapter_no, chapter_text = 1, story['content']
+    if story['chapter_count'] > 1:
+        chapters = db.get_chapters(story['story_id'], user_id)
+        chapter_no = st.selectbox("Chapter", [c['chapter_no'] for c in chapters],
+                                  format_func=lambda n: f"Chapter {n}", key="edit_chapter_no")
+        chapter_text = chapters[chapter_no - 1]['content']
+    
     with st.form("edit_story_form"):
         new_title = st.text_input("Title", value=story['title'])
         new_genre = st.selectbox(
@@ -137,7 +358,7 @@ def show_edit_form(story, db, user_id):
             ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"],
             index=["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"].index(story['genre']) if story['genre'] in ["Fantasy", "Sci-Fi", "Mystery", "Romance", "Horror", "Adventure", "Comedy", "Drama", "Thriller"] else 0
         )
-        new_content = st.text_area("Content", value=story['content'], height=400)
+        new_content = st.text_area("Content", value=chapter_text, height=400)
         
         tags = parse_tags(story.get('tags'))
         new_tags_str = st.text_input("Tags (comma-separated)", value=", ".join(tags))
@@ -155,10 +376,12 @@ def show_edit_form(story, db, user_id):
                 story['story_id'],
                 user_id,
                 title=new_title,
-                content=new_content,
+                content=new_content if chapter_no == 1 else None,
                 genre=new_genre,
                 tags=new_tags
             )
+            if chapter_no > 1 and new_content != chapter_text:
+                db.update_chapter(story['story_id'], user_id, chapter_no, new_content)
             st.success("Story updated successfully!")
             if 'editing_story' in st.session_state:
                 del st.session_state['editing_story']
@@ -170,9 +393,40 @@ def show_edit_form(story, db, user_id):
             st.rerun()
 
 
+def show_export_panel(db, user_id, total, filters):
+    """Download many stories at once: Markdown files in a ZIP, or one EPUB"""
+    selection = st.session_state.get('export_selection', set())
+    with st.expander(f"📦 Export stories{f' ({len(selection)} selected)' if selection else ''}"):
+        scopes = {"filtered": f"All {total} matching the search and filters"}
+        if selection:
+            scopes["selected"] = f"The {len(selection)} selected"
+        scope = st.radio("Stories", list(scopes), format_func=scopes.get, horizontal=True, key="export_scope")
+        fmt = st.radio("Format", list(FORMATS), format_func=lambda f: FORMATS[f][0], horizontal=True,
+                       key="export_format")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            prepare = st.button("Prepare download", key="export_prepare", type="primary")
+        with col2:
+            if selection and st.button("Clear selection", key="export_clear"):
+                st.session_state['export_selection'] = set()
+                st.rerun()
+        
+        if prepare:
+            chosen = {'story_ids': sorted(selection)} if scope == "selected" else filters
+            user = db.get_user(user_id) or {}
+            with st.spinner("Packing stories..."):
+                spool, count = export_file(db, user_id, fmt, author=user.get('display_name') or "", **chosen)
+                data = spool.read()
+                spool.close()
+            st.download_button(f"💾 Download {count} {'story' if count == 1 else 'stories'} "
+                               f"({len(data) / 1e6:.1f} MB)", data=data, file_name=download_name(fmt),
+                               mime=FORMATS[fmt][1], key="export_download")
+
+
 def show_history_page(user_id):
     """Display story history page with search and filters"""
-    db = Database()
+    db = open_database()
     
     st.title("📚 My Story Library")
     
@@ -224,8 +478,29 @@ def show_history_page(user_id):
     # Search and filters
     col1, col2, col3 = st.columns([3, 1, 1])
     
+    # A clicked suggestion has to be applied before the search box is created
+    if 'pending_search' in st.session_state:
+        st.session_state['library_search'] = st.session_state.pop('pending_search')
+    
     with col1:
-        search_query = st.text_input("🔍 Search stories", placeholder="Search by title, content, or prompt...")
+        raw_query = st.text_input("🔍 Search stories", placeholder="Search by title, content, or prompt...",
+                                  key="library_search")
+        search_query = normalize_query(raw_query)
+        if len(search_query) < MIN_QUERY_LENGTH:
+            search_query = ""
+        
+        suggestions = []
+        if search_query:
+            with span("history.suggest"):
+                suggestions = [s for s in suggestion_indexes.suggest(db, user_id, search_query, limit=6)
+                               if normalize_query(s) != search_query]
+        if suggestions:
+            suggestion_cols = st.columns(len(suggestions))
+            for idx, suggestion in enumerate(suggestions):
+                with suggestion_cols[idx]:
+                    if st.button(suggestion, key=f"suggest_{idx}"):
+                        st.session_state['pending_search'] = suggestion
+                        st.rerun()
     
     with col2:
         genre_filter = st.selectbox(
@@ -235,26 +510,46 @@ def show_history_page(user_id):
     
     with col3:
         show_favorites = st.checkbox("⭐ Favorites Only")
+        collapse = st.checkbox("🗂️ Collapse duplicates", key="library_collapse",
+                               help="Show near-duplicate stories once, under the earliest")
     
-    # Get stories
-    if search_query:
-        genre = None if genre_filter == "All" else genre_filter
-        stories = db.search_stories(user_id, search_query, genre=genre, favorite_only=show_favorites)
-    else:
-        stories = db.get_user_stories(user_id)
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        display_mode = st.radio("Display", DISPLAY_MODES, horizontal=True, key="library_display_mode")
+    
+    with col2:
+        page_size = st.selectbox("Per page", PAGE_SIZES, index=1, key="library_page_size")
+    
+    genre = None if genre_filter == "All" else genre_filter
+    
+    # Go back to the first page whenever the result set changes
+    filters = (search_query, genre, show_favorites, collapse, page_size)
+    if st.session_state.get('library_filters') != filters:
+        st.session_state['library_filters'] = filters
+        st.session_state['library_page'] = 0
+    
+    # Only the visible page is fetched and rendered
+    total = db.count_stories(user_id, query=search_query or None, genre=genre, favorite_only=show_favorites,
+                             collapse_duplicates=collapse)
+    
+    if total:
+        st.markdown(f"### Found {total} {'story' if total == 1 else 'stories'}")
         
-        # Apply filters
-        if genre_filter != "All":
-            stories = [s for s in stories if s['genre'] == genre_filter]
-        if show_favorites:
-            stories = [s for s in stories if s['is_favorite']]
-    
-    # Display stories
-    if stories:
-        st.markdown(f"### Found {len(stories)} {'story' if len(stories) == 1 else 'stories'}")
+        show_export_panel(db, user_id, total, {'query': search_query or None, 'genre': genre,
+                                               'favorite_only': show_favorites, 'collapse_duplicates': collapse})
         
-        for story in stories:
-            show_story_card(story, db)
+        page = show_pagination(total, page_size)
+        offset = page * page_size
+        
+        if search_query:
+            stories = db.search_stories(user_id, search_query, genre=genre, favorite_only=show_favorites,
+                                        limit=page_size, offset=offset, collapse_duplicates=collapse)
+        else:
+            stories = db.get_user_stories(user_id, limit=page_size, offset=offset, genre=genre,
+                                          favorite_only=show_favorites, collapse_duplicates=collapse)
+        
+        show_story_page(stories, db, display_mode)
     else:
         st.info("No stories found. Generate your first story to get started!")
     
@@ -0,0 +1,289 @@
+"""Background maintenance of the story database files
+
+Deleted and edited stories leave free pages behind, and the planner's
+statistics drift from the data. The app and the API server each start a
+daemon thread that runs these jobs on every database file (each shard
+when STORY_SHARDS > 1) once they are due. Jobs only start after the
+process has made no database call for IDLE_SECONDS:
+
+- checkpoint           every 5 minutes: passive WAL checkpoint, which never waits for readers
+- analyze              daily: ANALYZE, sampling ANALYSIS_LIMIT rows per index
+- incremental_vacuum   every 10 minutes: gives free pages back to the disk, VACUUM_PAGES per
+                       short write transaction, until VACUUM_PAGES are left or a request comes in
+- quick_check          daily: PRAGMA quick_check
+- integrity_check      weekly: PRAGMA integrity_check, which also checks every index
+- prune_revisions      daily: drops story versions past REVISION_RETENTION_DAYS
+- activity_backfill    weekly: recomputes the daily activity rollups from the stories, which
+                       fills them in on files from before the rollups (see activity.py)
+
+Each file keeps the last run of every job (start, duration, result) in
+its maintenance_runs table. A job is claimed there before it runs, so
+processes sharing a file share one schedule. Older files must be
+switched to incremental auto-vacuum once with `convert`, which rebuilds
+them like VACUUM. Set MAINTENANCE=0 to turn the thread off.
+
+    python maintenance.py                 # last run of every job
+    python maintenance.py run [JOB ...]   # run jobs now, due or not
+    python maintenance.py convert         # switch to incremental auto-vacuum (blocks writers meanwhile)
+"""
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database
+from metrics import registry
+
+ENABLED = os.getenv("MAINTENANCE", "1") != "0"
+IDLE_SECONDS = float(os.getenv("MAINTENANCE_IDLE_SECONDS", "30"))
+POLL_SECONDS = 10.0
+ANALYSIS_LIMIT = 1000
+VACUUM_PAGES = 256
+STEP_SLEEP = 0.05  # between vacuum steps, so waiting writers get the lock
+
+last_run = registry.gauge("storygen_maintenance_last_run_timestamp_seconds",
+                          "When a maintenance job last finished", ("job", "file"))
+last_duration = registry.gauge("storygen_maintenance_duration_seconds",
+                               "How long a maintenance job last took", ("job", "file"))
+failures = registry.counter("storygen_maintenance_failures_total",
+                            "Maintenance jobs that failed or found problems", ("job",))
+
+
+def checkpoint(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    busy, frames, copied = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    if frames < 0:
+        return True, "not in WAL mode"
+    return True, f"{copied} of {frames} WAL frames copied" + (" (readers still need the rest)" if copied < frames else "")
+
+
+def analyze(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    conn.execute(f'PRAGMA analysis_limit={ANALYSIS_LIMIT}')
+    conn.execute('ANALYZE')
+    indexes = conn.execute('SELECT COUNT(*) FROM sqlite_stat1').fetchone()[0]
+    return True, f"statistics for {indexes} indexes"
+
+
+def incremental_vacuum(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return True, "skipped: incremental auto-vacuum is off (python maintenance.py convert)"
+    freed = 0
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # A few free pages are kept for new rows to reuse
+    while free > VACUUM_PAGES and idle():
+        # execute() would step the pragma once, which frees a single page
+        conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({VACUUM_PAGES}); COMMIT;')
+        left = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        freed, free = freed + free - left, left
+        time.sleep(STEP_SLEEP)
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    paused = ", paused for requests" if free > VACUUM_PAGES else ""
+    return True, f"freed {freed * page_size / 1e6:.1f} MB, {free * page_size / 1e6:.1f} MB still free{paused}"
+
+
+def _check(conn: sqlite3.Connection, pragma: str) -> Tuple[bool, str]:
+    problems = [row[0] for row in conn.execute(f'PRAGMA {pragma}(20)')]
+    if problems == ["ok"]:
+        return True, "ok"
+    return False, "; ".join(problems)
+
+
+def quick_check(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    return _check(conn, "quick_check")
+
+
+def integrity_check(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    return _check(conn, "integrity_check")
+
+
+def prune_revisions(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    return True, f"pruned {db.prune_revisions()} versions"
+
+
+def activity_backfill(db, conn: sqlite3.Connection, idle: Callable[[], bool]) -> Tuple[bool, str]:
+    users, rows = db.rebuild_activity()
+    return True, f"{rows} rollup rows for {users} users"
+
+
+HOUR = 3600
+# name -> (seconds between runs, job); run in this order
+JOBS: Dict[str, Tuple[float, Callable]] = {
+    "checkpoint": (300, checkpoint),
+    "analyze": (24 * HOUR, analyze),
+    "incremental_vacuum": (600, incremental_vacuum),
+    "quick_check": (24 * HOUR, quick_check),
+    "integrity_check": (7 * 24 * HOUR, integrity_check),
+    "prune_revisions": (24 * HOUR, prune_revisions),
+    "activity_backfill": (7 * 24 * HOUR, activity_backfill),
+}
+
+
+def _connect(db_name: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_name, timeout=5, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            job TEXT PRIMARY KEY,
+            started_at TIMESTAMP,
+            seconds REAL,
+            ok INTEGER,
+            result TEXT
+        )
+    ''')
+    return conn
+
+
+def _claim(conn: sqlite3.Connection, job: str, interval: float) -> bool:
+    """Mark the job as started if its last start is at least interval seconds ago"""
+    conn.execute('BEGIN IMMEDIATE')
+    row = conn.execute('''
+        SELECT started_at > datetime('now', ?) FROM maintenance_runs WHERE job = ?
+    ''', (f"-{int(interval)} seconds", job)).fetchone()
+    if row is not None and row[0]:
+        conn.execute('COMMIT')
+        return False
+    conn.execute('''
+        INSERT OR REPLACE INTO maintenance_runs (job, started_at, result) VALUES (?, CURRENT_TIMESTAMP, 'running')
+    ''', (job,))
+    conn.execute('COMMIT')
+    return True
+
+
+def run_job(db, name: str, idle: Callable[[], bool] = lambda: True, force: bool = False) -> Optional[Dict]:
+    """Run one job on one database file if it is due (or force); returns its run, or None if not due"""
+    interval, job = JOBS[name]
+    conn = _connect(db.db_name)
+    try:
+        if not _claim(conn, name, 0 if force else interval):
+            return None
+        start = time.perf_counter()
+        try:
+            ok, result = job(db, conn, idle)
+        except Exception as e:
+            # Recorded as a failed run like any other, so one broken job doesn't stop the rest
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            ok, result = False, f"failed: {e}" if isinstance(e, sqlite3.Error) else f"failed: {type(e).__name__}: {e}"
+        seconds = time.perf_counter() - start
+        conn.execute('UPDATE maintenance_runs SET seconds = ?, ok = ?, result = ? WHERE job = ?',
+                     (seconds, ok, result, name))
+    finally:
+        conn.close()
+    file = os.path.basename(db.db_name)
+    last_run.set(time.time(), job=name, file=file)
+    last_duration.set(seconds, job=name, file=file)
+    if not ok:
+        failures.inc(job=name)
+    return {'file': file, 'job': name, 'seconds': seconds, 'ok': ok, 'result': result}
+
+
+def shards_of(db) -> List:
+    """The Database of every file behind db: itself, or each shard"""
+    return getattr(db, 'shards', [db])
+
+
+def status(db) -> List[Dict]:
+    """Last run of every job on every file, and how often it runs"""
+    rows = []
+    for part in shards_of(db):
+        conn = _connect(part.db_name)
+        runs = {row['job']: dict(row) for row in conn.execute('''
+            SELECT job, started_at, seconds, ok, result FROM maintenance_runs
+        ''')}
+        conn.close()
+        for name, (interval, _) in JOBS.items():
+            run = runs.get(name, {'started_at': None, 'seconds': None, 'ok': None, 'result': "never run"})
+            rows.append({'file': os.path.basename(part.db_name), 'job': name, 'started_at': run['started_at'],
+                         'seconds': run['seconds'], 'ok': run['ok'], 'result': run['result'],
+                         'every': f"{interval / HOUR:g}h" if interval >= HOUR else f"{interval / 60:g}m"})
+    return rows
+
+
+class MaintenanceScheduler:
+    """Runs due jobs from a daemon thread whenever the process has been quiet for idle_seconds"""
+
+    def __init__(self, db, idle_seconds: float = IDLE_SECONDS, poll_seconds: float = POLL_SECONDS):
+        self.db = db
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def idle(self) -> bool:
+        return time.monotonic() - database.last_query_at >= self.idle_seconds
+
+    def run_due(self) -> List[Dict]:
+        """One pass over every file and job; stops as soon as the process gets busy"""
+        runs = []
+        for part in shards_of(self.db):
+            for name in JOBS:
+                if not self.idle():
+                    return runs
+                run = run_job(part, name, self.idle)
+                if run is not None:
+                    runs.append(run)
+        return runs
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.run_due()
+            except sqlite3.Error:
+                pass  # the claim found the file locked; try again next poll
+            except Exception:
+                traceback.print_exc()  # keep the thread alive; the next poll tries again
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_scheduler: Optional[MaintenanceScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_maintenance(db) -> Optional[MaintenanceScheduler]:
+    """Start the maintenance thread for db once per process; safe to call on every rerun"""
+    global _scheduler
+    if not ENABLED:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = MaintenanceScheduler(db)
+            _scheduler.start()
+        return _scheduler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import open_database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="run jobs now, due or not")
+    run.add_argument("jobs", nargs="*", help=f"any of {', '.join(JOBS)} (default: all)")
+    commands.add_parser("convert", help="switch older files to incremental auto-vacuum")
+    args = parser.parse_args()
+    if args.command == "run" and set(args.jobs) - set(JOBS):
+        parser.error(f"unknown job: {', '.join(sorted(set(args.jobs) - set(JOBS)))}")
+
+    db = open_database()
+    if args.command == "run":
+        for part in shards_of(db):
+            for name in args.jobs or JOBS:
+                run = run_job(part, name, force=True)
+                print(f"{run['file']} {name}: {run['result']} ({run['seconds']:.2f}s)")
+    elif args.command == "convert":
+        start = time.perf_counter()
+        db.vacuum()
+        print(f"rebuilt with incremental auto-vacuum in {time.perf_counter() - start:.1f}s")
+    else:
+        for row in status(db):
+            when = f"{row['started_at']} UTC, {row['seconds']:.2f}s" if row['seconds'] is not None else "-"
+            print(f"{row['file']:<20} {row['job']:<20} every {row['every']:<5} {when:<36} {row['result']}")
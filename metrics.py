@@ -0,0 +1,294 @@
+"""In-process metrics with Prometheus text exposition
+
+Counters, gauges and histograms live in a process-wide registry and are
+served at http://METRICS_HOST:METRICS_PORT/metrics by a daemon thread
+(start_metrics_server). Set METRICS_PORT=0 to disable the endpoint.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+ACTIVE_SESSION_WINDOW = 300  # seconds since last rerun for a session to count as active
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base class: one named metric with a fixed set of label names"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class CallbackGauge(Metric):
+    """Gauge whose value is read from a function at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            return [f"{self.name} {_format_value(self.fn())}"]
+        except Exception:
+            return []
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1  # index == len(buckets) is the +Inf bucket
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {int(series[-1])}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def callback_gauge(self, name, help_text, fn) -> CallbackGauge:
+        return self.register(CallbackGauge(name, help_text, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+# Generation pipeline
+hf_requests = registry.counter("storygen_hf_requests_total", "HF inference API calls", ("model", "status"))
+hf_latency = registry.histogram("storygen_hf_request_seconds", "HF inference API call latency", ("model",))
+generations = registry.counter("storygen_generations_total", "Stories generated, by the path that produced them",
+                               ("source",))
+generation_latency = registry.histogram("storygen_generation_seconds", "End-to-end story generation latency",
+                                        ("source",))
+assembly_latency = registry.histogram("storygen_assembly_seconds", "Time spent trimming or assembling story text",
+                                      ("step",), FAST_BUCKETS)
+
+# Storage
+db_latency = registry.histogram("storygen_db_query_seconds", "Database method latency (cache misses only)",
+                                ("method",), FAST_BUCKETS)
+
+# Sessions
+_sessions: Dict[str, float] = {}
+_sessions_lock = threading.Lock()
+
+
+def touch_session(session_id: str):
+    """Mark a UI session as active (call on every rerun)"""
+    with _sessions_lock:
+        _sessions[session_id] = time.time()
+
+
+def active_session_count() -> int:
+    cutoff = time.time() - ACTIVE_SESSION_WINDOW
+    with _sessions_lock:
+        for session_id in [s for s, seen in _sessions.items() if seen < cutoff]:
+            del _sessions[session_id]
+        return len(_sessions)
+
+
+registry.callback_gauge("storygen_active_sessions",
+                        f"UI sessions active in the last {ACTIVE_SESSION_WINDOW}s", active_session_count)
+
+
+def _cache_stat(field: str) -> Callable[[], float]:
+    def read():
+        from cache import library_cache
+        return library_cache.stats()[field]
+    return read
+
+
+for _field in ("hits", "misses", "evictions", "size", "hit_ratio"):
+    registry.callback_gauge(f"storygen_library_cache_{_field}", f"Library cache {_field.replace('_', ' ')}",
+                            _cache_stat(_field))
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator observing a function's latency"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread; safe to call repeatedly
+
+    Returns None if disabled (port 0) or the port is taken, e.g. by another
+    worker process that already exposes it.
+    """
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError:
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
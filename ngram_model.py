@@ -0,0 +1,329 @@
+"""Offline trigram story model trained on the stories table
+
+A CPU-only fallback for when the HF API is unavailable. Each genre gets
+its own model:
+
+- words are mapped to integer ids
+- trigram and bigram counts are stored as sorted context keys with CSR
+  offsets into parallel next-id / count arrays
+- the arrays, vocabulary and counters are written as one file (model.bin)
+  that is swapped in with os.replace and memory-mapped on load, so every
+  process sees a consistent model whichever process wrote it last
+- stories saved after the last compaction go into a small in-memory
+  overlay that is merged into the arrays once it grows large enough
+"""
+import json
+import mmap
+import os
+import random
+import re
+import threading
+import traceback
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+
+from database import Database, open_database, register_write_listener
+
+MODEL_DIR = os.getenv("NGRAM_MODEL_DIR", os.path.join("models", "ngram"))
+MIN_TRAINING_TOKENS = int(os.getenv("NGRAM_MIN_TOKENS", "5000"))
+COMPACT_AFTER_CONTEXTS = 50_000
+MODEL_FILE = "model.bin"
+
+# Array attributes in file order: the 8-byte arrays first keeps every array aligned for cast()
+ARRAYS = (("keys", "Q"), ("offsets", "Q"), ("next_ids", "I"), ("counts", "I"))
+
+BOS = 0
+BACKOFF = 0xFFFFFFFF  # first half of a bigram key
+SENTENCE_END = {".", "!", "?"}
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+(?:['’-][A-Za-z0-9]+)*|[.,!?;:]")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text)
+
+
+def detokenize(tokens: List[str]) -> str:
+    out = []
+    capitalize = True
+    for token in tokens:
+        if token in SENTENCE_END or token in ",;:":
+            if out:
+                out[-1] += token
+            capitalize = token in SENTENCE_END
+            continue
+        out.append(token[:1].upper() + token[1:] if capitalize else token)
+        capitalize = False
+    return " ".join(out)
+
+
+class NgramModel:
+    """Trigram model for one genre with bigram backoff"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vocab: List[str] = ["<s>"]
+        self.ids: Dict[str, int] = {"<s>": BOS}
+        self.keys = array("Q")
+        self.offsets = array("Q", [0])
+        self.next_ids = array("I")
+        self.counts = array("I")
+        self.overlay: Dict[int, Dict[int, int]] = {}
+        self.compacting: Dict[int, Dict[int, int]] = {}
+        self.token_count = 0
+        self.last_story_id = 0
+        self.lock = threading.Lock()
+
+    # Storage
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def load(self) -> bool:
+        """Memory-map model.bin: the arrays, then a JSON header, then the header's offset (8 bytes)"""
+        if not os.path.exists(self._file(MODEL_FILE)):
+            return False
+        with open(self._file(MODEL_FILE), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_at = int.from_bytes(mapped[-8:], "little")
+        header = json.loads(mapped[header_at:-8])
+        self.vocab = header["vocab"]
+        self.ids = {word: i for i, word in enumerate(self.vocab)}
+        self.token_count = header["token_count"]
+        self.last_story_id = header["last_story_id"]
+        view = memoryview(mapped)
+        for name, typecode in ARRAYS:
+            start, end = header["arrays"][name]
+            setattr(self, name, view[start:end].cast(typecode) if end > start else array(typecode))
+        self.offsets = self.offsets or array("Q", [0])
+        return True
+
+    def save(self, token_count: Optional[int] = None, last_story_id: Optional[int] = None):
+        """Write the compiled arrays; counts still in the overlay are not included
+
+        The vocabulary goes in the same file, since ids are assigned in
+        whatever order each process saw words. Processes that have the
+        file mapped keep reading the copy they loaded.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file(f"{MODEL_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+        sections = {}
+        with open(tmp, "wb") as f:
+            for name, _ in ARRAYS:
+                data = getattr(self, name)
+                start = f.tell()
+                f.write(data if isinstance(data, memoryview) else data.tobytes())
+                sections[name] = [start, f.tell()]
+            header_at = f.tell()
+            f.write(json.dumps({
+                "token_count": self.token_count if token_count is None else token_count,
+                "last_story_id": self.last_story_id if last_story_id is None else last_story_id,
+                "vocab": self.vocab,
+                "arrays": sections,
+            }).encode())
+            f.write(header_at.to_bytes(8, "little"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file(MODEL_FILE))
+
+    # Training
+    def _id(self, token: str) -> int:
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = len(self.vocab)
+            self.vocab.append(token)
+            self.ids[token] = token_id
+        return token_id
+
+    def add_text(self, text: str, story_id: int = 0):
+        """Count the trigrams and bigrams of one story into the overlay"""
+        with self.lock:
+            tokens = [self._id(token) for token in tokenize(text.lower())]
+            w1 = w2 = BOS
+            for token in tokens:
+                for key in ((w1 << 32) | w2, (BACKOFF << 32) | w2):
+                    successors = self.overlay.setdefault(key, {})
+                    successors[token] = successors.get(token, 0) + 1
+                w1, w2 = w2, token
+            self.token_count += len(tokens)
+            self.last_story_id = max(self.last_story_id, story_id)
+
+    def compact(self):
+        """Merge the overlay into the sorted arrays and persist them
+
+        The merge runs outside the lock; until it finishes, sampling reads
+        the pending counts from self.compacting.
+        """
+        with self.lock:
+            if not self.overlay or self.compacting:
+                return
+            self.compacting, self.overlay = self.overlay, {}
+            pending = self.compacting
+            token_count, last_story_id = self.token_count, self.last_story_id
+            old_keys, old_offsets, old_next, old_counts = self.keys, self.offsets, self.next_ids, self.counts
+
+        keys, offsets, next_ids, counts = array("Q"), array("Q", [0]), array("I"), array("I")
+        i = 0
+        for key in sorted(set(old_keys).union(pending)):
+            merged: Dict[int, int] = {}
+            while i < len(old_keys) and old_keys[i] < key:
+                i += 1
+            if i < len(old_keys) and old_keys[i] == key:
+                for j in range(old_offsets[i], old_offsets[i + 1]):
+                    merged[old_next[j]] = old_counts[j]
+            for token, count in pending.get(key, {}).items():
+                merged[token] = merged.get(token, 0) + count
+            keys.append(key)
+            for token, count in merged.items():
+                next_ids.append(token)
+                counts.append(count)
+            offsets.append(len(next_ids))
+
+        with self.lock:
+            self.keys, self.offsets, self.next_ids, self.counts = keys, offsets, next_ids, counts
+            self.compacting = {}
+            self.save(token_count, last_story_id)
+
+    # Sampling
+    def successors(self, key: int) -> Dict[int, int]:
+        with self.lock:
+            merged: Dict[int, int] = {}
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                for j in range(self.offsets[i], self.offsets[i + 1]):
+                    merged[self.next_ids[j]] = self.counts[j]
+            for pending in (self.compacting, self.overlay):
+                for token, count in pending.get(key, {}).items():
+                    merged[token] = merged.get(token, 0) + count
+            return merged
+
+    def _next(self, w1: int, w2: int, temperature: float, rng: random.Random) -> Optional[int]:
+        candidates = self.successors((w1 << 32) | w2) or self.successors((BACKOFF << 32) | w2)
+        if not candidates:
+            return None
+        tokens = list(candidates)
+        exponent = 1.0 / temperature
+        cumulative = list(accumulate(candidates[t] ** exponent for t in tokens))
+        return tokens[bisect_left(cumulative, rng.random() * cumulative[-1])]
+
+    def generate(self, prompt: str, target_words: int, temperature: float = 0.7,
+                 rng: Optional[random.Random] = None) -> str:
+        """Sample a story of exactly target_words words, starting from the prompt"""
+        rng = rng or random
+        temperature = max(temperature, 0.1)
+        tokens = tokenize(prompt)[:target_words]
+        words = sum(1 for token in tokens if token[0].isalnum())
+
+        w1 = w2 = BOS
+        for token in tokens:
+            w1, w2 = w2, self.ids.get(token.lower(), BOS)
+
+        while words < target_words:
+            token_id = self._next(w1, w2, temperature, rng)
+            if token_id is None:  # dead end: start a fresh sentence
+                w1 = w2 = BOS
+                if tokens and tokens[-1] not in SENTENCE_END:
+                    tokens.append(".")
+                continue
+            token = self.vocab[token_id]
+            tokens.append(token)
+            if token[0].isalnum():
+                words += 1
+            w1, w2 = w2, token_id
+
+        if tokens[-1] not in SENTENCE_END:
+            tokens.append(".")
+        return detokenize(tokens)
+
+
+class NgramModels:
+    """Per-genre models, loaded or trained in the background and updated as stories are saved"""
+
+    def __init__(self, db_name: str = "stories.db", model_dir: str = MODEL_DIR):
+        self.db_name = db_name
+        self.model_dir = model_dir
+        self._models: Dict[str, NgramModel] = {}
+        self._training = set()
+        self._lock = threading.Lock()
+
+    def _path(self, genre: str) -> str:
+        return os.path.join(self.model_dir, genre.lower().replace("-", "_"))
+
+    def get(self, genre: str) -> Optional[NgramModel]:
+        """The genre's model, or None while a background thread loads and catches it up"""
+        with self._lock:
+            model = self._models.get(genre)
+            if model is None and genre not in self._training:
+                self._training.add(genre)
+                threading.Thread(target=self._load, args=(genre,), name=f"ngram-{genre}", daemon=True).start()
+            return model
+
+    def _load(self, genre: str):
+        model = NgramModel(self._path(genre))
+        try:
+            model.load()
+            self._catch_up(model, genre)
+        except Exception:
+            traceback.print_exc()
+            model = None  # the next get() tries again
+        with self._lock:
+            if model is not None:
+                self._models.setdefault(genre, model)
+            self._training.discard(genre)
+
+    def _catch_up(self, model: NgramModel, genre: str):
+        """Train on stories saved since the model files were written"""
+        db = open_database(self.db_name)
+        for story_id, content in db.iter_story_texts(genre, after_story_id=model.last_story_id):
+            model.add_text(content, story_id)
+        if model.overlay:
+            model.compact()
+
+    def generate(self, prompt: str, genre: str, target_words: int, temperature: float) -> Tuple[bool, str]:
+        model = self.get(genre)
+        if model is None:
+            return False, f"{genre} model is still training"
+        if model.token_count < MIN_TRAINING_TOKENS:
+            return False, f"Not enough {genre} training data"
+        return True, model.generate(prompt, target_words, temperature)
+
+    def on_write(self, db: Database, event: str, user_id: str, old: Optional[Dict], new: Optional[Dict]):
+        """Train incrementally on newly saved stories and chapters for models already in memory"""
+        if event not in ('save', 'chapter') or db.db_name != self.db_name or not new.get('genre'):
+            return
+        model = self._models.get(new['genre'])
+        if model is None:
+            return  # picked up by _catch_up when the model is first used
+        model.add_text(new['content'], new['story_id'])
+        if len(model.overlay) >= COMPACT_AFTER_CONTEXTS:
+            threading.Thread(target=model.compact, daemon=True).start()
+
+    def retrain(self, genre: str):
+        """Rebuild a genre's model from scratch"""
+        model = NgramModel(self._path(genre))
+        self._catch_up(model, genre)
+        model.save()
+        with self._lock:
+            self._models[genre] = model
+
+
+ngram_models = NgramModels()
+register_write_listener(ngram_models.on_write)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Retrain the per-genre n-gram models from the stories table")
+    parser.add_argument("genres", nargs="*", help="genres to retrain (default: all with stories)")
+    args = parser.parse_args()
+
+    genres = args.genres or open_database().get_genres()
+    for genre in genres:
+        start = time.perf_counter()
+        ngram_models.retrain(genre)
+        model = ngram_models.get(genre)
+        print(f"{genre}: {model.token_count} tokens, {len(model.vocab)} words, "
+              f"{len(model.keys)} contexts in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,172 @@
+"""Opt-in sampling profiler for Streamlit reruns
+
+start_rerun_profile() is called near the top of app.py. When profiling is
+on (PROFILE_RERUNS=1 for every session, or the toggle on the admin page
+for one session) a daemon thread samples the script thread's stack every
+PROFILE_INTERVAL_MS until the script's module frame is gone, i.e. the
+rerun finished (normally, by st.rerun()/st.stop(), or with an error). It
+then writes two files to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES:
+
+- <stamp>.collapsed: "frame;frame;frame count" lines for flamegraph.pl / speedscope
+- <stamp>.speedscope.json: speedscope's sampled-profile format
+
+span(name) marks a named region (database calls, generation, page
+sections); open spans appear as extra frames above the code they wrap.
+While nothing is being profiled, span() returns a shared no-op context
+manager and start_rerun_profile() returns immediately.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_RERUNS = os.getenv("PROFILE_RERUNS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+_NULL = nullcontext()
+
+# Open spans per profiled thread id; empty when nothing is being profiled
+_span_stacks: Dict[int, List[str]] = {}
+
+
+class _Span:
+    __slots__ = ("name", "stack")
+
+    def __init__(self, name: str, stack: List[str]):
+        self.name = name
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.append(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.stack.pop()
+        return False
+
+
+def span(name: str):
+    """Name a region for the profiler (no-op unless this thread is being profiled)"""
+    if not _span_stacks:
+        return _NULL
+    stack = _span_stacks.get(threading.get_ident())
+    return _NULL if stack is None else _Span(name, stack)
+
+
+def _frame_name(frame) -> Tuple[str, str, int]:
+    code = frame.f_code
+    return (f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})",
+            code.co_filename, code.co_firstlineno)
+
+
+class RerunProfiler:
+    """Samples one thread until the given frame leaves its stack"""
+
+    def __init__(self, root_frame, label: str, interval: float, directory: str, max_files: int):
+        self.root_frame = root_frame
+        self.label = label
+        self.interval = interval
+        self.directory = directory
+        self.max_files = max_files
+        self.thread_id = threading.get_ident()
+        self.samples: Dict[Tuple, int] = {}
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.path: Optional[str] = None
+        self.spans: List[str] = []
+        _span_stacks[self.thread_id] = self.spans  # replaces a previous rerun's list on this thread
+        self._sampler = threading.Thread(target=self._run, name="rerun-profiler", daemon=True)
+        self._sampler.start()
+
+    def _sample(self) -> bool:
+        """Record one stack; False once the rerun has finished"""
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            if frame is self.root_frame:
+                break
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        else:
+            return False
+        stack.append(_frame_name(self.root_frame))
+        stack.reverse()
+        # Open spans go right under the script frame so they group the flamegraph
+        if self.spans:
+            stack[1:1] = [(f"[{name}]", "", 0) for name in self.spans]
+        key = tuple(stack)
+        self.samples[key] = self.samples.get(key, 0) + 1
+        return True
+
+    def _run(self):
+        try:
+            while self._sample():
+                time.sleep(self.interval)
+        finally:
+            self.duration = time.perf_counter() - self.started
+            if _span_stacks.get(self.thread_id) is self.spans:
+                del _span_stacks[self.thread_id]
+            if self.samples:
+                self.write()
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = os.path.join(self.directory, f"{stamp}-{self.label}")
+
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                f.write(";".join(name for name, _, _ in stack) + f" {count}\n")
+
+        # Sampling is slower than the nominal interval, so spread the measured time over the samples
+        per_sample = self.duration / sum(self.samples.values())
+        frame_index: Dict[Tuple, int] = {}
+        frames, samples, weights = [], [], []
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    name, file, line = frame
+                    frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count * per_sample)
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": {"frames": frames},
+                "profiles": [{
+                    "type": "sampled", "name": f"rerun {self.label} ({self.duration * 1000:.0f} ms)",
+                    "unit": "seconds", "startValue": 0, "endValue": sum(weights),
+                    "samples": samples, "weights": weights,
+                }],
+                "name": self.label,
+            }, f)
+        self.path = base
+        _rotate(self.directory, self.max_files)
+
+
+def _rotate(directory: str, max_files: int):
+    """Delete the oldest profile pairs beyond max_files"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".collapsed"))
+    for name in names[:max(len(names) - max_files, 0)]:
+        base = os.path.join(directory, name[:-len(".collapsed")])
+        for suffix in (".collapsed", ".speedscope.json"):
+            try:
+                os.remove(base + suffix)
+            except OSError:
+                pass
+
+
+def start_rerun_profile(enabled: bool = False, label: str = "rerun") -> Optional[RerunProfiler]:
+    """Profile the calling script run if enabled (or PROFILE_RERUNS is set)"""
+    if not (enabled or PROFILE_RERUNS):
+        return None
+    return RerunProfiler(sys._getframe(1), label, PROFILE_INTERVAL_MS / 1000, PROFILE_DIR, PROFILE_MAX_FILES)
@@ -0,0 +1,144 @@
+"""Compact encoding of story revisions
+
+Each revision of a chapter is stored either as a snapshot (the
+zlib-compressed text) or as a delta against the revision before it. A
+delta is a list of ops over whitespace-preserving word tokens: a positive
+int copies that many tokens from the base, a negative int skips them, a
+string is inserted. The ops are JSON-encoded and compressed, so a few
+changed words cost tens of bytes.
+
+Word diffs are quadratic in the worst case, so a changed stretch longer
+than MAX_DIFF_TOKENS is first diffed sentence by sentence. Only the
+changed runs of sentences that are short enough get a word diff. Longer
+runs, as in a rewrite, are stored as inserted text.
+
+A snapshot starts every run of SNAPSHOT_EVERY revisions (and replaces any
+delta that would not be smaller), so rebuilding any revision applies at
+most SNAPSHOT_EVERY - 1 deltas to one snapshot.
+"""
+import json
+import os
+import re
+import zlib
+from difflib import SequenceMatcher
+from typing import Iterable, List, Tuple, Union
+
+SNAPSHOT_EVERY = int(os.getenv("REVISION_SNAPSHOT_EVERY", "10"))
+MAX_REVISIONS = int(os.getenv("REVISION_MAX_PER_CHAPTER", "50"))     # per chapter, oldest dropped first
+RETENTION_DAYS = int(os.getenv("REVISION_RETENTION_DAYS", "180"))   # for prune_revisions()
+
+MAX_DIFF_TOKENS = 400  # longest stretch of tokens diffed word by word (about 200 words)
+
+_TOKEN_RE = re.compile(r"\S+|\s+")
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\u201d\u2019]*$")
+
+Op = Union[int, str]
+
+
+def tokenize(text: str) -> List[str]:
+    """Words and the whitespace between them; "".join(tokens) == text"""
+    return _TOKEN_RE.findall(text)
+
+
+def sentences(tokens: List[str]) -> List[List[str]]:
+    """Tokens split after each sentence end or line break, whitespace kept with the sentence before it"""
+    chunks, chunk = [], []
+    for i, token in enumerate(tokens):
+        chunk.append(token)
+        if token.isspace() and ("\n" in token or (i and _SENTENCE_END_RE.search(tokens[i - 1]))):
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _word_diff(a: List[str], b: List[str], ops: List[Op]):
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append("".join(b[j1:j2]))
+
+
+def _diff(a: List[str], b: List[str], ops: List[Op]):
+    if max(len(a), len(b)) <= MAX_DIFF_TOKENS:
+        _word_diff(a, b, ops)
+        return
+    sa, sb = sentences(a), sentences(b)
+    matcher = SequenceMatcher(None, ["".join(chunk) for chunk in sa], ["".join(chunk) for chunk in sb],
+                              autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        old = [token for chunk in sa[i1:i2] for token in chunk]
+        if tag == "equal":
+            ops.append(len(old))
+            continue
+        new = [token for chunk in sb[j1:j2] for token in chunk]
+        if old and new and max(len(old), len(new)) <= MAX_DIFF_TOKENS:
+            _word_diff(old, new, ops)
+            continue
+        if old:
+            ops.append(-len(old))
+        if new:
+            ops.append("".join(new))
+
+
+def make_delta(base: str, text: str) -> List[Op]:
+    a, b = tokenize(base), tokenize(text)
+    # Small edits leave long common ends; diff only the middle
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    ops: List[Op] = [prefix] if prefix else []
+    _diff(a[prefix:len(a) - suffix], b[prefix:len(b) - suffix], ops)
+    if suffix:
+        ops.append(suffix)
+    return ops
+
+
+def apply_delta(base: str, ops: Iterable[Op]) -> str:
+    tokens = tokenize(base)
+    out, pos = [], 0
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.append("".join(tokens[pos:pos + op]))
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+
+def encode_snapshot(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"))
+
+
+def encode_delta(base: str, text: str) -> bytes:
+    return zlib.compress(json.dumps(make_delta(base, text), separators=(",", ":")).encode("utf-8"))
+
+
+def encode(base: str, text: str, revision_no: int) -> Tuple[bool, bytes]:
+    """(is_snapshot, data) for a new revision; base is the previous revision's text"""
+    snapshot = encode_snapshot(text)
+    if base is None or (revision_no - 1) % SNAPSHOT_EVERY == 0:
+        return True, snapshot
+    delta = encode_delta(base, text)
+    return (True, snapshot) if len(delta) >= len(snapshot) else (False, delta)
+
+
+def rebuild(chain: Iterable[Tuple[bool, bytes]]) -> str:
+    """Text of the last revision in a chain that starts with a snapshot"""
+    text = None
+    for is_snapshot, data in chain:
+        raw = zlib.decompress(data).decode("utf-8")
+        text = raw if is_snapshot else apply_delta(text, json.loads(raw))
+    return text
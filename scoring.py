@@ -0,0 +1,70 @@
+"""Cheap quality scorer for ranking generated story candidates
+
+Scores are in [0, 1] and combine four signals that catch the usual GPT-2
+failure modes without a second model:
+
+- repetition: share of distinct word trigrams (loops score near 0)
+- prompt echo: share of the instruction prompt's trigrams repeated in the text
+- length fit: words produced relative to the target (overshoot is trimmed later)
+- completeness: whether the text ends on a finished sentence
+"""
+from typing import Dict, List, Optional, Tuple
+
+MIN_SCORE = 0.5  # candidates below this are treated as failed generations
+REPETITION_FLOOR = 0.6  # normal prose has ~95% distinct trigrams; below this the whole score is scaled down
+
+WEIGHTS = {"repetition": 0.4, "length": 0.25, "completeness": 0.2, "echo": 0.15}
+SENTENCE_END = (".", "!", "?", '."', '!"', '?"')
+
+
+def _trigrams(words: List[str]) -> set:
+    return set(zip(words, words[1:], words[2:]))
+
+
+def score_parts(text: str, target_words: int, instruction: str = "", topic: str = "") -> Dict[str, float]:
+    """Per-signal scores for one candidate (1.0 is best for each)
+
+    instruction is the prompt sent to the model; trigrams of the user's
+    topic are not counted as echo, since a story may mention its subject.
+    """
+    words = text.lower().split()
+    if len(words) < 3:
+        return {"repetition": 0.0, "length": 0.0, "completeness": 0.0, "echo": 0.0}
+
+    # Only the part that survives trimming matters
+    kept = words[:target_words]
+    trigrams = _trigrams(kept)
+    repetition = len(trigrams) / (len(kept) - 2) if len(kept) > 2 else 0.0
+
+    prompt_trigrams = _trigrams(instruction.lower().split()) - _trigrams(topic.lower().split())
+    echo = len(prompt_trigrams & trigrams) / len(prompt_trigrams) if prompt_trigrams else 0.0
+
+    length = min(len(words), target_words) / target_words
+
+    # Finished text scores 1; otherwise half credit for the share before the last sentence end
+    completeness = 0.0
+    for i in range(len(kept) - 1, -1, -1):
+        if kept[i].endswith(SENTENCE_END):
+            completeness = 1.0 if i == len(kept) - 1 else 0.5 * (i + 1) / len(kept)
+            break
+
+    return {"repetition": repetition, "length": length, "completeness": completeness, "echo": 1.0 - echo}
+
+
+def score_story(text: str, target_words: int, instruction: str = "", topic: str = "") -> float:
+    parts = score_parts(text, target_words, instruction, topic)
+    score = sum(WEIGHTS[name] * value for name, value in parts.items())
+    return score * min(1.0, parts["repetition"] / REPETITION_FLOOR)
+
+
+def pick_best(candidates: List[str], target_words: int, instruction: str = "",
+              topic: str = "") -> Tuple[Optional[int], float]:
+    """Index and score of the best candidate; the index is None if none reaches MIN_SCORE"""
+    best, best_score = None, 0.0
+    for index, text in enumerate(candidates):
+        score = score_story(text, target_words, instruction, topic)
+        if score > best_score:
+            best, best_score = index, score
+    if best_score < MIN_SCORE:
+        return None, best_score
+    return best, best_score
@@ -0,0 +1,144 @@
+"""In-memory typeahead index over story titles and tags"""
+import json
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from database import Database, register_write_listener
+
+MIN_QUERY_LENGTH = 2
+MAX_INDEXED_USERS = 256
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so equivalent queries share cache entries"""
+    return " ".join(query.lower().split())
+
+
+def _story_terms(story: Dict) -> List[Tuple[str, str]]:
+    """(key, suggestion) pairs for a story: the title, each title word, and each tag"""
+    terms = []
+    title = (story.get('title') or "").strip()
+    if title:
+        terms.append((normalize_query(title), title))
+        for word in _WORD_RE.findall(title.lower())[1:]:
+            terms.append((word, title))
+
+    tags = story.get('tags')
+    if isinstance(tags, str):
+        try:
+            tags = json.loads(tags)
+        except ValueError:
+            tags = []
+    for tag in tags or []:
+        tag = tag.strip()
+        if tag:
+            terms.append((normalize_query(tag), tag))
+    return terms
+
+
+class PrefixIndex:
+    """Sorted array of (key, suggestion) pairs searched with bisect.
+
+    Pairs are reference-counted so that several stories sharing a title or
+    tag keep it in the index until the last one is removed.
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[str, str]] = []
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, terms: List[Tuple[str, str]]):
+        """Replace the contents in one sort instead of one insort per term"""
+        self._counts = {}
+        for term in terms:
+            self._counts[term] = self._counts.get(term, 0) + 1
+        self._entries = sorted(self._counts)
+
+    def add(self, terms: List[Tuple[str, str]]):
+        for term in terms:
+            count = self._counts.get(term, 0)
+            if count == 0:
+                insort(self._entries, term)
+            self._counts[term] = count + 1
+
+    def remove(self, terms: List[Tuple[str, str]]):
+        for term in terms:
+            count = self._counts.get(term, 0)
+            if count <= 1:
+                self._counts.pop(term, None)
+                i = bisect_left(self._entries, term)
+                if i < len(self._entries) and self._entries[i] == term:
+                    del self._entries[i]
+            else:
+                self._counts[term] = count - 1
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[str]:
+        """Distinct suggestions whose key starts with prefix"""
+        prefix = normalize_query(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(results) < limit:
+            key, suggestion = self._entries[i]
+            if not key.startswith(prefix):
+                break
+            if suggestion not in seen:
+                seen.add(suggestion)
+                results.append(suggestion)
+            i += 1
+        return results
+
+
+class SuggestionIndexes:
+    """Per-user prefix indexes, built lazily and kept current by write events"""
+
+    def __init__(self, max_users: int = MAX_INDEXED_USERS):
+        self.max_users = max_users
+        self._indexes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Database, user_id: str) -> PrefixIndex:
+        key = (db.db_name, user_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+            index = PrefixIndex()
+            index.load([term for story in db.get_suggestion_terms(user_id) for term in _story_terms(story)])
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            return index
+
+    def suggest(self, db: Database, user_id: str, prefix: str, limit: int = 8) -> List[str]:
+        index = self.get(db, user_id)
+        with self._lock:
+            return index.suggest(prefix, limit)
+
+    def on_write(self, db: Database, event: str, user_id: str, old: Optional[Dict], new: Optional[Dict]):
+        """Apply a story write to an already-built index (unbuilt ones load fresh later)"""
+        with self._lock:
+            index = self._indexes.get((db.db_name, user_id))
+            if index is None:
+                return
+            if old and event in ('update', 'delete'):
+                index.remove(_story_terms(old))
+            if new and event in ('save', 'update'):
+                index.add(_story_terms(new))
+
+
+suggestion_indexes = SuggestionIndexes()
+register_write_listener(suggestion_indexes.on_write)
@@ -0,0 +1,628 @@
+"""Per-user sharding of the story store
+
+With STORY_SHARDS=N (N > 1), open_database() returns a ShardedDatabase
+with the Database API. Each user, with their stories, lives in one of N
+SQLite files (stories.shard0.db, ...), so each file has its own writer
+lock and connection pool. A small catalog (stories.catalog.db) records
+which shard each user is on. New users are placed by a hash of user_id,
+so growing STORY_SHARDS only spreads new users until existing ones are
+rebalanced.
+
+Story ids are reserved in blocks from the catalog, so they are unique
+across shards and a user can move without renumbering their stories.
+
+Moving a user is online:
+1. copy their rows to the target in small batches while the app keeps
+   using the source shard
+2. freeze their writes (writers wait up to MOVE_WAIT), copy what changed
+3. point the catalog at the target, unfreeze, delete the source rows
+Reads are served throughout. Shards check the route again under their
+write lock, which the final copy also takes, so a write either lands
+before that copy or is retried on the target. The source rows are only
+deleted if they are still exactly what was copied.
+
+Usage:
+    python sharding.py status
+    python sharding.py migrate              # copy an unsharded stories.db into the shards
+    python sharding.py move <user_id> <shard>
+    python sharding.py rebalance [--max-moves 10] [--dry-run]
+"""
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from cache import LibraryCache, library_cache
+from database import ConnectionPool, Database, _write_listeners
+
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", "4"))
+ID_BLOCK = 1000        # story ids reserved from the catalog at a time
+COPY_BATCH = 500       # stories per transaction while copying a user
+MOVE_WAIT = 10.0       # seconds a write waits for a move to finish
+
+# A user's story ids on the source shard, for copying per-story tables along with the stories
+USER_STORIES = 'SELECT story_id FROM main.stories WHERE user_id = ?'
+
+# Tables keyed by story_id that move with their stories, and their primary keys
+STORY_TABLES = {
+    "story_chapters": "story_id, chapter_no",
+    "story_revisions": "story_id, chapter_no, revision_no",
+    "story_signatures": "story_id",
+    "story_lsh": "band_key, story_id",
+}
+
+
+def user_digest(conn: sqlite3.Connection, user_id: str) -> str:
+    """Hash of a user's rows in the main database, to tell whether anything changed
+
+    read_at is left out: opening a story records it without a write lock or a route check.
+    """
+    columns = ', '.join(row[1] for row in conn.execute('PRAGMA main.table_info(stories)') if row[1] != 'read_at')
+    queries = ['SELECT * FROM main.users WHERE user_id = ?',
+               f'SELECT {columns} FROM main.stories WHERE user_id = ? ORDER BY story_id',
+               'SELECT * FROM main.daily_user_activity WHERE user_id = ? ORDER BY day, genre']
+    queries += [f'SELECT * FROM main.{table} WHERE story_id IN ({USER_STORIES}) ORDER BY {key}'
+                for table, key in STORY_TABLES.items()]
+    digest = hashlib.sha256()
+    for query in queries:
+        for row in conn.execute(query, (user_id,)):
+            digest.update(repr(tuple(row)).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class UserMoved(Exception):
+    """A write reached a shard the user has moved off (or is being moved off); route it again"""
+
+
+def shard_path(db_name: str, index: int) -> str:
+    root, ext = os.path.splitext(db_name)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+def catalog_path(db_name: str) -> str:
+    root, ext = os.path.splitext(db_name)
+    return f"{root}.catalog{ext or '.db'}"
+
+
+def home_shard(user_id: str, shards: int) -> int:
+    """Where a new user goes (stable across processes, unlike hash())"""
+    return int(hashlib.md5(user_id.encode()).hexdigest()[:8], 16) % shards
+
+
+class Catalog:
+    """user_id -> shard routing, move state and the story id counter"""
+
+    def __init__(self, path: str, shards: int):
+        self.path = path
+        self.pool = ConnectionPool(path, 8)
+        conn = self.pool.acquire()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS user_shards (
+                user_id TEXT PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                moving_to INTEGER,
+                frozen INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS shard_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+        conn.execute("INSERT OR IGNORE INTO shard_meta VALUES ('shards', ?), ('next_story_id', 1)", (shards,))
+        stored = conn.execute("SELECT value FROM shard_meta WHERE key = 'shards'").fetchone()[0]
+        if shards < stored:
+            conn.close()
+            raise ValueError(f"{path} has {stored} shards; move users off the extra shards before shrinking")
+        conn.execute("UPDATE shard_meta SET value = ? WHERE key = 'shards'", (shards,))
+        conn.commit()
+        conn.close()
+        self.shards = shards
+
+    def route(self, user_id: str, assign: bool = False) -> Tuple[int, bool]:
+        """(shard, frozen) for a user; assign=True records a new user's home shard"""
+        conn = self.pool.acquire()
+        row = conn.execute('SELECT shard, frozen FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            shard = home_shard(user_id, self.shards)
+            if assign:
+                conn.execute('INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)', (user_id, shard))
+                conn.commit()
+            conn.close()
+            return shard, False
+        conn.close()
+        return row['shard'], bool(row['frozen'])
+
+    def reserve_ids(self, count: int) -> int:
+        """First id of a block of count story ids no other process will use"""
+        conn = self.pool.acquire()
+        conn.execute('BEGIN IMMEDIATE')
+        start = conn.execute("SELECT value FROM shard_meta WHERE key = 'next_story_id'").fetchone()[0]
+        conn.execute("UPDATE shard_meta SET value = ? WHERE key = 'next_story_id'", (start + count,))
+        conn.commit()
+        conn.close()
+        return start
+
+    def set_next_id(self, value: int):
+        conn = self.pool.acquire()
+        conn.execute("UPDATE shard_meta SET value = MAX(value, ?) WHERE key = 'next_story_id'", (value,))
+        conn.commit()
+        conn.close()
+
+    def set_move(self, user_id: str, shard: int, moving_to: Optional[int] = None, frozen: bool = False):
+        conn = self.pool.acquire()
+        conn.execute('''
+            INSERT INTO user_shards (user_id, shard, moving_to, frozen) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                shard = excluded.shard, moving_to = excluded.moving_to, frozen = excluded.frozen
+        ''', (user_id, shard, moving_to, int(frozen)))
+        conn.commit()
+        conn.close()
+
+    def moving_users(self) -> set:
+        conn = self.pool.acquire()
+        users = {row[0] for row in conn.execute('SELECT user_id FROM user_shards WHERE moving_to IS NOT NULL')}
+        conn.close()
+        return users
+
+    def user_count(self) -> int:
+        conn = self.pool.acquire()
+        count = conn.execute('SELECT COUNT(*) FROM user_shards').fetchone()[0]
+        conn.close()
+        return count
+
+
+class Shard(Database):
+    """One shard file; ids come from the catalog and write events name the sharded store"""
+
+    def __init__(self, db_name: str, owner: "ShardedDatabase", pool_size: int):
+        self.owner = owner
+        super().__init__(db_name, cache=owner.cache, pool_size=pool_size)
+
+    def next_story_id(self) -> Optional[int]:
+        return self.owner.next_story_id()
+
+    def _begin_write(self, conn: sqlite3.Connection, user_id: str):
+        # Checked under this file's write lock: move_user's final copy takes the same lock after freezing
+        # the user, so a write either commits before that copy or sees the freeze here
+        super()._begin_write(conn, user_id)
+        shard, frozen = self.owner.catalog.route(user_id)
+        if frozen or self.owner.shards[shard] is not self:
+            raise UserMoved(user_id)  # the caller rolls back and returns the connection
+
+    def notify_write(self, event: str, user_id: str, old: Optional[Dict] = None, new: Optional[Dict] = None):
+        for listener in _write_listeners:
+            listener(self.owner, event, user_id, old, new)
+
+    def _archive_excluded_users(self) -> set:
+        # The archive file is per shard, so a user being moved keeps their text in the rows being copied
+        return self.owner.catalog.moving_users()
+
+
+class ShardedDatabase:
+    """Database API over per-user shard files"""
+
+    def __init__(self, db_name: str = "stories.db", shards: int = 2, cache: Optional[LibraryCache] = library_cache,
+                 pool_size: int = SHARD_POOL_SIZE):
+        self.db_name = db_name  # logical name, seen by write listeners
+        self.cache = cache
+        self.catalog = Catalog(catalog_path(db_name), shards)
+        self.shards = [Shard(shard_path(db_name, i), self, pool_size) for i in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard")
+        self._ids_lock = threading.Lock()
+        self._next_id = self._end_id = 0
+
+    def next_story_id(self) -> int:
+        with self._ids_lock:
+            if self._next_id >= self._end_id:
+                self._next_id = self.catalog.reserve_ids(ID_BLOCK)
+                self._end_id = self._next_id + ID_BLOCK
+            self._next_id += 1
+            return self._next_id - 1
+
+    def shard_for(self, user_id: str) -> Shard:
+        return self.shards[self.catalog.route(user_id)[0]]
+
+    def _writable(self, user_id: str) -> Shard:
+        """The user's shard once no move has their writes frozen"""
+        deadline = time.monotonic() + MOVE_WAIT
+        while True:
+            shard, frozen = self.catalog.route(user_id, assign=True)
+            if not frozen:
+                return self.shards[shard]
+            if time.monotonic() > deadline:
+                raise sqlite3.OperationalError(f"user {user_id} is being moved between shards")
+            time.sleep(0.02)
+
+    def _write(self, user_id: str, method: str, *args, **kwargs):
+        """Call a Database write method on the user's shard, again on the new one if they moved meanwhile"""
+        while True:
+            try:
+                return getattr(self._writable(user_id), method)(*args, **kwargs)
+            except UserMoved:
+                time.sleep(0.02)
+
+    def fan_out(self, method: str, *args, **kwargs) -> List:
+        """Call a Database method on every shard in parallel (sqlite3 releases the GIL while querying)"""
+        return list(self._executor.map(lambda shard: getattr(shard, method)(*args, **kwargs), self.shards))
+
+    def invalidate_user(self, user_id: str):
+        for shard in self.shards:
+            shard.invalidate_user(user_id)
+
+    # Per-user operations go to the user's shard
+    def create_or_update_user(self, user_id: str, email: str, display_name: str | None = None,
+                              photo_url: str | None = None):
+        self._write(user_id, 'create_or_update_user', user_id, email, display_name, photo_url)
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        return self.shard_for(user_id).get_user(user_id)
+
+    def save_story(self, user_id: str, *args, **kwargs) -> int:
+        return self._write(user_id, 'save_story', user_id, *args, **kwargs)
+
+    def save_stories(self, user_id: str, stories: List[Dict]) -> List[int]:
+        return self._write(user_id, 'save_stories', user_id, stories)
+
+    def get_user_stories(self, user_id: str, *args, **kwargs) -> List[Dict]:
+        return self.shard_for(user_id).get_user_stories(user_id, *args, **kwargs)
+
+    def count_stories(self, user_id: str, *args, **kwargs) -> int:
+        return self.shard_for(user_id).count_stories(user_id, *args, **kwargs)
+
+    def search_stories(self, user_id: str, *args, **kwargs) -> List[Dict]:
+        return self.shard_for(user_id).search_stories(user_id, *args, **kwargs)
+
+    def get_suggestion_terms(self, user_id: str) -> List[Dict]:
+        return self.shard_for(user_id).get_suggestion_terms(user_id)
+
+    def get_stats(self, user_id: str) -> Dict:
+        return self.shard_for(user_id).get_stats(user_id)
+
+    def get_activity(self, user_id: str, *args, **kwargs) -> List[Dict]:
+        return self.shard_for(user_id).get_activity(user_id, *args, **kwargs)
+
+    def get_story(self, story_id: int, user_id: str, touch: bool = True) -> Optional[Dict]:
+        return self.shard_for(user_id).get_story(story_id, user_id, touch)
+
+    def get_story_summaries(self, story_ids: List[int], user_id: str) -> Dict[int, Dict]:
+        return self.shard_for(user_id).get_story_summaries(story_ids, user_id)
+
+    def update_story(self, story_id: int, user_id: str, *args, **kwargs) -> bool:
+        return self._write(user_id, 'update_story', story_id, user_id, *args, **kwargs)
+
+    def delete_story(self, story_id: int, user_id: str):
+        self._write(user_id, 'delete_story', story_id, user_id)
+
+    def toggle_favorite(self, story_id: int, user_id: str):
+        self._write(user_id, 'toggle_favorite', story_id, user_id)
+
+    def add_chapter(self, story_id: int, user_id: str, *args, **kwargs) -> int:
+        return self._write(user_id, 'add_chapter', story_id, user_id, *args, **kwargs)
+
+    def update_chapter(self, story_id: int, user_id: str, *args, **kwargs) -> bool:
+        return self._write(user_id, 'update_chapter', story_id, user_id, *args, **kwargs)
+
+    def get_chapters(self, story_id: int, user_id: str) -> List[Dict]:
+        return self.shard_for(user_id).get_chapters(story_id, user_id)
+
+    def get_story_context(self, story_id: int, user_id: str, *args, **kwargs) -> str:
+        return self.shard_for(user_id).get_story_context(story_id, user_id, *args, **kwargs)
+
+    def get_revisions(self, story_id: int, user_id: str, *args, **kwargs) -> List[Dict]:
+        return self.shard_for(user_id).get_revisions(story_id, user_id, *args, **kwargs)
+
+    def get_revision(self, story_id: int, user_id: str, *args, **kwargs) -> Optional[str]:
+        return self.shard_for(user_id).get_revision(story_id, user_id, *args, **kwargs)
+
+    def restore_revision(self, story_id: int, user_id: str, *args, **kwargs) -> bool:
+        return self._write(user_id, 'restore_revision', story_id, user_id, *args, **kwargs)
+
+    def find_duplicates(self, story_id: int, user_id: str) -> List[Dict]:
+        return self.shard_for(user_id).find_duplicates(story_id, user_id)
+
+    def similar_stories(self, story_id: int, user_id: str, k: int = 5) -> List[Dict]:
+        from similarity_index import similarity_indexes
+        return similarity_indexes.similar_stories(self, story_id, user_id, k)
+
+    # Cross-shard queries
+    def iter_story_texts(self, genre: Optional[str] = None, after_story_id: int = 0, batch_size: int = 500,
+                         with_user: bool = False):
+        """All shards merged in story_id order; a story caught mid-move is yielded once"""
+        last = None
+        merged = heapq.merge(*(shard.iter_story_texts(genre, after_story_id, batch_size, with_user)
+                               for shard in self.shards))
+        for item in merged:
+            if item[0] != last:
+                yield item
+            last = item[0]
+
+    def iter_user_stories(self, user_id: str, *args, **kwargs):
+        return self.shard_for(user_id).iter_user_stories(user_id, *args, **kwargs)
+
+    def prune_revisions(self, *args, **kwargs) -> int:
+        return sum(self.fan_out('prune_revisions', *args, **kwargs))
+
+    def rebuild_activity(self, user_id: Optional[str] = None) -> Tuple[int, int]:
+        if user_id is not None:
+            return self.shard_for(user_id).rebuild_activity(user_id)
+        counts = self.fan_out('rebuild_activity')
+        return sum(users for users, _ in counts), sum(rows for _, rows in counts)
+
+    def index_duplicates(self, *args, **kwargs) -> Tuple[int, int]:
+        counts = self.fan_out('index_duplicates', *args, **kwargs)
+        return sum(indexed for indexed, _ in counts), sum(linked for _, linked in counts)
+
+    def get_duplicate_ids(self) -> List[Tuple[int, str]]:
+        return sorted(row for rows in self.fan_out('get_duplicate_ids') for row in rows)
+
+    def archive_stories(self, *args, **kwargs) -> Tuple[int, int]:
+        counts = self.fan_out('archive_stories', *args, **kwargs)
+        return sum(stories for stories, _ in counts), sum(size for _, size in counts)
+
+    def restore_archived(self, user_id: Optional[str] = None, batch_size: int = 500) -> int:
+        if user_id is not None:
+            return self.shard_for(user_id).restore_archived(user_id, batch_size)
+        return sum(self.fan_out('restore_archived', None, batch_size))
+
+    def compact_archive(self) -> int:
+        return sum(self.fan_out('compact_archive'))
+
+    def archive_status(self) -> Dict:
+        totals: Dict = {}
+        for status in self.fan_out('archive_status'):
+            for key, value in status.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def vacuum(self):
+        self.fan_out('vacuum')
+
+    def get_genres(self) -> List[str]:
+        return sorted({genre for genres in self.fan_out('get_genres') for genre in genres})
+
+    def get_global_stats(self) -> Dict:
+        totals: Dict = {'total_users': 0, 'total_stories': 0, 'total_words': 0, 'favorite_count': 0, 'genres': {}}
+        for stats in self.fan_out('get_global_stats'):
+            for key in ('total_users', 'total_stories', 'total_words', 'favorite_count'):
+                totals[key] += stats[key]
+            for genre, count in stats['genres'].items():
+                totals['genres'][genre] = totals['genres'].get(genre, 0) + count
+        return totals
+
+    def shard_stats(self) -> List[Dict]:
+        """Users, stories and file size per shard"""
+        stats = self.fan_out('get_global_stats')
+        for index, shard in enumerate(self.shards):
+            stats[index] = {'shard': index, 'users': stats[index]['total_users'],
+                            'stories': stats[index]['total_stories'], 'words': stats[index]['total_words'],
+                            'mb': os.path.getsize(shard.db_name) / 1e6}
+        return stats
+
+    # Rebalancing
+    def move_user(self, user_id: str, target: int) -> int:
+        """Move a user and their stories to another shard while the app is running; returns stories moved"""
+        source_index, frozen = self.catalog.route(user_id)
+        if frozen:
+            raise ValueError(f"user {user_id} is already being moved")
+        if not 0 <= target < len(self.shards):
+            raise ValueError(f"no shard {target}")
+        if target == source_index:
+            return 0
+        source, dest = self.shards[source_index], self.shards[target]
+
+        conn = sqlite3.connect(source.db_name, timeout=30, isolation_level=None)
+        conn.execute('ATTACH DATABASE ? AS dest', (dest.db_name,))
+        self.catalog.set_move(user_id, source_index, moving_to=target)
+        try:
+            # Archived text lives in the source shard's archive file; copy it as row content instead
+            source.restore_archived(user_id)
+
+            # 1. Bulk copy while the user keeps writing to the source
+            last = -1
+            while True:
+                ids = [row[0] for row in conn.execute('''
+                    SELECT story_id FROM main.stories WHERE user_id = ? AND story_id > ?
+                    ORDER BY story_id LIMIT ?
+                ''', (user_id, last, COPY_BATCH))]
+                if not ids:
+                    break
+                conn.execute('BEGIN')
+                conn.execute('''
+                    INSERT OR REPLACE INTO dest.stories
+                    SELECT * FROM main.stories WHERE user_id = ? AND story_id BETWEEN ? AND ?
+                ''', (user_id, ids[0], ids[-1]))
+                for table in STORY_TABLES:
+                    conn.execute(f'''
+                        INSERT OR REPLACE INTO dest.{table}
+                        SELECT * FROM main.{table} WHERE story_id IN ({USER_STORIES}) AND story_id BETWEEN ? AND ?
+                    ''', (user_id, ids[0], ids[-1]))
+                conn.execute('COMMIT')
+                last = ids[-1]
+
+            # 2. Freeze writes and copy whatever changed in the meantime
+            self.catalog.set_move(user_id, source_index, moving_to=target, frozen=True)
+            conn.execute('BEGIN IMMEDIATE')  # waits for writes already past the route check
+            source._restore_archived(conn, user_id)  # anything an archive job started before the move took
+            conn.execute('INSERT OR REPLACE INTO dest.users SELECT * FROM main.users WHERE user_id = ?', (user_id,))
+            conn.execute('''
+                INSERT OR REPLACE INTO dest.stories
+                SELECT * FROM main.stories WHERE user_id = ?
+                EXCEPT SELECT * FROM dest.stories WHERE user_id = ?
+            ''', (user_id, user_id))
+            conn.execute('''
+                DELETE FROM dest.stories WHERE user_id = ?
+                AND story_id NOT IN (SELECT story_id FROM main.stories WHERE user_id = ?)
+            ''', (user_id, user_id))
+            for table, key in STORY_TABLES.items():
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO dest.{table}
+                    SELECT * FROM main.{table} WHERE story_id IN ({USER_STORIES})
+                    EXCEPT SELECT * FROM dest.{table}
+                ''', (user_id,))
+                conn.execute(f'''
+                    DELETE FROM dest.{table} WHERE story_id IN (SELECT story_id FROM dest.stories WHERE user_id = ?)
+                    AND ({key}) NOT IN (SELECT {key} FROM main.{table} WHERE story_id IN ({USER_STORIES}))
+                ''', (user_id, user_id))
+            # The rollups are final now that writes are frozen
+            conn.execute('DELETE FROM dest.daily_user_activity WHERE user_id = ?', (user_id,))
+            conn.execute('INSERT INTO dest.daily_user_activity SELECT * FROM main.daily_user_activity WHERE user_id = ?',
+                         (user_id,))
+            moved = conn.execute('SELECT COUNT(*) FROM dest.stories WHERE user_id = ?', (user_id,)).fetchone()[0]
+            copied = user_digest(conn, user_id)
+            conn.execute('COMMIT')
+
+            # 3. Switch reads and writes to the target; still "moving" so the source's archive job
+            # leaves the rows about to be deleted alone
+            self.catalog.set_move(user_id, target, moving_to=target)
+        except Exception:
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for table in STORY_TABLES:
+                    conn.execute(f'DELETE FROM dest.{table} WHERE story_id IN '
+                                 f'({USER_STORIES.replace("main.", "dest.")})', (user_id,))
+                conn.execute('DELETE FROM dest.stories WHERE user_id = ?', (user_id,))
+                conn.execute('DELETE FROM dest.daily_user_activity WHERE user_id = ?', (user_id,))
+                conn.execute('DELETE FROM dest.users WHERE user_id = ?', (user_id,))
+            finally:
+                # Unfreeze even if the cleanup failed; rows left on the target are never routed to
+                self.catalog.set_move(user_id, source_index)
+                conn.close()
+            raise
+
+        conn.execute('BEGIN IMMEDIATE')
+        if user_digest(conn, user_id) != copied:
+            conn.execute('ROLLBACK')
+            conn.close()
+            self.catalog.set_move(user_id, target)
+            raise RuntimeError(f"user {user_id} changed on shard {source_index} after the final copy; "
+                               f"left their rows there for inspection")
+        for table in STORY_TABLES:
+            conn.execute(f'DELETE FROM main.{table} WHERE story_id IN ({USER_STORIES})', (user_id,))
+        conn.execute('DELETE FROM main.stories WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM main.daily_user_activity WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM main.users WHERE user_id = ?', (user_id,))
+        conn.execute('COMMIT')
+        conn.close()
+        self.catalog.set_move(user_id, target)
+        self.invalidate_user(user_id)
+        return moved
+
+    def plan_rebalance(self, max_moves: int = 10) -> List[Tuple[str, int, int, int]]:
+        """Greedy (user_id, from, to, stories) moves from the fullest shard to the emptiest"""
+        per_user = []
+        for shard in self.shards:
+            conn = shard.get_connection()
+            per_user.append({row[0]: row[1] for row in conn.execute(
+                'SELECT user_id, COUNT(*) FROM stories GROUP BY user_id')})
+            conn.close()
+        sizes = [sum(users.values()) for users in per_user]
+
+        plan = []
+        while len(plan) < max_moves:
+            big = max(range(len(sizes)), key=sizes.__getitem__)
+            small = min(range(len(sizes)), key=sizes.__getitem__)
+            gap = sizes[big] - sizes[small]
+            # A move helps if the user has fewer stories than the gap; best is half of it
+            candidates = [(abs(count - gap / 2), user_id) for user_id, count in per_user[big].items() if count < gap]
+            if not candidates:
+                break
+            _, user_id = min(candidates)
+            count = per_user[big].pop(user_id)
+            per_user[small][user_id] = count
+            sizes[big] -= count
+            sizes[small] += count
+            plan.append((user_id, big, small, count))
+        return plan
+
+    def migrate_from(self, source_db: str) -> int:
+        """Copy users and stories from an unsharded database, keeping story ids
+
+        Archived text is first moved back into the source database, since
+        the shards have archive files of their own.
+        """
+        if self.catalog.user_count():
+            raise ValueError("the shards already have users; migrate into an empty catalog")
+        source = Database(source_db, cache=None)
+        source.init_db()  # bring older files up to the current schema
+        source.restore_archived()
+        conn = sqlite3.connect(source_db)
+        users = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+        users += [row[0] for row in conn.execute(
+            'SELECT DISTINCT user_id FROM stories WHERE user_id NOT IN (SELECT user_id FROM users)')]
+        for index, shard in enumerate(self.shards):
+            conn.execute(f'ATTACH DATABASE ? AS shard{index}', (shard.db_name,))
+        for user_id in users:
+            shard, _ = self.catalog.route(user_id, assign=True)
+            with conn:
+                conn.execute(f'INSERT OR REPLACE INTO shard{shard}.users SELECT * FROM users WHERE user_id = ?',
+                             (user_id,))
+                conn.execute(f'INSERT OR REPLACE INTO shard{shard}.stories SELECT * FROM stories WHERE user_id = ?',
+                             (user_id,))
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO shard{shard}.daily_user_activity
+                    SELECT * FROM daily_user_activity WHERE user_id = ?
+                ''', (user_id,))
+                for table in STORY_TABLES:
+                    conn.execute(f'''
+                        INSERT OR REPLACE INTO shard{shard}.{table} SELECT * FROM {table}
+                        WHERE story_id IN (SELECT story_id FROM stories WHERE user_id = ?)
+                    ''', (user_id,))
+        max_id = conn.execute('SELECT COALESCE(MAX(story_id), 0) FROM stories').fetchone()[0]
+        conn.close()
+        self.catalog.set_next_id(max_id + 1)
+        return len(users)
+
+
+# One instance per store and process, so id blocks and pools are shared across reruns
+_databases: Dict[Tuple[str, int], ShardedDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def sharded_database(db_name: str = "stories.db", shards: int = 2, pool_size: int = 0) -> ShardedDatabase:
+    with _databases_lock:
+        key = (db_name, shards)
+        if key not in _databases:
+            _databases[key] = ShardedDatabase(db_name, shards, pool_size=pool_size or SHARD_POOL_SIZE)
+        return _databases[key]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="stories.db", help="logical database name (shard files sit next to it)")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("STORY_SHARDS", "2")))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="users and stories per shard")
+    commands.add_parser("migrate", help="copy the unsharded --db file into the shards")
+    move = commands.add_parser("move", help="move one user to another shard")
+    move.add_argument("user_id")
+    move.add_argument("shard", type=int)
+    rebalance = commands.add_parser("rebalance", help="move users from the fullest to the emptiest shard")
+    rebalance.add_argument("--max-moves", type=int, default=10)
+    rebalance.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    db = ShardedDatabase(args.db, args.shards, cache=None)
+    if args.command == "status":
+        for shard in db.shard_stats():
+            print(f"shard {shard['shard']}: {shard['users']:>7} users {shard['stories']:>9} stories "
+                  f"{shard['mb']:>9.1f} MB")
+    elif args.command == "migrate":
+        print(f"migrated {db.migrate_from(args.db)} users from {args.db}")
+    elif args.command == "move":
+        start = time.perf_counter()
+        moved = db.move_user(args.user_id, args.shard)
+        print(f"moved {moved} stories to shard {args.shard} in {time.perf_counter() - start:.2f}s")
+    else:
+        for user_id, source, target, count in db.plan_rebalance(args.max_moves):
+            print(f"{user_id}: shard {source} -> {target} ({count} stories)")
+            if not args.dry_run:
+                db.move_user(user_id, target)
@@ -0,0 +1,402 @@
+"""Local "more like this" vector index over story texts
+
+Each story becomes a DIMENSIONS-long float32 vector of sublinear TF-IDF
+word weights, folded in by feature hashing: every word adds its weight to
+SLOTS_PER_WORD hashed slots with hashed signs. Document frequencies are
+kept in a hashed table too, so no vocabulary is stored. Vectors are
+L2-normalized, so a dot product is the cosine similarity.
+
+Each store (database file) gets a directory of NumPy files:
+
+- vectors.npy, N x DIMENSIONS, memory-mapped, rows sorted by story_id
+- ids.npy and users.npy, the story id and a 64-bit user key per row
+- df.npy and meta.json, document frequencies and the last indexed story
+
+Saves, edits and deletes go into an in-memory overlay (plus a set of file
+rows it supersedes), which is merged into the files once it grows large
+enough. Queries only score the asking user's rows, in chunks of
+CHUNK_ROWS, with one matrix product for a whole batch of query vectors.
+
+Several processes can share the files. Before each query an index picks
+up stories saved after the last one it has seen, and it loads the files
+again if meta.json changed. Compaction holds compact.lock and merges
+into whatever another process wrote last.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database import Database, register_write_listener
+
+INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", os.path.join("models", "similarity"))
+DIMENSIONS = int(os.getenv("SIMILARITY_DIMENSIONS", "128"))  # a power of two, at most 1024
+SLOTS_PER_WORD = 4
+DF_BUCKETS = 1 << 20
+COMPACT_AFTER_ROWS = 10_000
+CHUNK_ROWS = 1 << 16
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+@lru_cache(maxsize=200_000)
+def _features(word: str) -> Tuple[int, Tuple[int, ...], Tuple[float, ...]]:
+    """(df bucket, vector slots, signs) for a word, all cut from one 64-bit hash"""
+    h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+    bucket, h = h % DF_BUCKETS, h // DF_BUCKETS
+    slots, signs = [], []
+    for _ in range(SLOTS_PER_WORD):
+        slots.append(h % DIMENSIONS)
+        h //= DIMENSIONS
+        signs.append(1.0 if h & 1 else -1.0)
+        h >>= 1
+    return bucket, tuple(slots), tuple(signs)
+
+
+def user_key(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _word_counts(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for word in _WORD_RE.findall(text.lower()):
+        counts[word] = counts.get(word, 0) + 1
+    return counts
+
+
+class VectorIndex:
+    """Story vectors for one store: memory-mapped files plus an in-memory overlay"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.zeros((0, DIMENSIONS), np.float32)
+        self.ids = np.zeros(0, np.int64)
+        self.users = np.zeros(0, np.int64)
+        self.df = np.zeros(DF_BUCKETS, np.int32)
+        self.doc_count = 0
+        self.last_story_id = 0  # stories after this one are picked up from the database
+        self.stamp = None  # meta.json's (mtime, size) when the files were loaded
+        self.overlay: Dict[int, Tuple[int, np.ndarray]] = {}  # story_id -> (user key, vector)
+        self.superseded: set = set()  # story ids whose file row was deleted or replaced by the overlay
+        self.compacting = False
+        self.lock = threading.Lock()
+
+    # Storage
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _meta_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._file("meta.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> bool:
+        self.stamp = self._meta_stamp()
+        if self.stamp is None:
+            return False
+        with open(self._file("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["dimensions"] != DIMENSIONS:
+            return False  # rebuilt from the database by the caller
+        self.doc_count = meta["doc_count"]
+        self.last_story_id = meta["last_story_id"]
+        self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+        self.ids = np.load(self._file("ids.npy"), mmap_mode="r")
+        self.users = np.load(self._file("users.npy"), mmap_mode="r")
+        self.df = np.load(self._file("df.npy"))
+        return True
+
+    def refresh(self) -> bool:
+        """Load the files again if another process has rewritten them; changes in the overlay are kept"""
+        if self._meta_stamp() == self.stamp:
+            return False
+        fresh = VectorIndex(self.path)
+        if not fresh.load():
+            return False
+        with self.lock:
+            self.vectors, self.ids, self.users = fresh.vectors, fresh.ids, fresh.users
+            self.df, self.doc_count = fresh.df, fresh.doc_count
+            self.last_story_id = max(self.last_story_id, fresh.last_story_id)
+            self.stamp = fresh.stamp
+            self.superseded = {story_id for story_id in self.superseded | set(self.overlay) if self._row(story_id) >= 0}
+        return True
+
+    def _write(self, name: str, data: np.ndarray):
+        tmp = self._file(name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, self._file(name))
+
+    def save(self, vectors: np.ndarray, ids: np.ndarray, users: np.ndarray, df: np.ndarray,
+             doc_count: int, last_story_id: int):
+        """Write a full set of arrays; the meta file goes last so a crash leaves the old index loadable"""
+        os.makedirs(self.path, exist_ok=True)
+        for name, data in (("vectors.npy", vectors), ("ids.npy", ids), ("users.npy", users), ("df.npy", df)):
+            self._write(name, data)
+        with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dimensions": DIMENSIONS, "doc_count": doc_count, "last_story_id": last_story_id}, f)
+
+    # Vectors
+    def count(self, text: str):
+        """Add a new story's words to the document frequencies"""
+        for word in _word_counts(text):
+            self.df[_features(word)[0]] += 1
+        self.doc_count += 1
+
+    def encode(self, text: str) -> np.ndarray:
+        """Unit-length TF-IDF vector of text with the current document frequencies"""
+        weights = [0.0] * DIMENSIONS
+        n = self.doc_count
+        for word, tf in _word_counts(text).items():
+            bucket, slots, signs = _features(word)
+            weight = (1.0 + math.log(tf)) * (math.log((1 + n) / (1 + self.df[bucket])) + 1.0)
+            for slot, sign in zip(slots, signs):
+                weights[slot] += sign * weight
+        vector = np.array(weights, np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _row(self, story_id: int) -> int:
+        row = int(np.searchsorted(self.ids, story_id))
+        return row if row < len(self.ids) and self.ids[row] == story_id else -1
+
+    def vector(self, story_id: int) -> Optional[np.ndarray]:
+        with self.lock:
+            if story_id in self.overlay:
+                return self.overlay[story_id][1]
+            row = self._row(story_id)
+            return None if row < 0 or story_id in self.superseded else np.array(self.vectors[row])
+
+    def add(self, story_id: int, user_id: str, text: str):
+        """Index a new or edited story"""
+        with self.lock:
+            if story_id not in self.overlay and self._row(story_id) < 0:
+                self.count(text)
+            vector = self.encode(text)
+            self.overlay[story_id] = (user_key(user_id), vector)
+            if self._row(story_id) >= 0:
+                self.superseded.add(story_id)
+
+    def remove(self, story_id: int):
+        # Document frequencies only grow; deletes are too rare to skew them
+        with self.lock:
+            self.overlay.pop(story_id, None)
+            if self._row(story_id) >= 0:
+                self.superseded.add(story_id)
+
+    def compact(self):
+        """Merge the overlay into the files
+
+        The merge runs outside the lock on a snapshot; overlay entries
+        written meanwhile stay in the overlay.
+        """
+        with self.lock:
+            if self.compacting or not (self.overlay or self.superseded):
+                return
+            self.compacting = True
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file("compact.lock"), "a") as lock_file:
+                # Other processes compact the same files; start from whatever they wrote last
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.refresh()
+                with self.lock:
+                    overlay, superseded = dict(self.overlay), set(self.superseded)
+                    vectors, ids, users = self.vectors, self.ids, self.users
+                    df, doc_count, last_story_id = self.df.copy(), self.doc_count, self.last_story_id
+
+                keep = np.ones(len(ids), bool)
+                if superseded:
+                    keep &= ~np.isin(ids, np.fromiter(superseded, np.int64))
+                new_ids = np.fromiter(overlay, np.int64, len(overlay))
+                merged_ids = np.concatenate([ids[keep], new_ids])
+                order = np.argsort(merged_ids, kind="stable")
+                merged_vectors = np.concatenate([vectors[keep],
+                                                 np.array([v for _, v in overlay.values()], np.float32)
+                                                 .reshape(len(overlay), DIMENSIONS)])[order]
+                merged_users = np.concatenate([users[keep],
+                                               np.array([u for u, _ in overlay.values()], np.int64)])[order]
+                self.save(merged_vectors, merged_ids[order], merged_users, df, doc_count, last_story_id)
+
+                with self.lock:
+                    self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+                    self.ids = np.load(self._file("ids.npy"), mmap_mode="r")
+                    self.users = np.load(self._file("users.npy"), mmap_mode="r")
+                    self.stamp = self._meta_stamp()
+                    for story_id, entry in overlay.items():
+                        if self.overlay.get(story_id) is entry:
+                            del self.overlay[story_id]
+                    # Rows deleted or edited again during the merge are still superseded
+                    self.superseded = {story_id for story_id in self.superseded - superseded | set(self.overlay)
+                                       if self._row(story_id) >= 0}
+        finally:
+            self.compacting = False
+
+    # Queries
+    def top_k(self, queries: np.ndarray, k: int, owner: Optional[int] = None,
+              exclude: Sequence[int] = ()) -> List[List[Tuple[int, float]]]:
+        """(story_id, cosine) of the k best rows for each query vector, restricted to one user key"""
+        queries = np.asarray(queries, np.float32).reshape(-1, DIMENSIONS)
+        with self.lock:
+            vectors, ids, users = self.vectors, self.ids, self.users
+            overlay = [(story_id, vector) for story_id, (key, vector) in self.overlay.items()
+                       if owner is None or key == owner]
+            hidden = np.fromiter(self.superseded.union(exclude), np.int64)
+
+        rows = np.flatnonzero(users == owner) if owner is not None else np.arange(len(ids))
+        if len(hidden):
+            rows = rows[~np.isin(ids[rows], hidden)]
+
+        found: List[List[Tuple[float, int]]] = [[] for _ in range(len(queries))]
+        for start in range(0, len(rows), CHUNK_ROWS):
+            chunk = rows[start:start + CHUNK_ROWS]
+            span = chunk[-1] - chunk[0] + 1
+            if span <= 4 * len(chunk):
+                # Dense rows: scoring the whole span beats copying the rows out of the memory map
+                scores = (vectors[chunk[0]:chunk[-1] + 1] @ queries.T)[chunk - chunk[0]]
+            else:
+                scores = vectors[chunk] @ queries.T
+            self._collect(found, scores, ids[chunk], k)
+        if overlay:
+            exclude = set(exclude)
+            overlay = [(story_id, vector) for story_id, vector in overlay if story_id not in exclude]
+            if overlay:
+                block = np.array([vector for _, vector in overlay], np.float32)
+                self._collect(found, block @ queries.T, np.array([story_id for story_id, _ in overlay]), k)
+
+        return [[(int(story_id), float(score)) for score, story_id in sorted(hits, reverse=True)[:k]]
+                for hits in found]
+
+    @staticmethod
+    def _collect(found, scores: np.ndarray, ids: np.ndarray, k: int):
+        best = min(k, len(ids))
+        for q, hits in enumerate(found):
+            column = scores[:, q]
+            top = np.argpartition(-column, best - 1)[:best] if best < len(ids) else np.arange(len(ids))
+            hits.extend(zip(column[top].tolist(), ids[top].tolist()))
+
+
+class SimilarityIndexes:
+    """One vector index per store, loaded lazily and kept current by write events"""
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_dir = index_dir
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, db: Database) -> str:
+        return os.path.join(self.index_dir, os.path.splitext(os.path.basename(db.db_name))[0])
+
+    def get(self, db: Database) -> VectorIndex:
+        with self._lock:
+            index = self._indexes.get(db.db_name)
+            if index is None:
+                index = VectorIndex(self._path(db))
+                if not index.load():
+                    index = self._build(db)
+                self._indexes[db.db_name] = index
+            else:
+                index.refresh()
+            self._catch_up(index, db)
+            return index
+
+    def _catch_up(self, index: VectorIndex, db: Database):
+        """Index stories saved since the last one this index has seen, by any process"""
+        for story_id, user_id, content in db.iter_story_texts(after_story_id=index.last_story_id, with_user=True):
+            index.add(story_id, user_id, content)
+            index.last_story_id = story_id
+        self._compact_if_due(index)
+
+    @staticmethod
+    def _compact_if_due(index: VectorIndex):
+        if len(index.overlay) >= COMPACT_AFTER_ROWS and not index.compacting:
+            threading.Thread(target=index.compact, daemon=True).start()
+
+    def _build(self, db: Database) -> VectorIndex:
+        """Index every story: one pass for document frequencies, one for the vectors"""
+        index = VectorIndex(self._path(db))
+        for _, content in db.iter_story_texts():
+            index.count(content)
+        os.makedirs(index.path, exist_ok=True)
+        build_file = index._file("vectors.build.npy")
+        vectors = np.lib.format.open_memmap(build_file, mode="w+", dtype=np.float32,
+                                            shape=(index.doc_count, DIMENSIONS)) \
+            if index.doc_count else np.zeros((0, DIMENSIONS), np.float32)
+        ids, users = np.zeros(index.doc_count, np.int64), np.zeros(index.doc_count, np.int64)
+        rows = 0
+        for story_id, user_id, content in db.iter_story_texts(with_user=True):
+            if rows == index.doc_count:
+                break  # saved during the build; picked up by the catch-up
+            vectors[rows], ids[rows], users[rows] = index.encode(content), story_id, user_key(user_id)
+            rows += 1
+        last_story_id = int(ids[rows - 1]) if rows else 0
+        index.save(vectors[:rows], ids[:rows], users[:rows], index.df, index.doc_count, last_story_id)
+        del vectors
+        if index.doc_count:
+            os.remove(build_file)
+        index.load()
+        return index
+
+    def rebuild(self, db: Database) -> VectorIndex:
+        with self._lock:
+            index = self._build(db)
+            self._indexes[db.db_name] = index
+            return index
+
+    def similar_stories(self, db: Database, story_id: int, user_id: str, k: int = 5) -> List[Dict]:
+        """The user's k stories closest to this one, most similar first"""
+        # Lookups here don't count as opening the stories, which would keep them out of the archive
+        if not db.get_story_summaries([story_id], user_id):
+            return []
+        index = self.get(db)
+        vector = index.vector(story_id)
+        if vector is None:
+            story = db.get_story(story_id, user_id, touch=False)
+            if not story:
+                return []
+            vector = index.encode(story['content'])
+        hits = index.top_k(vector, k + 5, user_key(user_id), exclude=[story_id])[0]
+
+        # Rows deleted by another process are skipped here
+        summaries = db.get_story_summaries([hit_id for hit_id, _ in hits], user_id)
+        results = [dict(summaries[hit_id], similarity=score) for hit_id, score in hits if hit_id in summaries]
+        return results[:k]
+
+    def on_write(self, db: Database, event: str, user_id: str, old: Optional[Dict], new: Optional[Dict]):
+        """Apply a story write to an already-loaded index (unloaded ones catch up when first used)"""
+        index = self._indexes.get(db.db_name)
+        if index is None:
+            return
+        if event == 'save':
+            index.add(new['story_id'], user_id, new['content'])
+        elif event in ('update', 'chapter', 'chapter_update') and (old or {}).get('content') != new.get('content'):
+            story = db.get_story(new['story_id'], user_id, touch=False)
+            if story:
+                index.add(story['story_id'], user_id, story['content'])
+        elif event == 'delete':
+            index.remove(old['story_id'])
+        self._compact_if_due(index)
+
+
+similarity_indexes = SimilarityIndexes()
+register_write_listener(similarity_indexes.on_write)
+
+
+if __name__ == "__main__":
+    import time
+
+    from database import open_database
+
+    start = time.perf_counter()
+    built = similarity_indexes.rebuild(open_database())
+    print(f"indexed {len(built.ids)} stories in {time.perf_counter() - start:.1f}s -> {built.path}")
@@ -0,0 +1,320 @@
+"""Persistent generation telemetry
+
+Every generate_story call emits one event (model, path, latency, requested
+vs produced words, tokens, error class). emit() only puts the event on a
+bounded queue; a background thread writes events to telemetry.db in
+batches and, in the same transaction, folds them into daily rollup tables
+so the admin page never scans raw events:
+
+- generation_daily: counts and sums per day, genre, source, model, error class
+- generation_daily_latency: latency histogram per day, genre and source
+"""
+import atexit
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from metrics import registry
+
+TELEMETRY_DB = os.getenv("TELEMETRY_DB", "telemetry.db")
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 2.0   # seconds an event may wait in the queue
+MAX_QUEUE = 10_000     # events beyond this are dropped rather than blocking generation
+EVENT_RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "30"))  # raw events; rollups are kept
+
+# Failure messages from the backends, mapped to a short error class
+ERROR_CLASSES = [
+    ("Rate limited", "rate_limited"),
+    ("timeout", "timeout"),
+    ("Service unavailable", "unavailable"),
+    ("Busy", "busy"),
+    ("Low quality", "low_quality"),
+    ("No HF_TOKEN", "no_token"),
+    ("Forbidden", "forbidden"),
+    ("deprecated", "deprecated"),
+    ("Empty response", "empty"),
+    ("Not enough", "untrained"),
+    ("HTTP error", "http_error"),
+    ("Error:", "exception"),
+]
+
+dropped_events = registry.counter("storygen_telemetry_dropped_total", "Telemetry events dropped", ("reason",))
+
+
+def error_class(message: Optional[str]) -> Optional[str]:
+    if not message:
+        return None
+    for prefix, name in ERROR_CLASSES:
+        if prefix.lower() in message.lower():
+            return name
+    return "other"
+
+
+def latency_bucket(latency: float) -> int:
+    """Half-octave buckets in milliseconds: bucket b holds latencies up to 2 ** (b / 2) ms"""
+    return max(0, math.ceil(2 * math.log2(max(latency * 1000, 1.0))))
+
+
+def bucket_upper_bound(bucket: int) -> float:
+    """Upper edge of a latency bucket, in seconds"""
+    return 2 ** (bucket / 2) / 1000
+
+
+class Telemetry:
+    """Buffered event writer plus queries over the rollup tables"""
+
+    def __init__(self, db_path: str = TELEMETRY_DB, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, max_queue: int = MAX_QUEUE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.init_db()
+
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        conn = self.get_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS generation_events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts TEXT NOT NULL,
+                day TEXT NOT NULL,
+                model TEXT,
+                source TEXT NOT NULL,
+                genre TEXT,
+                latency REAL NOT NULL,
+                requested_words INTEGER,
+                produced_words INTEGER,
+                tokens INTEGER,
+                error_class TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_generation_events_day ON generation_events(day);
+
+            CREATE TABLE IF NOT EXISTS generation_daily (
+                day TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                source TEXT NOT NULL,
+                model TEXT NOT NULL,
+                error_class TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                latency_sum REAL NOT NULL,
+                requested_words INTEGER NOT NULL,
+                produced_words INTEGER NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (day, genre, source, model, error_class)
+            );
+
+            CREATE TABLE IF NOT EXISTS generation_daily_latency (
+                day TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                source TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day, genre, source, bucket)
+            );
+        ''')
+        conn.commit()
+        conn.close()
+
+    # Writing
+    def emit(self, source: str, latency: float, genre: Optional[str] = None, model: Optional[str] = None,
+             requested_words: Optional[int] = None, produced_words: Optional[int] = None,
+             tokens: Optional[int] = None, error: Optional[str] = None):
+        """Queue one generation event; never blocks"""
+        now = datetime.now(timezone.utc)
+        event = (now.isoformat(timespec="seconds"), now.date().isoformat(), model, source, genre, latency,
+                 requested_words, produced_words, tokens, error_class(error))
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            dropped_events.inc(reason="queue_full")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Write everything queued so far; returns False if the writer did not finish in time"""
+        if self._thread is None:
+            return True
+        self._ensure_thread()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self.get_connection()
+        batch: List[tuple] = []
+        deadline = 0.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, threading.Event):
+                self._write(conn, batch)
+                batch = []
+                item.set()
+                continue
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.batch_size):
+                self._write(conn, batch)
+                batch = []
+
+    def _write(self, conn: sqlite3.Connection, events: List[tuple]):
+        """Insert raw events and fold them into the daily rollups in one transaction"""
+        if not events:
+            return
+        daily: Dict[tuple, List] = {}
+        latency: Dict[tuple, int] = {}
+        for ts, day, model, source, genre, seconds, requested, produced, tokens, error in events:
+            key = (day, genre or "", source, model or "", error or "")
+            totals = daily.setdefault(key, [0, 0.0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += requested or 0
+            totals[3] += produced or 0
+            totals[4] += tokens or 0
+            bucket_key = (day, genre or "", source, latency_bucket(seconds))
+            latency[bucket_key] = latency.get(bucket_key, 0) + 1
+
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO generation_events (ts, day, model, source, genre, latency,
+                                                   requested_words, produced_words, tokens, error_class)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', events)
+                conn.executemany('''
+                    INSERT INTO generation_daily VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (day, genre, source, model, error_class) DO UPDATE SET
+                        count = count + excluded.count,
+                        latency_sum = latency_sum + excluded.latency_sum,
+                        requested_words = requested_words + excluded.requested_words,
+                        produced_words = produced_words + excluded.produced_words,
+                        tokens = tokens + excluded.tokens
+                ''', [key + tuple(totals) for key, totals in daily.items()])
+                conn.executemany('''
+                    INSERT INTO generation_daily_latency VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (day, genre, source, bucket) DO UPDATE SET count = count + excluded.count
+                ''', [key + (count,) for key, count in latency.items()])
+        except sqlite3.Error:
+            dropped_events.inc(len(events), reason="write_error")
+            return
+
+        if time.monotonic() - self._last_prune > 3600:
+            self._last_prune = time.monotonic()
+            try:
+                self.prune(conn)
+            except sqlite3.Error:
+                pass  # tried again in an hour; the events above are already committed
+
+    def prune(self, conn: Optional[sqlite3.Connection] = None, days: int = EVENT_RETENTION_DAYS):
+        """Delete raw events older than the retention window (rollups are kept)"""
+        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+        own = conn is None
+        conn = conn or self.get_connection()
+        with conn:
+            conn.execute('DELETE FROM generation_events WHERE day < ?', (cutoff,))
+        if own:
+            conn.close()
+
+    # Reading (rollup tables only)
+    def _since(self, days: int) -> str:
+        return (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+
+    def daily_summary(self, days: int = 7) -> List[Dict]:
+        """Per day and source: stories, errors before success, mean latency, words and tokens"""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT day, source, SUM(count) AS stories,
+                   SUM(CASE WHEN error_class != '' THEN count ELSE 0 END) AS fell_through,
+                   SUM(latency_sum) / SUM(count) AS mean_latency,
+                   SUM(requested_words) AS requested_words, SUM(produced_words) AS produced_words,
+                   SUM(tokens) AS tokens
+            FROM generation_daily
+            WHERE day >= ?
+            GROUP BY day, source
+            ORDER BY day DESC, stories DESC
+        ''', (self._since(days),)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def source_share(self, days: int = 7) -> Dict[str, float]:
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT source, SUM(count) FROM generation_daily WHERE day >= ? GROUP BY source
+        ''', (self._since(days),)).fetchall()
+        conn.close()
+        total = sum(count for _, count in rows)
+        return {source: count / total for source, count in rows} if total else {}
+
+    def error_breakdown(self, days: int = 7) -> List[Dict]:
+        """Why the first backend failed, and which path served the story instead"""
+        conn = self.get_connection()
+        rows = conn.execute('''
+            SELECT error_class, source AS served_by, SUM(count) AS count FROM generation_daily
+            WHERE day >= ? AND error_class != ''
+            GROUP BY error_class, source ORDER BY count DESC
+        ''', (self._since(days),)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def latency_quantiles(self, days: int = 7, by: str = "genre",
+                          quantiles=(0.5, 0.95, 0.99)) -> List[Dict]:
+        """Latency quantiles (upper bucket edges, in seconds) grouped by genre or source"""
+        if by not in ("genre", "source"):
+            raise ValueError("by must be 'genre' or 'source'")
+        conn = self.get_connection()
+        rows = conn.execute(f'''
+            SELECT {by} AS grp, bucket, SUM(count) FROM generation_daily_latency
+            WHERE day >= ? GROUP BY grp, bucket ORDER BY grp, bucket
+        ''', (self._since(days),)).fetchall()
+        conn.close()
+
+        histograms: Dict[str, List[tuple]] = {}
+        for group, bucket, count in rows:
+            histograms.setdefault(group, []).append((bucket, count))
+        result = []
+        for group, buckets in histograms.items():
+            total = sum(count for _, count in buckets)
+            entry = {by: group or "(none)", "stories": total}
+            for q in quantiles:
+                seen = 0
+                for bucket, count in buckets:
+                    seen += count
+                    if seen >= q * total:
+                        entry[f"p{round(q * 100)}"] = bucket_upper_bound(bucket)
+                        break
+            result.append(entry)
+        return result
+
+
+telemetry = Telemetry()
+atexit.register(telemetry.flush, 2.0)
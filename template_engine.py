@@ -0,0 +1,192 @@
+"""Genre-aware template engine for the local story generator
+
+Sentence and fragment libraries live in templates/<genre>.json and are
+compiled once at import time. Every template is pre-split into words with
+its slot positions recorded, so a story's length is known from a table
+lookup and it can be assembled to an exact word count without any
+split/join/trim passes over the finished text.
+"""
+import json
+import os
+import random
+import re
+from typing import Dict, List, Optional, Tuple
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+DEFAULT_GENRE = "Fantasy"
+
+_SLOT_RE = re.compile(r"\{(\w+)\}")
+
+
+class CompiledTemplate:
+    """A sentence split into static words and (slot, capitalize, prefix, suffix) pieces"""
+    __slots__ = ("pieces", "static_words", "slots")
+
+    def __init__(self, text: str):
+        pieces = []
+        slots = []
+        for token in text.split():
+            match = _SLOT_RE.search(token)
+            if not match:
+                pieces.append(token)
+                continue
+            name = match.group(1)
+            key = name.lower()
+            pieces.append((key, name[0].isupper(), token[:match.start()], token[match.end():]))
+            slots.append(key)
+        self.pieces = tuple(pieces)
+        self.static_words = len(pieces) - len(slots)
+        self.slots = tuple(slots)
+
+    def length(self, bindings: Dict[str, Tuple[str, ...]]) -> int:
+        return self.static_words + sum(len(bindings[key]) for key in self.slots)
+
+    def render_into(self, out: List[str], bindings: Dict[str, Tuple[str, ...]]):
+        for piece in self.pieces:
+            if piece.__class__ is str:
+                out.append(piece)
+                continue
+            key, capitalize, prefix, suffix = piece
+            words = bindings[key]
+            if capitalize:
+                words = (words[0][:1].upper() + words[0][1:],) + words[1:]
+            if len(words) == 1:
+                out.append(prefix + words[0] + suffix)
+            else:
+                out.append(prefix + words[0])
+                out.extend(words[1:-1])
+                out.append(words[-1] + suffix)
+
+
+class GenreLibrary:
+    """Compiled templates and fragments for one genre"""
+
+    def __init__(self, data: Dict):
+        self.genre = data["genre"]
+        self.guidance = data.get("guidance", "")
+        self.fragments = {
+            key: [tuple(value.split()) for value in values]
+            for key, values in data["fragments"].items()
+        }
+        self.per_sentence = set(data.get("per_sentence", []))
+        self.openings = [CompiledTemplate(t) for t in data["openings"]]
+        self.middles = [CompiledTemplate(t) for t in data["middles"]]
+        self.closings = [CompiledTemplate(t) for t in data["closings"]]
+        self.fillers = [CompiledTemplate(t) for t in data["fillers"]]
+        self.fill_table = self._build_fill_table()
+
+    def _build_fill_table(self) -> List[Optional[Tuple[int, ...]]]:
+        """fill_table[n] is the fewest fillers (by index) totalling n words, or None"""
+        max_middle = max(t.static_words for t in self.middles) + 16
+        size = 2 * max_middle + 1
+        table: List[Optional[Tuple[int, ...]]] = [None] * size
+        table[0] = ()
+        for n in range(1, size):
+            best = None
+            for index, filler in enumerate(self.fillers):
+                rest = n - filler.static_words
+                if rest >= 0 and table[rest] is not None and index not in table[rest]:
+                    if best is None or len(table[rest]) + 1 < len(best):
+                        best = table[rest] + (index,)
+            table[n] = best
+        return table
+
+    def bind(self, prompt_words: Tuple[str, ...], rng: random.Random) -> Dict[str, Tuple[str, ...]]:
+        """Pick one value per fragment slot for the whole story"""
+        bindings = {key: rng.choice(values) for key, values in self.fragments.items()}
+        bindings["prompt"] = prompt_words
+        return bindings
+
+    def compose(self, prompt: str, target_words: int, rng: random.Random) -> str:
+        prompt_words = tuple(prompt.split()) or ("the", "story")
+        bindings = self.bind(prompt_words, rng)
+
+        def sentence(templates):
+            """Choose a template, re-drawing per-sentence fragments, and return it with its bindings"""
+            template = rng.choice(templates) if isinstance(templates, list) else templates
+            local = bindings
+            if self.per_sentence.intersection(template.slots):
+                local = dict(bindings)
+                for key in self.per_sentence:
+                    local[key] = rng.choice(self.fragments[key])
+            return template, local
+
+        opening = sentence(self.openings)
+        closing = sentence(self.closings)
+        budget = target_words - opening[0].length(opening[1]) - closing[0].length(closing[1])
+
+        # Middles keep their narrative order; longer stories loop through the arc again
+        middles = []
+        used = 0
+        position = rng.randrange(2)
+        while budget > 0:
+            chosen = sentence(self.middles[position % len(self.middles)])
+            length = chosen[0].length(chosen[1])
+            if used + length > budget:
+                break
+            middles.append(chosen)
+            used += length
+            position += 1 + (rng.random() < 0.25)  # occasionally skip a beat for variety
+
+        # Close the gap exactly with short fillers, giving back a middle if the gap is unfillable
+        remainder = budget - used
+        while middles and (remainder >= len(self.fill_table) or self.fill_table[remainder] is None):
+            template, local = middles.pop()
+            remainder += template.length(local)
+
+        out: List[str] = []
+        if budget < 0:
+            # Prompt too long for the target: cut the opening and closing
+            opening[0].render_into(out, opening[1])
+            closing[0].render_into(out, closing[1])
+            return " ".join(out[:target_words])
+
+        if remainder >= len(self.fill_table) or self.fill_table[remainder] is None:
+            # Too short to fill exactly: cut the last middle sentence short instead
+            opening[0].render_into(out, opening[1])
+            limit = len(out) + budget
+            position = 0
+            while len(out) < limit:
+                template, local = sentence(self.middles[position % len(self.middles)])
+                template.render_into(out, local)
+                position += 1
+            del out[limit:]
+            closing[0].render_into(out, closing[1])
+            return " ".join(out)
+
+        fillers = list(self.fill_table[remainder])
+        slots = sorted(rng.randrange(len(middles) + 1) for _ in fillers)
+
+        opening[0].render_into(out, opening[1])
+        for index, (template, local) in enumerate(middles):
+            while slots and slots[0] == index:
+                slots.pop(0)
+                self.fillers[fillers.pop()].render_into(out, bindings)
+            template.render_into(out, local)
+        for filler in fillers:
+            self.fillers[filler].render_into(out, bindings)
+        closing[0].render_into(out, closing[1])
+
+        return " ".join(out)
+
+
+def load_libraries(directory: str = TEMPLATE_DIR) -> Dict[str, GenreLibrary]:
+    libraries = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                library = GenreLibrary(json.load(f))
+            libraries[library.genre] = library
+    return libraries
+
+
+LIBRARIES = load_libraries()
+GENRE_PROMPTS = {genre: library.guidance for genre, library in LIBRARIES.items()}
+
+_rng = random.Random()
+
+
+def compose_story(prompt: str, genre: str, target_words: int, rng: Optional[random.Random] = None) -> str:
+    """Assemble a story of exactly target_words words in the given genre"""
+    library = LIBRARIES.get(genre) or LIBRARIES[DEFAULT_GENRE]
+    return library.compose(prompt, max(target_words, 1), rng or _rng)